@@ -1,11 +1,14 @@
 import os
+import re
 import time
+import hashlib
 import json
 import math
 import argparse
 import subprocess
 import shutil
 import sys
+import threading
 from copy import deepcopy
 from itertools import product
 from concurrent.futures import ThreadPoolExecutor
@@ -19,6 +22,7 @@ from util.mvs.vm_manage import *
 from util.mns import *
 from util.common import *
 from util.remote import *
+from util.async_remote import AsyncRemoteExecutor, print_host_results
 from util.topo_util import *
 from util.factor import *
 
@@ -33,9 +37,18 @@ PM_CONFIG_PATH = os.path.join(COORDINATOR_CONFIG_DIR, "pm_config.json")
 EXP_CONFIG_PATH = os.path.join(COORDINATOR_CONFIG_DIR, "exp_config.json")
 SERVER_CONFIG_FILENAME = "server_config.json"
 AGENT_BIN_PATH = "bin/splitnn_agent"
+# The agent is built once on the coordinator and its binaries are pushed to the VMs
+LOCAL_AGENT_DIR = os.path.join(os.path.dirname(COORDINATOR_WORKDIR), "agent")
+AGENT_BINARY_PATHS = [AGENT_BIN_PATH, "bin/cctr", "bin/goctr"]
+AGENT_BUILD_CMD = "export GOPROXY=https://goproxy.cn,direct && make"
+ELF_MACHINES = {3: "i686", 40: "armv7l", 62: "x86_64", 183: "aarch64", 243: "riscv64"} # ELF e_machine -> uname -m
 AGENT_TOPO_DIR = "tmp/topo"
 LOCAL_RESULT_DIR = "raw_results"
 SERVER_RESULTS_DIR = "server_results"
+SETUP_LOG_DIR = "setup_logs"
+INVALID_TEST_FILENAME = "invalid.txt" # Written into the log directory of a test whose setup failed
+AGENT_SETUP_TIMEOUT = 3 * 3600 # Seconds before a setup command is given up
+SETUP_PROGRESS_INTERVAL = 5 # Seconds between two reports of the setup progress
 LOCAL_TOPO_DIR = os.path.join(COORDINATOR_WORKDIR, "topo")
 REMOTE_RESULT_PATHS = [
     ("file", "tmp/setup_log.txt"),
@@ -59,6 +72,12 @@ parser.add_argument(
 parser.add_argument(
     '-k', '--fixed-bbns-num', type=int, default=0,
     help='The BBNS number used per VM. If set to 0, use the optimal BBNS number; if set > 0, use the fixed BBNS number')
+parser.add_argument(
+    '-p', '--prev-partition', type=str, default=None,
+    help=f'The {PARTITION_FILENAME} of an earlier test. If set, the first test is partitioned incrementally from it')
+parser.add_argument(
+    '-i', '--incremental', action='store_true',
+    help='Partition every test incrementally from the partition of the test run before it')
 args = parser.parse_args()
 
 FIXED_VM_NUM_PER_PM = args.fixed_vm_num # If set to 0, use the optimal VM number; if set > 0, use the fixed VM number
@@ -70,6 +89,9 @@ assert FIXED_M >= 0
 assert not (FIXED_VM_NUM_PER_PM == 0 and FIXED_M > 0)
 assert FIXED_BBNS_NUM >= 0
 
+PREV_PARTITION_FILEPATH = args.prev_partition
+INCREMENTAL_PARTITIONING = args.incremental
+
 ######################### Agent options ############################
 
 const_options = {
@@ -175,29 +197,203 @@ var_options = {
 # ]
 
 ######################### SSH Helper functions ############################
-
-def connect_remote_machines(machine_config_list):
-    remote_machines = []
-    for mach in machine_config_list:
-        remote_machine = RemoteMachine(
-            mach["ipAddr"], mach["user"], mach["password"])
-        machine = remote_machine.connect()
-        remote_machines.append(machine)
-    return remote_machines
+# With a vm_executor (AsyncRemoteExecutor), VMs are driven from its event loop instead of one thread per VM
+
+def connect_remote_vms(vm_config_list, vm_executor=None):
+    """Returns the RemoteMachine of each VM, None for the VMs that could not be connected."""
+    if vm_executor is None:
+        return connect_remote_machines(vm_config_list)
+    remote_vms = [RemoteMachine(vm["ipAddr"], vm["user"], vm["password"]) for vm in vm_config_list]
+    results = vm_executor.connect_to_multiple_machines(remote_vms)
+    print_host_results(results, "SSH connection")
+    return [remote_vm if results[remote_vm.hostname]["error"] is None else None for remote_vm in remote_vms]
+
+
+def execute_command_on_vms(remote_vms, commands, vm_executor=None):
+    """Returns {ipAddr: (exit_status, stdout)}, the exit status is None if the command could not be run."""
+    if vm_executor is None:
+        return execute_command_on_multiple_machines(remote_vms, commands)
+    results = vm_executor.execute_command_on_multiple_machines(remote_vms, commands)
+    print_host_results(results, "Command")
+    return {hostname: (result["exit_status"], result["stdout"]) for hostname, result in results.items()}
+
+
+def exit_on_failed_commands(results, label):
+    """Exits if the command failed on some machine of {ipAddr: (exit_status, stdout)}."""
+    failed = {ipAddr: exit_status for ipAddr, (exit_status, _) in results.items() if exit_status != 0}
+    if failed:
+        print(f"{label} failed on {len(failed)} machines, exiting...")
+        for ipAddr, exit_status in sorted(failed.items()):
+            print(f"{ipAddr}: {'could not run the command' if exit_status is None else f'exit status {exit_status}'}")
+        exit(1)
+
+
+def send_file_to_vms(remote_vms, file_paths, vm_executor=None):
+    if vm_executor is None:
+        return send_file_to_multiple_machines(remote_vms, file_paths)
+    results = vm_executor.send_file_to_multiple_machines(remote_vms, file_paths)
+    print_host_results(results, "File transfer")
+    return results
+
+
+def stream_command_on_vms(remote_vms, commands, log_dir, line_callback=None, timeout=None, vm_executor=None):
+    """Returns the exit status of each VM, None where the command timed out or could not be run."""
+    if vm_executor is None:
+        return stream_command_on_multiple_machines(remote_vms, commands, log_dir, line_callback, timeout)
+    results = vm_executor.stream_command_on_multiple_machines(remote_vms, commands, log_dir, line_callback, timeout)
+    print_host_results(results, "Command")
+    return {hostname: result["exit_status"] for hostname, result in results.items()}
+
+
+def receive_paths_from_vms(remote_vms, path_lists, vm_executor=None):
+    if vm_executor is None:
+        return receive_paths_from_multiple_machines(remote_vms, path_lists)
+    results = vm_executor.receive_paths_from_multiple_machines(remote_vms, path_lists)
+    print_host_results(results, "File reception")
+    return results
+
+
+def build_agent_locally():
+    """Builds the agent on the coordinator, returns the sha256 of each of its binaries."""
+    print("Building agent on the coordinator...")
+    cur_ts = time.time()
+    proc = subprocess.run(AGENT_BUILD_CMD, shell=True, cwd=LOCAL_AGENT_DIR)
+    if proc.returncode != 0:
+        print(f"Failed to build agent in {LOCAL_AGENT_DIR} (exit status {proc.returncode}), exiting...")
+        exit(1)
+    agent_hashes = {}
+    for binary_path in AGENT_BINARY_PATHS:
+        digest = hashlib.sha256()
+        with open(os.path.join(LOCAL_AGENT_DIR, binary_path), 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        agent_hashes[binary_path] = digest.hexdigest()
+    print(f"Agent built in {time.time() - cur_ts:.2f}s: {agent_hashes}")
+    return agent_hashes
+
+
+def get_binary_target(binary_filepath):
+    """Returns (uname -m machine, highest GLIBC version required or None) of an ELF binary."""
+    with open(binary_filepath, 'rb') as f:
+        data = f.read()
+    if data[:4] != b"\x7fELF":
+        print(f"{binary_filepath} is not an ELF binary, exiting...")
+        exit(1)
+    e_machine = int.from_bytes(data[18:20], "little" if data[5] == 1 else "big")
+    glibc_versions = [tuple(int(x) for x in version.split(b".")) for version in
+                      re.findall(rb"GLIBC_(\d+(?:\.\d+)+)", data)]
+    return ELF_MACHINES.get(e_machine, f"e_machine {e_machine}"), max(glibc_versions, default=None)
+
+
+def check_agent_target_on_vms(remote_machines, server_config_list, vm_executor=None):
+    """Exits if the agent binaries built on the coordinator can not run on some VM (architecture or glibc)."""
+    binary_targets = {binary_path: get_binary_target(os.path.join(LOCAL_AGENT_DIR, binary_path))
+                      for binary_path in AGENT_BINARY_PATHS}
+    results = execute_command_on_vms(
+        remote_machines, {
+            server["ipAddr"]: (
+                "uname -m; getconf GNU_LIBC_VERSION 2>/dev/null; true", server["agentWorkDir"], None, False
+            ) for server in server_config_list
+        }, vm_executor
+    )
+    mismatches = {}
+    for server in server_config_list:
+        ipAddr = server["ipAddr"]
+        exit_status, output = results.get(ipAddr, (None, ""))
+        lines = output.split("\n") if exit_status == 0 else []
+        if not lines or not lines[0].strip():
+            mismatches[ipAddr] = "could not get its architecture"
+            continue
+        machine = lines[0].strip()
+        libc_fields = lines[1].split() if len(lines) > 1 else []
+        # "glibc 2.31", nothing on musl
+        vm_glibc = tuple(int(x) for x in libc_fields[1].split(".")) \
+            if len(libc_fields) == 2 and libc_fields[0] == "glibc" else None
+        for binary_path, (binary_machine, binary_glibc) in binary_targets.items():
+            if binary_machine != machine:
+                mismatches[ipAddr] = f"{binary_path} is built for {binary_machine}, the VM is {machine}"
+            elif binary_glibc is not None and (vm_glibc is None or vm_glibc < binary_glibc):
+                mismatches[ipAddr] = f"{binary_path} needs glibc {'.'.join(map(str, binary_glibc))}, " \
+                    f"the VM has {'.'.join(map(str, vm_glibc)) if vm_glibc else 'no glibc'}"
+    if mismatches:
+        print(f"The agent built on the coordinator can not run on {len(mismatches)} VMs, exiting...")
+        for ipAddr, reason in sorted(mismatches.items()):
+            print(f"{ipAddr}: {reason}")
+        exit(1)
+
+
+def get_agent_hashes_on_vms(remote_machines, server_config_list, vm_executor=None):
+    """Returns {ipAddr: {binary path: sha256}} of the agent binaries present on each VM."""
+    binary_paths = ' '.join(AGENT_BINARY_PATHS)
+    results = execute_command_on_vms(
+        remote_machines, {
+            server["ipAddr"]: (
+                f"mkdir -p bin && sha256sum {binary_paths} 2>/dev/null; true", server["agentWorkDir"], None, False
+            ) for server in server_config_list
+        }, vm_executor
+    )
+    vm_agent_hashes = {}
+    exit_on_failed_commands(results, "Reading the agent hashes")
+    for ipAddr, (_, output) in results.items():
+        vm_agent_hashes[ipAddr] = {}
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) == 2:
+                vm_agent_hashes[ipAddr][fields[1]] = fields[0]
+    return vm_agent_hashes
+
+
+def distribute_agent_to_vms(remote_machines, server_config_list, agent_hashes, vm_executor=None):
+    """Pushes the locally built agent binaries to the VMs that do not have them already."""
+    check_agent_target_on_vms(remote_machines, server_config_list, vm_executor)
+    vm_agent_hashes = get_agent_hashes_on_vms(remote_machines, server_config_list, vm_executor)
+    ipAddr2server = {server["ipAddr"]: server for server in server_config_list}
+    ipAddr2outdated = {
+        ipAddr: [binary_path for binary_path, sha256 in agent_hashes.items()
+                 if vm_agent_hashes.get(ipAddr, {}).get(binary_path) != sha256]
+        for ipAddr in ipAddr2server
+    }
+    ipAddr2outdated = {ipAddr: outdated for ipAddr, outdated in ipAddr2outdated.items() if outdated}
+    print(f"Agent up to date on {len(ipAddr2server) - len(ipAddr2outdated)} VMs, "
+          f"pushing to {len(ipAddr2outdated)} VMs...")
+
+    # Push each binary next to its destination, then make them executable and move them into place at once
+    for binary_path in AGENT_BINARY_PATHS:
+        binary_src_dst_paths = {
+            ipAddr: (
+                os.path.join(LOCAL_AGENT_DIR, binary_path),
+                os.path.join(ipAddr2server[ipAddr]["agentWorkDir"], f"{binary_path}.new"),
+                False
+            ) for ipAddr, outdated in ipAddr2outdated.items() if binary_path in outdated
+        }
+        if binary_src_dst_paths:
+            send_file_to_vms(remote_machines, binary_src_dst_paths, vm_executor)
+    if ipAddr2outdated:
+        results = execute_command_on_vms(
+            remote_machines, {
+                ipAddr: (
+                    ' && '.join(f"chmod +x {binary_path}.new && mv -f {binary_path}.new {binary_path}"
+                               for binary_path in outdated),
+                    ipAddr2server[ipAddr]["agentWorkDir"], None, False
+                ) for ipAddr, outdated in ipAddr2outdated.items()
+            }, vm_executor
+        )
+        exit_on_failed_commands(results, "Installing the agent")
 
 
 def prepare_env_on_remote_servers(
-    remote_machines, server_config_filepath, server_config_list):
+    remote_machines, server_config_filepath, server_config_list, agent_hashes, vm_executor=None):
 
     # Synchronize code
     print("Synchronizing code...")
-    execute_command_on_multiple_machines(
+    results = execute_command_on_vms(
         remote_machines, {
             server["ipAddr"]: (
                 "./sync_code.sh master", os.path.join(server["agentWorkDir"], ".."), None, False
             ) for server in server_config_list
-        }
+        }, vm_executor
     )
+    exit_on_failed_commands(results, "Synchronizing code")
 
     # Distribute vm_config.json onto each VM as server_config.json 
     print("Distributing vm_config.json (server_config.json)...")
@@ -208,18 +404,14 @@ def prepare_env_on_remote_servers(
             False
         ) for server in server_config_list
     }
-    send_file_to_multiple_machines(
-        remote_machines, server_config_src_dst_paths)
+    send_file_to_vms(
+        remote_machines, server_config_src_dst_paths, vm_executor)
 
-    # Recompile agent on all machines
-    print("Building agent on VMs...")
-    execute_command_on_multiple_machines(
-        remote_machines, {
-            server["ipAddr"]: (
-                "export GOPROXY=https://goproxy.cn,direct && make", server["agentWorkDir"], None, False
-            ) for server in server_config_list
-        }
-    )
+    # Distribute the agent built on the coordinator
+    print("Distributing agent to VMs...")
+    cur_ts = time.time()
+    distribute_agent_to_vms(remote_machines, server_config_list, agent_hashes, vm_executor)
+    print(f"Agent distribution consumes {time.time() - cur_ts:.2f}s")
 
     # # Prepare docker images on VMs
     # print("Preparing docker images on VMs...")
@@ -244,12 +436,13 @@ def get_mem_usage_of_all_pms(remote_pms, pm_config_list):
             ) for server in pm_config_list
         }
     )
-    mem_results = {ipAddr2pmid[ipAddr]: int(result) for ipAddr, result in results.items()}
+    exit_on_failed_commands(results, "Reading the memory usage")
+    mem_results = {ipAddr2pmid[ipAddr]: int(output) for ipAddr, (_, output) in results.items()}
     return mem_results
 
 ######################### Topology Helper functions ############################
 
-def distribute_sub_topo_to_vms(topo, full_topo_filepath, remote_vms, vm_config_list):
+def distribute_sub_topo_to_vms(topo, full_topo_filepath, remote_vms, vm_config_list, vm_executor=None):
     # Send sub-topo to servers
     sub_topo_src_dst_filepaths = {}
     for i, server in enumerate(vm_config_list):
@@ -258,8 +451,8 @@ def distribute_sub_topo_to_vms(topo, full_topo_filepath, remote_vms, vm_config_l
         sub_topo_dst_filepath = os.path.join(server["agentWorkDir"], AGENT_TOPO_DIR, sub_topo_filename)
         sub_topo_src_dst_filepaths[server["ipAddr"]] = \
             (sub_topo_src_filepath, sub_topo_dst_filepath, False)
-    send_file_to_multiple_machines(
-        remote_vms, sub_topo_src_dst_filepaths)
+    send_file_to_vms(
+        remote_vms, sub_topo_src_dst_filepaths, vm_executor)
 
 ###################### Test Command Helper functions #########################
 
@@ -302,6 +495,46 @@ def generate_agent_commands(
 
     return setup_commands, clean_commands
 
+class SetupProgress:
+    """
+    Line callback of the setup commands, turning the link progress reports of the agents
+    ("<p>% links are added, ...") into the overall links added and the link setup rate.
+    """
+    LINK_PROGRESS_PATTERN = re.compile(r"(\d+)% links are added")
+
+    def __init__(self, hostname2linknum, report_interval=SETUP_PROGRESS_INTERVAL):
+        self.hostname2linknum = hostname2linknum
+        self.hostname2linkdone = {hostname: 0 for hostname in hostname2linknum}
+        self.report_interval = report_interval
+        self.lock = threading.Lock()
+        self.start_ts = self.last_report_ts = time.time()
+        self.last_report_link_num = 0
+
+    def __call__(self, hostname, stream, line):
+        match = self.LINK_PROGRESS_PATTERN.search(line)
+        if match:
+            link_done = self.hostname2linknum.get(hostname, 0) * int(match.group(1)) // 100
+        elif line.startswith("Link setup time:"):
+            link_done = self.hostname2linknum.get(hostname, 0)
+        else:
+            return
+        with self.lock:
+            self.hostname2linkdone[hostname] = link_done
+            if time.time() - self.last_report_ts >= self.report_interval:
+                self.report()
+
+    def report(self):
+        cur_ts = time.time()
+        link_num = sum(self.hostname2linkdone.values())
+        rate = (link_num - self.last_report_link_num) / max(cur_ts - self.last_report_ts, 1e-9)
+        finished_num = sum(self.hostname2linkdone[hostname] >= self.hostname2linknum[hostname]
+                           for hostname in self.hostname2linknum)
+        elapsed_time = cur_ts - self.start_ts
+        print(f"Setup progress: {link_num}/{sum(self.hostname2linknum.values())} links added "
+              f"({rate:.0f} links/s now, {link_num / max(elapsed_time, 1e-9):.0f} links/s on average), "
+              f"{finished_num}/{len(self.hostname2linknum)} VMs done, {elapsed_time:.0f}s elapsed")
+        self.last_report_ts, self.last_report_link_num = cur_ts, link_num
+
 ###################### Result Collection Helper functions #########################
 
 def get_one_test_log_name(var_opts):
@@ -312,24 +545,23 @@ def get_one_test_log_name(var_opts):
     var_opts['t'] = old_var_opts_t
     return dir_name
 
-def reap_one_test_results(remote_machines, server_config_list, cur_test_log_dir):
+def reap_one_test_results(remote_machines, server_config_list, cur_test_log_dir, vm_executor=None):
     server_log_dirs = []
     for i, server in enumerate(server_config_list):
         server_i_log_dir = os.path.join(cur_test_log_dir, SERVER_RESULTS_DIR, f"server{i}")
         os.makedirs(server_i_log_dir, exist_ok=True)
         server_log_dirs.append(server_i_log_dir)
 
-    for remote_result_path in REMOTE_RESULT_PATHS:
-        # Define different remote and local directories for each machine
-        directories = {
-            server["ipAddr"]: (
-                os.path.join(server["agentWorkDir"], remote_result_path[1]),
-                server_log_dirs[i],
-                remote_result_path[0] == "dir"
-            )
-            for i, server in enumerate(server_config_list)
-        }
-        receive_file_from_multiple_machines(remote_machines, directories)
+    # All result paths of a VM come in one archive stream, unpacked into its log directory
+    path_lists = {
+        server["ipAddr"]: (
+            [os.path.join(server["agentWorkDir"], remote_result_path[1])
+             for remote_result_path in REMOTE_RESULT_PATHS],
+            server_log_dirs[i]
+        )
+        for i, server in enumerate(server_config_list)
+    }
+    receive_paths_from_vms(remote_machines, path_lists, vm_executor)
 
 def print_commands(commands):
     for ip, (cmd, work_dir, _, _) in commands.items():
@@ -363,40 +595,65 @@ def output_mem_usage_to_file(
 
 ###################### One run of the experiment #########################
 
-def one_test(var_opts, remote_pms, local_result_repo_dir, pm_config_list, exp_config):
+def one_test(var_opts, remote_pms, local_result_repo_dir, pm_config_list, exp_config, agent_hashes,
+             prev_partition_filepath=None, vm_executor=None):
+    """Runs one test and returns the file its partition was saved to, if any."""
     # Check log directory of current test
     print(f"\n\n============== New test! Options: {var_opts} ==============\n")
     test_start_ts = time.time()
     final_cur_test_log_dir = get_one_test_log_name(var_opts)
     full_cur_test_log_dir = os.path.join(local_result_repo_dir, final_cur_test_log_dir)
+    partition_filepath = os.path.join(full_cur_test_log_dir, PARTITION_FILENAME)
+    if os.path.exists(os.path.join(full_cur_test_log_dir, INVALID_TEST_FILENAME)):
+        # The setup of a previous run failed, so its results are dropped and the test is run again
+        print(f"Test {var_opts} was invalid, running it again")
+        shutil.rmtree(full_cur_test_log_dir)
     if os.path.exists(full_cur_test_log_dir) and os.listdir(full_cur_test_log_dir):
         print(f"Test {var_opts} skipped")
-        return # Current test has been completed before, skip current iteration
+        # Current test has been completed before, skip current iteration
+        return partition_filepath if os.path.exists(partition_filepath) else None
     os.makedirs(full_cur_test_log_dir, exist_ok=True)
 
-    # Generate current topology
+    # Generate current topology. With streaming partitioning, the topology is never held as a graph:
+    # every step below reads the links chunk by chunk from the file (or its binary cache) instead.
     topo = var_opts['t']
-    full_topo_filepath = generate_topo(topo, LOCAL_TOPO_DIR)
+    streaming = exp_config.get("StreamingPartitioning", False)
+    full_topo_filepath, graph = generate_topo(topo, LOCAL_TOPO_DIR, build_graph=not streaming)
+    if streaming:
+        graph = TopoStream(full_topo_filepath)
 
     # Partition topo to PMs
     print(f"Partitioning across all PMs...")
     cur_ts = time.time()
-    nodes, adjacency_list = read_graph_from_topo_file(full_topo_filepath)
-    cross_pm_partition_method = exp_config["CrossPMPartitioning"]
-    node2pmid, pmid2nodes, pmid2adjacencylist = partition_graph_across_pm(
-        cross_pm_partition_method,
-        nodes, adjacency_list,
-        pm_config_list, full_topo_filepath)
+    pm_weights = get_cross_pm_weights(
+        graph, pm_config_list, exp_config, FIXED_VM_NUM_PER_PM, FIXED_M, FIXED_BBNS_NUM)
+    if streaming:
+        # Every cross-PM method but "stream" needs the graph, so the PMs are split by streaming
+        node2pmid, pmid2graph = partition_stream_across_pm(
+            graph, pm_config_list, pm_weights, exp_config.get("StreamRestreamPasses", STREAM_RESTREAM_PASSES))
+    else:
+        node2pmid, pmid2graph = partition_graph_across_pm(
+            exp_config["CrossPMPartitioning"],
+            graph,
+            pm_config_list, full_topo_filepath,
+            exp_config.get("MetisSeedNum", 1), exp_config.get("CrossPMSeedMetric", "tdf"),
+            get_planning_worker_num(exp_config),
+            pm_weights,
+            exp_config.get("CrossPMRefinement", False))
+    print_pm_setup_time_predictions(pmid2graph, pm_config_list, exp_config, FIXED_VM_NUM_PER_PM, FIXED_M, FIXED_BBNS_NUM)
     cross_pm_partition_time = time.time() - cur_ts
     print(f"Cross-PM partitioning elapsed for {cross_pm_partition_time}s")
 
     # Get the optimal VM allocation for each PM in parallel
     print(f"Planning optimal VM configuration...")
     cur_ts = time.time()
-    pmid2search_results, pmid2vmalloc, n_opt_legal = \
+    # The PM sub-topologies are streams, which only the node-balanced stream partitioner takes
+    planning_exp_config = dict(exp_config, VMPartitioning="stream", VMPartitionBalance="nodes") \
+        if streaming else exp_config
+    pmid2search_results, pmid2vmalloc, n_opt_legal, pmid2partitions = \
         get_optimal_vm_allocation_for_all_pms(
-            pmid2nodes, pmid2adjacencylist,
-            pm_config_list, exp_config,
+            pmid2graph,
+            pm_config_list, planning_exp_config,
             FIXED_VM_NUM_PER_PM, FIXED_M, FIXED_BBNS_NUM
         )
     if not all(n_opt_legal.values()):
@@ -436,29 +693,50 @@ def one_test(var_opts, remote_pms, local_result_repo_dir, pm_config_list, exp_co
     # Record host PM usage
     vm_mem_results = get_mem_usage_of_all_pms(remote_pms, pm_config_list)
 
-    # Connect to all remote VMs
-    remote_vms = [None for vm_config in vm_config_list]
-    while True:
-        print("Trying SSH connection...")
-        remote_vms = connect_remote_machines(vm_config_list)
-        if all(remote_vms):
-            break
+    # Connect to all remote VMs, retrying only the ones that failed
+    print("Trying SSH connection...")
+    cur_ts = time.time()
+    remote_vms = connect_remote_vms(vm_config_list, vm_executor)
+    while not all(remote_vms):
         wait_for_all_vms_to_start(vm_config_list, timeout=300)
+        print("Retrying SSH connection...")
+        remote_vms = connect_remote_vms(vm_config_list, vm_executor)
+    ssh_connect_elapsed_time = time.time() - cur_ts
+    print(f"SSH connection setup consumes {ssh_connect_elapsed_time}s")
 
     # Config environments on remote VMs
-    prepare_env_on_remote_servers(remote_vms, vm_config_filepath, vm_config_list)
+    prepare_env_on_remote_servers(remote_vms, vm_config_filepath, vm_config_list, agent_hashes, vm_executor)
 
     # Partition the topology to VMs
-    tdf = partition_topo_across_vms_for_all_pms(
-        nodes, adjacency_list,
-        pmid2nodes, pmid2adjacencylist,
-        vm_config_list, full_topo_filepath)
+    if prev_partition_filepath is not None:
+        tdf, node2serverid, partition_delta = partition_topo_incrementally(
+            graph, node2pmid,
+            vm_config_list, full_topo_filepath,
+            prev_partition_filepath)
+        with open(os.path.join(full_cur_test_log_dir, "partition_delta.txt"), 'w') as f:
+            print(f"Previous partition: {prev_partition_filepath}", file=f)
+            print_partition_delta(partition_delta, file=f)
+    elif streaming:
+        tdf, node2serverid = partition_topo_file_streaming(
+            full_topo_filepath, vm_config_list, node2pmid,
+            exp_config.get("StreamRestreamPasses", STREAM_RESTREAM_PASSES), pmid2partitions)
+    elif exp_config.get("HierarchicalPartitioning", False):
+        tdf, node2serverid = partition_topo_hierarchically(
+            graph, node2pmid, pmid2graph,
+            vm_config_list, full_topo_filepath,
+            pmid2partitions, get_vm_partition_options(exp_config), exp_config.get("CrossPMCutCost", 4))
+    else:
+        tdf, node2serverid = partition_topo_across_vms_for_all_pms(
+            graph, pmid2graph,
+            vm_config_list, full_topo_filepath,
+            pmid2partitions, get_vm_partition_options(exp_config))
     tdf_filepath = os.path.join(full_cur_test_log_dir, "tdf.txt")
     output_tdf_to_file(tdf, tdf_filepath)
+    save_partition(partition_filepath, graph, node2serverid)
 
     # Distribute sub-topologies to remote VMs
     distribute_sub_topo_to_vms(
-        topo, full_topo_filepath, remote_vms, vm_config_list)
+        topo, full_topo_filepath, remote_vms, vm_config_list, vm_executor)
 
     # Calcuate best BBNS number k_opt for each sub-topology
     serverid2bbnsnum = get_bbns_num_for_all_vms(
@@ -473,9 +751,26 @@ def one_test(var_opts, remote_pms, local_result_repo_dir, pm_config_list, exp_co
     time.sleep(5)
     print(f"Setup virtual networks...")
     print_commands(setup_commands)
+    partition_stats = get_partition_stats(graph, node2serverid, len(vm_config_list))
+    setup_progress = SetupProgress({
+        server["ipAddr"]: partition_stats.get(server_id, {}).get("edge_count", 0)
+        for server_id, server in enumerate(vm_config_list)})
     cur_ts = time.time()
-    execute_command_on_multiple_machines(remote_vms, setup_commands) # Setup virtual network
+    setup_exit_statuses = stream_command_on_vms(
+        remote_vms, setup_commands, os.path.join(full_cur_test_log_dir, SETUP_LOG_DIR),
+        setup_progress, AGENT_SETUP_TIMEOUT, vm_executor) # Setup virtual network
     setup_elapsed_time = time.time() - cur_ts
+    setup_progress.report()
+    # A VM whose setup did not report back counts as failed
+    failed_setups = {hostname: setup_exit_statuses.get(hostname) for hostname in setup_commands
+                     if setup_exit_statuses.get(hostname) != 0}
+    if failed_setups:
+        # The network is incomplete, so the results of this test are marked invalid (logs are still reaped)
+        print(f"Setup failed on {len(failed_setups)} VMs (exit status, None if timed out): {failed_setups}")
+        print(f"Test {var_opts} is invalid")
+        with open(os.path.join(full_cur_test_log_dir, INVALID_TEST_FILENAME), 'w') as f:
+            for hostname, status in sorted(failed_setups.items()):
+                f.write(f"{hostname} {status}\n")
     print(f"Setup done, time: {setup_elapsed_time}s")
     time.sleep(15) # Wait for a while
 
@@ -488,12 +783,15 @@ def one_test(var_opts, remote_pms, local_result_repo_dir, pm_config_list, exp_co
     # time.sleep(20) # Wait for a while
 
     # Reap results of current test
-    reap_one_test_results(remote_vms, vm_config_list, full_cur_test_log_dir)
+    reap_one_test_results(remote_vms, vm_config_list, full_cur_test_log_dir, vm_executor)
     time.sleep(5) # Wait for a while
 
-    # Close connection to VMs
-    for remote_vm in remote_vms:
-        remote_vm.close_connection()
+    # Close connection to VMs, which are destroyed below
+    vm_hostnames = [vm_config["ipAddr"] for vm_config in vm_config_list]
+    if vm_executor is not None:
+        vm_executor.close(vm_hostnames)
+    else:
+        connection_pool.close(vm_hostnames)
     time.sleep(5) # Wait for a while
 
     # Destroy VMs and record destroy time
@@ -511,25 +809,38 @@ def one_test(var_opts, remote_pms, local_result_repo_dir, pm_config_list, exp_co
 
     test_elapsed_time = time.time() - test_start_ts
     print(f"The test consumes {test_elapsed_time}s")
-    
+    return partition_filepath
+
 
 def run_all_tests(local_result_repo_dir, pm_config_list, exp_config):
     # Connect to remote PMs
     remote_pms = connect_remote_machines(pm_config_list)
+    vm_executor = AsyncRemoteExecutor() if exp_config.get("AsyncRemoteExecution", False) else None
+
+    # Build the agent once for all tests
+    agent_hashes = build_agent_locally()
 
     # Iterate over all possible combiation of options
     var_opt_keys = var_options.keys()
 
     # Each combination of options is a test
+    prev_partition_filepath = PREV_PARTITION_FILEPATH
     for var_opt_comb in product(*var_options.values()):
         # Get a combination of options
         opts = dict(zip(var_opt_keys, var_opt_comb))
         var_opts = deepcopy(opts)
-        one_test(var_opts, remote_pms, local_result_repo_dir, pm_config_list, exp_config)
+        partition_filepath = one_test(
+            var_opts, remote_pms, local_result_repo_dir, pm_config_list, exp_config, agent_hashes,
+            prev_partition_filepath, vm_executor)
+        if INCREMENTAL_PARTITIONING and partition_filepath is not None:
+            prev_partition_filepath = partition_filepath
+        elif not INCREMENTAL_PARTITIONING:
+            prev_partition_filepath = None
 
     # Close connection to PMs
-    for remote_machine in remote_pms:
-        remote_machine.close_connection()
+    connection_pool.close()
+    if vm_executor is not None:
+        vm_executor.shutdown()
 
 
 ################################# Main ##################################
@@ -539,8 +850,12 @@ if __name__ == "__main__":
     with open(PM_CONFIG_PATH, 'r') as f:
         pm_config = json.load(f)
         pm_config_list = pm_config["physicalMachines"]
+    load_cross_machine_bw(pm_config)
     with open(EXP_CONFIG_PATH, 'r') as f:
         exp_config = json.load(f)
+    if exp_config.get("StreamingPartitioning", False) and (INCREMENTAL_PARTITIONING or PREV_PARTITION_FILEPATH):
+        print("Incremental partitioning needs the topology graph, which streaming partitioning does not build, exiting...")
+        exit(1)
 
     # Prepare local repository directory for storing test results
     current_time = time.strftime("%Y%m%d-%H%M%S", time.localtime())
@@ -0,0 +1,64 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# The tests import the coordinator modules (util...) as test.py does, from the coordinator directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.mvs.partition.graph import TopoGraph
+
+
+def make_community_graph(community_num=4, community_size=50, intra_degree=6, inter_link_num=20, seed=0):
+    """
+    Synthetic topology of community_num dense communities (about intra_degree links per node)
+    joined by inter_link_num random links, with integer node names as the agent expects.
+    """
+    rng = np.random.default_rng(seed)
+    node_num = community_num * community_size
+    src, dst = [], []
+    for community in range(community_num):
+        base = community * community_size
+        # A ring keeps every community connected, random chords make it dense
+        ring = np.arange(community_size)
+        src.append(base + ring)
+        dst.append(base + (ring + 1) % community_size)
+        chord_num = community_size * (intra_degree - 2) // 2
+        src.append(base + rng.integers(0, community_size, chord_num))
+        dst.append(base + rng.integers(0, community_size, chord_num))
+    src.append(rng.integers(0, node_num, inter_link_num))
+    dst.append(rng.integers(0, node_num, inter_link_num))
+    src, dst = np.concatenate(src), np.concatenate(dst)
+    not_loop = src != dst
+    return TopoGraph.from_edges([str(i) for i in range(node_num)], src[not_loop], dst[not_loop])
+
+
+def write_topo_file(filepath, graph):
+    """Writes graph in the text topology format: the node line, then one "u v" line per link."""
+    with open(filepath, 'w') as f:
+        f.write(' '.join(graph.names) + '\n')
+        for u, v in zip(graph.edge_src.tolist(), graph.edge_dst.tolist()):
+            f.write(f"{graph.names[u]} {graph.names[v]}\n")
+
+
+@pytest.fixture
+def community_graph():
+    return make_community_graph()
+
+
+@pytest.fixture
+def topo_filepath(tmp_path, community_graph):
+    filepath = str(tmp_path / "community_topo.txt")
+    write_topo_file(filepath, community_graph)
+    return filepath
+
+
+@pytest.fixture(scope="module")
+def fake_hosts():
+    """Two fake SSH hosts on loopback addresses, running commands on the local machine."""
+    pytest.importorskip("asyncssh")
+    from util.fake_ssh_server import FakeSSHServer, get_fake_hostnames
+    hostnames = get_fake_hostnames(2)
+    server = FakeSSHServer(hostnames)
+    yield server
+    server.close()
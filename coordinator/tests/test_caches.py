@@ -0,0 +1,154 @@
+import os
+import numpy as np
+import pytest
+
+from util.mvs.partition.graph import TopoGraph
+from util.mvs.partition.topo_cache import TOPO_CACHE_HEADER, get_topo_cache_filepath, hash_topo_file, \
+    load_cached_graph
+from util.mvs.partition.fmt_util import read_graph_from_topo_file, parse_topo_file
+from util.mvs.partition.streaming import TopoStream
+from util.mvs.partition.partition_cache import hash_graph, load_cached_partition, save_cached_partition, \
+    get_partition_cache_filepath
+
+
+def assert_same_graph(graph, expected):
+    assert graph.names == expected.names
+    assert np.array_equal(graph.edge_src, expected.edge_src)
+    assert np.array_equal(graph.edge_dst, expected.edge_dst)
+
+
+def stream_edges(graph, chunk_size=64):
+    chunks = list(graph.iter_edge_chunks(chunk_size))
+    return np.concatenate([src for src, _ in chunks]), np.concatenate([dst for _, dst in chunks])
+
+
+######################## Binary topology cache ########################
+
+def test_tbin_cache_round_trip(topo_filepath):
+    cache_filepath = get_topo_cache_filepath(topo_filepath)
+    assert cache_filepath.endswith(".tbin")
+    parsed = parse_topo_file(topo_filepath)
+
+    graph = read_graph_from_topo_file(topo_filepath)
+    assert os.path.exists(cache_filepath)
+    assert_same_graph(graph, parsed)
+    # The second read is served from the cache
+    cached = load_cached_graph(cache_filepath, hash_topo_file(topo_filepath))
+    assert cached is not None
+    assert_same_graph(cached, parsed)
+    assert_same_graph(read_graph_from_topo_file(topo_filepath), parsed)
+
+
+def test_tbin_cache_is_refreshed_when_the_topology_changes(topo_filepath):
+    read_graph_from_topo_file(topo_filepath)
+    old_digest = hash_topo_file(topo_filepath)
+    with open(topo_filepath, 'a') as f:
+        f.write("0 199\n")
+    assert load_cached_graph(get_topo_cache_filepath(topo_filepath), hash_topo_file(topo_filepath)) is None
+
+    graph = read_graph_from_topo_file(topo_filepath)
+    assert graph.edge_num == parse_topo_file(topo_filepath).edge_num
+    assert load_cached_graph(get_topo_cache_filepath(topo_filepath), old_digest) is None
+    assert load_cached_graph(get_topo_cache_filepath(topo_filepath), hash_topo_file(topo_filepath)) is not None
+
+
+@pytest.mark.parametrize("damage", ["truncate", "header", "empty"])
+def test_damaged_tbin_cache_is_ignored(topo_filepath, damage):
+    read_graph_from_topo_file(topo_filepath)
+    cache_filepath = get_topo_cache_filepath(topo_filepath)
+    with open(cache_filepath, 'rb') as f:
+        data = f.read()
+    if damage == "truncate":
+        data = data[:-10]
+    elif damage == "header":
+        data = b"garbage!" + data[8:]
+    else:
+        data = b""
+    with open(cache_filepath, 'wb') as f:
+        f.write(data)
+
+    assert load_cached_graph(cache_filepath, hash_topo_file(topo_filepath)) is None
+    assert_same_graph(read_graph_from_topo_file(topo_filepath), parse_topo_file(topo_filepath))
+    assert os.path.getsize(cache_filepath) > TOPO_CACHE_HEADER.size
+
+
+@pytest.mark.parametrize("write_cache", [True, False])
+def test_topo_stream_matches_graph(topo_filepath, write_cache):
+    graph = parse_topo_file(topo_filepath)
+    stream = TopoStream(topo_filepath, chunk_size=64, write_cache=write_cache)
+    assert os.path.exists(get_topo_cache_filepath(topo_filepath)) == write_cache
+    assert stream.names == graph.names
+    assert hash_graph(stream) == hash_graph(graph)
+    edge_src, edge_dst = stream_edges(stream)
+    assert np.array_equal(edge_src, graph.edge_src) and np.array_equal(edge_dst, graph.edge_dst)
+
+    # The masked stream gives the links of the sub-graph
+    mask = np.arange(graph.node_num) % 3 != 0
+    subgraph = graph.subgraph(mask)
+    masked = stream.masked(mask)
+    assert masked.names == subgraph.names
+    edge_src, edge_dst = stream_edges(masked)
+    assert np.array_equal(edge_src, subgraph.edge_src) and np.array_equal(edge_dst, subgraph.edge_dst)
+
+
+def test_dangling_nodes_are_dropped(tmp_path):
+    topo_filepath = str(tmp_path / "topo.txt")
+    with open(topo_filepath, 'w') as f:
+        f.write("1 2 3 4\n1 2\n2 4\n")
+    graph = read_graph_from_topo_file(topo_filepath)
+    assert graph.names == ["1", "2", "4"]
+    assert TopoStream(topo_filepath).names == ["1", "2", "4"]
+
+
+######################## Partition cache ########################
+
+def test_partition_cache_round_trip(tmp_path, community_graph):
+    cache_dir = str(tmp_path / "partition_cache")
+    digest = hash_graph(community_graph)
+    options = {"method": "metis", "seed": None, "balance": "nodes"}
+    parts = np.arange(community_graph.node_num) % 4
+    assert load_cached_partition(digest, options, 4, community_graph.node_num, cache_dir) is None
+
+    save_cached_partition(digest, options, 4, parts, 123, cache_dir)
+    cached_parts, E_max = load_cached_partition(digest, options, 4, community_graph.node_num, cache_dir)
+    assert np.array_equal(cached_parts, parts) and E_max == 123
+    assert os.listdir(os.path.dirname(get_partition_cache_filepath(digest, options, 4, cache_dir))) == ["n4.npz"]
+
+    # Other n, other options and another node count miss
+    assert load_cached_partition(digest, options, 2, community_graph.node_num, cache_dir) is None
+    assert load_cached_partition(digest, dict(options, balance="edges"), 4, community_graph.node_num,
+                                 cache_dir) is None
+    assert load_cached_partition(digest, options, 4, community_graph.node_num - 1, cache_dir) is None
+
+
+def test_damaged_partition_cache_is_ignored(tmp_path, community_graph):
+    cache_dir = str(tmp_path / "partition_cache")
+    digest = hash_graph(community_graph)
+    options = {"method": "metis", "seed": None, "balance": "nodes"}
+    cache_filepath = get_partition_cache_filepath(digest, options, 4, cache_dir)
+    os.makedirs(os.path.dirname(cache_filepath))
+    with open(cache_filepath, 'wb') as f:
+        f.write(b"not an npz")
+    assert load_cached_partition(digest, options, 4, community_graph.node_num, cache_dir) is None
+
+
+def test_hash_graph_covers_links_and_external_degrees(community_graph):
+    digest = hash_graph(community_graph)
+    assert hash_graph(make_copy(community_graph)) == digest
+    assert hash_graph(TopoGraph.from_edges(
+        community_graph.names, community_graph.edge_src[1:], community_graph.edge_dst[1:],
+        drop_isolated=False)) != digest
+
+    # Sub-graphs with the same links but other external degrees weigh their nodes differently
+    mask = np.arange(community_graph.node_num) < 50
+    subgraph = community_graph.subgraph(mask)
+    other = make_copy(subgraph)
+    other.ext_degree = np.zeros_like(subgraph.ext_degree)
+    other.ext_degree[0] = subgraph.ext_degree[0] + 1
+    assert hash_graph(subgraph) == hash_graph(make_copy(subgraph))
+    assert hash_graph(other) != hash_graph(subgraph)
+
+
+def make_copy(graph):
+    return TopoGraph(list(graph.names), graph.edge_src.copy(), graph.edge_dst.copy(),
+                     global_ids=graph.global_ids, ext_degree=graph.ext_degree)
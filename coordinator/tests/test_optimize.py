@@ -0,0 +1,164 @@
+import functools
+import pytest
+
+from conftest import make_community_graph
+
+# Planning partitions the PM sub-graphs with METIS
+try:
+    from util.mvs import optimize
+    from util.mvs.partition.partition_topo_vm import get_vm_partition_options
+except (ImportError, RuntimeError):
+    pytest.skip("METIS is not available", allow_module_level=True)
+
+
+def make_pm_config(core_num=33, memory=968):
+    return {
+        "maxVMNum": 30,
+        "coreNum": core_num,
+        "Memory": memory,
+        "Parameters": {
+            "theta_m_table": {"8": 2.814, "25": 3.19, "50": 3.746, "100": 4.82, "200": 7.009,
+                              "300": 8.857, "400": 10.59, "500": 10.942},
+            "X": 0.00329,
+            "Y": 0.03918,
+            "Z": 0.0127,
+        },
+    }
+
+
+@pytest.fixture(autouse=True)
+def partition_cache_dir(tmp_path, monkeypatch):
+    """Keeps the partitions of the tests out of the coordinator's partition cache."""
+    cache_dir = str(tmp_path / "partition_cache")
+    monkeypatch.setattr(optimize, "load_cached_partition",
+                        functools.partial(optimize.load_cached_partition, cache_dir=cache_dir))
+    monkeypatch.setattr(optimize, "save_cached_partition",
+                        functools.partial(optimize.save_cached_partition, cache_dir=cache_dir))
+    return cache_dir
+
+
+def get_exhaustive_allocation(pmid, graph, pm_config, exp_config, FIXED_VM_NUM, FIXED_M, FIXED_BBNS_NUM):
+    """The optimal (n, m, vcpu) of a PM with E_max(n) derived for every n, as before branch-and-bound."""
+    pmid2E_max_data, _ = optimize.get_E_max_data_for_all_pm_topos(
+        {pmid: graph}, {pmid: list(range(1, pm_config["coreNum"]))}, 1, get_vm_partition_options(exp_config))
+    model = optimize.get_pm_model(pm_config, exp_config, FIXED_BBNS_NUM)
+    _, optimal_result, max_gain = optimize.search_vm_allocation(
+        pm_config, model, graph.node_num, pmid2E_max_data[pmid], FIXED_VM_NUM, FIXED_M)
+    return optimal_result, max_gain
+
+
+@pytest.mark.parametrize("exp_options", [
+    {"VMPartitioning": "metis"},
+    {"VMPartitioning": "metis", "EmaxEstimation": "sampled"},
+    {"VMPartitioning": "metis", "VMPartitionBalance": "edges"},
+    {"VMPartitioning": "tree", "TreeLeafNum": 16},
+])
+@pytest.mark.parametrize("FIXED_BBNS_NUM", [0, 1])
+def test_branch_and_bound_matches_exhaustive_search(exp_options, FIXED_BBNS_NUM):
+    exp_config = dict(exp_options, **{"MemoryReq(GB)": 500})
+    pmid2graph = {
+        0: make_community_graph(community_num=8, community_size=40, seed=0),
+        1: make_community_graph(community_num=3, community_size=60, inter_link_num=60, seed=1),
+    }
+    pm_config_list = {0: make_pm_config(), 1: make_pm_config(core_num=13, memory=600)}
+
+    evaluator = optimize.EmaxEvaluator(pmid2graph, 1, get_vm_partition_options(exp_config))
+    try:
+        pmid2E_max_data = optimize.get_E_max_data_by_branch_and_bound(
+            evaluator, pm_config_list, exp_config, 0, 0, FIXED_BBNS_NUM)
+    finally:
+        evaluator.close()
+
+    for pmid, graph in pmid2graph.items():
+        model = optimize.get_pm_model(pm_config_list[pmid], exp_config, FIXED_BBNS_NUM)
+        candidate_vm_nums = optimize.get_candidate_vm_nums(pm_config_list[pmid], model, 0, 0)
+        # Most candidates are pruned (the sampled estimation always derives its geometric sample)
+        if exp_config.get("EmaxEstimation", "exact") == "exact":
+            assert evaluator.pmid2partition_num[pmid] < len(candidate_vm_nums) / 2
+        _, optimal_result, max_gain = optimize.search_vm_allocation(
+            pm_config_list[pmid], model, graph.node_num, pmid2E_max_data[pmid], 0, 0)
+        expected_result, expected_max_gain = get_exhaustive_allocation(
+            pmid, graph, pm_config_list[pmid], exp_config, 0, 0, FIXED_BBNS_NUM)
+        assert optimal_result == expected_result
+        assert max_gain == pytest.approx(expected_max_gain)
+
+
+def test_branch_and_bound_keeps_fixed_vm_num():
+    exp_config = {"MemoryReq(GB)": 500}
+    pmid2graph = {0: make_community_graph(seed=2)}
+    pm_config_list = {0: make_pm_config()}
+    evaluator = optimize.EmaxEvaluator(pmid2graph, 1, get_vm_partition_options(exp_config))
+    try:
+        E_max_data = optimize.get_E_max_data_by_branch_and_bound(evaluator, pm_config_list, exp_config, 4, 0, 1)[0]
+    finally:
+        evaluator.close()
+    # Only E_max(1) and E_max(4) are needed
+    assert sorted(E_max_data) == [1, 4]
+    model = optimize.get_pm_model(pm_config_list[0], exp_config, 1)
+    _, (n, m, _), _ = optimize.search_vm_allocation(pm_config_list[0], model, 200, E_max_data, 4, 0)
+    assert n == 4 and 4 * m >= 500
+    expected_result, _ = get_exhaustive_allocation(0, pmid2graph[0], pm_config_list[0], exp_config, 4, 0, 1)
+    assert (n, m) == expected_result[:2]
+
+
+def test_worker_pool_matches_in_process_sweep(tmp_path, monkeypatch):
+    exp_config = {"MemoryReq(GB)": 500}
+    pmid2graph = {0: make_community_graph(seed=3), 1: make_community_graph(community_num=3, seed=4)}
+    pmid2n_values = {0: [2, 3, 4, 6], 1: [2, 5]}
+    options = get_vm_partition_options(exp_config)
+    E_max_data, partitions = optimize.get_E_max_data_for_all_pm_topos(pmid2graph, pmid2n_values, 1, options)
+    # The spawned workers must not read back what the first sweep cached
+    cache_dir = str(tmp_path / "pool_partition_cache")
+    monkeypatch.setattr(optimize, "load_cached_partition",
+                        functools.partial(optimize.load_cached_partition.func, cache_dir=cache_dir))
+    monkeypatch.setattr(optimize, "save_cached_partition",
+                        functools.partial(optimize.save_cached_partition.func, cache_dir=cache_dir))
+    pool_E_max_data, pool_partitions = optimize.get_E_max_data_for_all_pm_topos(pmid2graph, pmid2n_values, 2, options)
+    assert pool_E_max_data == E_max_data
+    for pmid, n_values in pmid2n_values.items():
+        for n in n_values:
+            assert (pool_partitions[pmid][n] == partitions[pmid][n]).all()
+
+
+def test_sampled_estimation_never_prunes_the_optimum(monkeypatch):
+    # A fit far above the true E_max(n) would make every candidate off the sample look hopeless
+    monkeypatch.setattr(optimize, "fit_E_max_curve", lambda E_max_samples: (lambda n: 10 * E_max_samples[1], 0.02))
+    exp_config = {"MemoryReq(GB)": 500, "EmaxEstimation": "sampled"}
+    graph = make_community_graph(community_num=8, community_size=40, seed=0)
+    pm_config = make_pm_config()
+    evaluator = optimize.EmaxEvaluator({0: graph}, 1, get_vm_partition_options(exp_config))
+    try:
+        E_max_data = optimize.get_E_max_data_by_branch_and_bound(evaluator, {0: pm_config}, exp_config, 0, 0, 0)[0]
+    finally:
+        evaluator.close()
+    model = optimize.get_pm_model(pm_config, exp_config, 0)
+    _, optimal_result, _ = optimize.search_vm_allocation(pm_config, model, graph.node_num, E_max_data, 0, 0)
+    expected_result, _ = get_exhaustive_allocation(0, graph, pm_config, exp_config, 0, 0, 0)
+    # The optimum is off the geometric sample 1, 2, 4, 8, ...
+    assert expected_result[0] == 3
+    assert optimal_result == expected_result
+
+
+def test_streaming_planning_matches_the_graph(tmp_path):
+    from conftest import write_topo_file
+    from util.mvs.partition.fmt_util import read_graph_from_topo_file
+    from util.mvs.partition.streaming import TopoStream
+    from util.mvs.partition.partition_topo_pm import partition_stream_across_pm
+    topo_filepath = str(tmp_path / "topo.txt")
+    write_topo_file(topo_filepath, make_community_graph(community_num=8, community_size=40, seed=0))
+    graph = read_graph_from_topo_file(topo_filepath)
+    stream = TopoStream(topo_filepath, chunk_size=256)
+    exp_config = {"MemoryReq(GB)": 500, "VMPartitioning": "stream", "PlanningWorkerNum": 1}
+    pm_config_list = [make_pm_config(), make_pm_config(core_num=13, memory=600)]
+
+    # Planning on the PM sub-streams gives what it gives on the PM sub-graphs
+    node2pmid, pmid2stream = partition_stream_across_pm(stream, pm_config_list, [0.7, 0.3])
+    pmid2graph = {pmid: graph.subgraph(node2pmid == pmid) for pmid in pmid2stream}
+    stream_results = optimize.get_optimal_vm_allocation_for_all_pms(pmid2stream, pm_config_list, exp_config, 0, 0, 0)
+    graph_results = optimize.get_optimal_vm_allocation_for_all_pms(pmid2graph, pm_config_list, exp_config, 0, 0, 0)
+    assert stream_results[:3] == graph_results[:3]
+    for pmid, partitions in graph_results[3].items():
+        for n, parts in partitions.items():
+            assert (stream_results[3][pmid][n] == parts).all()
+            assert optimize.get_partition_stats(pmid2stream[pmid], parts, n) == \
+                optimize.get_partition_stats(pmid2graph[pmid], parts, n)
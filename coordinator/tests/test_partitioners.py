@@ -0,0 +1,221 @@
+import os
+import math
+import numpy as np
+import pytest
+
+from conftest import make_community_graph
+from util.mvs.partition.graph import TopoGraph
+from util.mvs.partition.streaming import TopoStream, partition_stream
+from util.mvs.partition.incremental import save_partition, load_partition, repartition_incrementally, \
+    get_partition_delta
+from util.mvs.partition.fmt_util import write_subtopos_to_file, get_subtopo_filepath
+
+# The METIS based partitioners need the METIS shared library (METIS_DLL)
+try:
+    from util.mvs.partition import partition_topo_vm, algorithm
+except (ImportError, RuntimeError):
+    partition_topo_vm = algorithm = None
+requires_metis = pytest.mark.skipif(partition_topo_vm is None, reason="METIS is not available")
+
+TREE_OPTIONS = {"method": "tree", "seed": None, "leaf_num": 8, "refine": True}
+
+
+def count_cut(graph, parts):
+    return int(np.count_nonzero(parts[graph.edge_src] != parts[graph.edge_dst]))
+
+
+def assert_balanced(parts, num_partitions, imbalance):
+    sizes = np.bincount(parts, minlength=num_partitions)
+    assert len(sizes) == num_partitions and sizes.min() > 0
+    assert sizes.max() <= math.ceil(imbalance * len(parts) / num_partitions) + 1
+
+
+def edit_graph(graph, removed_names, added_links):
+    """The graph without removed_names, plus added_links given as (name, name) pairs."""
+    names = [name for name in graph.names if name not in removed_names]
+    names += list(dict.fromkeys(name for link in added_links for name in link if name not in graph.names))
+    name2id = {name: i for i, name in enumerate(names)}
+    links = [(graph.names[u], graph.names[v]) for u, v in zip(graph.edge_src.tolist(), graph.edge_dst.tolist())]
+    links = [link for link in links if not set(link) & set(removed_names)] + list(added_links)
+    return TopoGraph.from_edges(
+        names, [name2id[u] for u, _ in links], [name2id[v] for _, v in links], drop_isolated=False)
+
+
+######################## Tree partitioner ########################
+
+@requires_metis
+@pytest.mark.parametrize("num_partitions", [2, 3, 4])
+def test_tree_partition_is_balanced_with_a_small_cut(community_graph, num_partitions):
+    parts = partition_topo_vm.partition_graph_across_vm(community_graph, num_partitions, 0, options=TREE_OPTIONS)
+    assert_balanced(parts, num_partitions, 1.1)
+    # Much less than the 1 - 1/k of the links a random partition cuts
+    assert count_cut(community_graph, parts) < 0.25 * community_graph.edge_num
+
+
+@requires_metis
+def test_tree_partition_offsets_server_ids(community_graph):
+    parts = partition_topo_vm.partition_graph_across_vm(community_graph, 4, 8, options=TREE_OPTIONS)
+    assert sorted(np.unique(parts).tolist()) == [8, 9, 10, 11]
+    assert np.array_equal(partition_topo_vm.partition_graph_across_vm(community_graph, 1, 3, options=TREE_OPTIONS),
+                          np.full(community_graph.node_num, 3))
+
+
+@requires_metis
+def test_tree_partition_finds_the_communities(community_graph):
+    parts = partition_topo_vm.partition_graph_across_vm(community_graph, 4, 0, options=TREE_OPTIONS)
+    # Cutting only between communities gives at most the inter-community links
+    assert count_cut(community_graph, parts) <= 20
+
+
+
+@requires_metis
+@pytest.mark.parametrize("num_partitions", [2, 3, 4])
+def test_tree_refinement_keeps_the_weight_balance(community_graph, num_partitions):
+    vwgt = np.random.default_rng(0).integers(1, 20, community_graph.node_num)
+    tree = algorithm.build_partition_tree(community_graph, num_partitions, vwgt=vwgt)
+    parts = algorithm.cut_partition_tree(tree, num_partitions)
+    refined = algorithm.partition_tree(community_graph, num_partitions, tree=tree, vwgt=vwgt)
+    # No part grows past the balance bound on weights, counting nodes would let heavy ones pile up
+    max_weight = max(np.bincount(parts, weights=vwgt).max(), math.ceil(1.03 * vwgt.sum() / num_partitions))
+    assert np.bincount(refined, weights=vwgt, minlength=num_partitions).max() <= max_weight
+    assert count_cut(community_graph, refined) <= count_cut(community_graph, parts)
+
+######################## Best of K METIS seeds ########################
+
+@requires_metis
+@pytest.mark.parametrize("metric", ["emax", "tdf"])
+def test_best_of_seeds_scores_lowest(metric):
+    from util.mvs.partition.algorithm import partition_metis
+    from util.mvs.partition.multi_seed import partition_metis_best_of_seeds, score_partition
+    graph = make_community_graph(community_num=6, community_size=40, inter_link_num=80, seed=5)
+    parts = partition_metis_best_of_seeds(graph, 4, 4, metric)
+    scores = [score_partition(graph, partition_metis(graph, 4, seed=seed), 4, metric) for seed in range(4)]
+    assert score_partition(graph, parts, 4, metric) == min(scores)
+    # Seeds run in spawned workers pick the same partition
+    assert np.array_equal(partition_metis_best_of_seeds(graph, 4, 4, metric, worker_num=2), parts)
+
+
+######################## Stream partitioner ########################
+
+def test_stream_partition_of_a_file_matches_the_graph(community_graph, topo_filepath):
+    parts = partition_stream(community_graph, 4)
+    assert np.array_equal(partition_stream(TopoStream(topo_filepath), 4), parts)
+    assert np.array_equal(partition_stream(TopoStream(topo_filepath, write_cache=False), 4), parts)
+
+
+@pytest.mark.parametrize("num_partitions", [2, 4])
+def test_stream_partition_is_balanced_with_a_small_cut(community_graph, num_partitions):
+    parts = partition_stream(community_graph, num_partitions)
+    assert_balanced(parts, num_partitions, 1.05)
+    assert count_cut(community_graph, parts) < 0.5 * (1 - 1 / num_partitions) * community_graph.edge_num
+
+
+def test_stream_partition_follows_part_shares():
+    graph = make_community_graph(community_num=4, community_size=100, seed=1)
+    parts = partition_stream(graph, 2, part_shares=[1, 3])
+    sizes = np.bincount(parts, minlength=2)
+    assert sizes[0] <= math.ceil(1.05 * graph.node_num / 4) + 1
+    assert sizes[1] <= math.ceil(1.05 * graph.node_num * 3 / 4) + 1
+
+
+######################## Incremental partitioner ########################
+
+def test_saved_partition_round_trip(tmp_path, community_graph):
+    parts = np.arange(community_graph.node_num, dtype=np.int32) // 50
+    partition_filepath = str(tmp_path / "partition.txt")
+    save_partition(partition_filepath, community_graph, parts)
+    name2serverid, vxlans = load_partition(partition_filepath)
+    assert name2serverid == dict(zip(community_graph.names, parts.tolist()))
+    assert len(vxlans) == count_cut(community_graph, parts)
+
+    delta = get_partition_delta(community_graph, parts, name2serverid, vxlans)
+    assert all(not delta[key] for key in delta)
+
+
+def test_incremental_partition_keeps_known_nodes(tmp_path, community_graph):
+    parts = np.arange(community_graph.node_num, dtype=np.int32) // 50
+    partition_filepath = str(tmp_path / "partition.txt")
+    save_partition(partition_filepath, community_graph, parts)
+    name2serverid, vxlans = load_partition(partition_filepath)
+
+    # Two new nodes in every community, and one node removed from the last one
+    added_links = [(f"new{c}_{i}", str(50 * c + j)) for c in range(4) for i in range(2) for j in range(3)]
+    graph = edit_graph(community_graph, {"199"}, added_links)
+    new_parts = repartition_incrementally(graph, name2serverid, 4)
+
+    for name, server_id in zip(graph.names, new_parts.tolist()):
+        if name in name2serverid:
+            assert server_id == name2serverid[name]
+        else:
+            assert server_id == int(name[3])
+    delta = get_partition_delta(graph, new_parts, name2serverid, vxlans)
+    assert sorted(delta["nodes_added"]) == sorted(set(name for name, _ in added_links))
+    assert delta["nodes_removed"] == ["199"] and delta["nodes_moved"] == []
+    assert delta["vxlans_added"] == []
+    assert all("199" in vxlan[:2] for vxlan in delta["vxlans_removed"])
+    assert delta["changed_servers"] == [0, 1, 2, 3]
+
+
+def test_incremental_partition_rebalances_overloaded_servers(community_graph):
+    # The previous topology ran on two servers, the new one gets four
+    name2serverid = {name: i // 100 for i, name in enumerate(community_graph.names)}
+    parts = repartition_incrementally(community_graph, name2serverid, 4)
+    assert_balanced(parts, 4, 1.05)
+    delta = get_partition_delta(community_graph, parts, name2serverid, set())
+    assert len(delta["nodes_moved"]) <= community_graph.node_num // 2 + 4
+
+
+######################## Sub-topology writer ########################
+
+def read_subtopos(topo_filepath, server_num):
+    """{server_id: (nodes, internal links, {(node, peer, peer server): vxlan_id})} of the written files."""
+    subtopos = {}
+    for server_id in range(server_num):
+        with open(get_subtopo_filepath(topo_filepath, server_id)) as f:
+            nodes = f.readline().split()
+            internal, dangling = [], {}
+            for line in f:
+                u, v = line.split()
+                if "_external_" in v:
+                    peer, _, peer_server_id, vxlan_id = v.split("_")
+                    dangling[(u, peer, int(peer_server_id))] = int(vxlan_id)
+                else:
+                    assert not dangling, "internal links come before the dangling ones"
+                    internal.append((u, v))
+        subtopos[server_id] = (nodes, internal, dangling)
+    return subtopos
+
+
+@pytest.mark.parametrize("worker_num", [1, 2])
+def test_subtopos_have_one_vxlan_per_node_pair(tmp_path, community_graph, worker_num):
+    # A duplicated cross-server link still gets a single VXLAN
+    graph = TopoGraph.from_edges(
+        community_graph.names, np.append(community_graph.edge_src, 0), np.append(community_graph.edge_dst, 199))
+    parts = (np.arange(graph.node_num, dtype=np.int32) * 7) % 4
+    topo_filepath = str(tmp_path / "topo.txt")
+    write_subtopos_to_file(graph, parts, 4, topo_filepath, worker_num=worker_num)
+    subtopos = read_subtopos(topo_filepath, 4)
+
+    assert sorted(name for nodes, _, _ in subtopos.values() for name in nodes) == sorted(graph.names)
+    pair2vxlan_id = {}
+    for server_id, (nodes, internal, dangling) in subtopos.items():
+        assert all(int(parts[int(name)]) == server_id for name in nodes)
+        assert all(u < v for u, v in internal)
+        for (u, peer, peer_server_id), vxlan_id in dangling.items():
+            assert int(parts[int(peer)]) == peer_server_id
+            assert pair2vxlan_id.setdefault(tuple(sorted((u, peer))), vxlan_id) == vxlan_id
+    cross = parts[graph.edge_src] != parts[graph.edge_dst]
+    pair_num = len(set(zip(np.minimum(graph.edge_src, graph.edge_dst)[cross].tolist(),
+                           np.maximum(graph.edge_src, graph.edge_dst)[cross].tolist())))
+    assert sorted(pair2vxlan_id.values()) == list(range(4097, 4097 + pair_num))
+
+
+def test_subtopos_do_not_depend_on_the_worker_num(tmp_path, community_graph):
+    parts = (np.arange(community_graph.node_num, dtype=np.int32) * 7) % 4
+    contents = []
+    for worker_num in (1, 3):
+        os.makedirs(tmp_path / str(worker_num))
+        topo_filepath = str(tmp_path / str(worker_num) / "topo.txt")
+        write_subtopos_to_file(community_graph, parts, 4, topo_filepath, worker_num=worker_num)
+        contents.append([open(get_subtopo_filepath(topo_filepath, i)).read() for i in range(4)])
+    assert contents[0] == contents[1]
@@ -0,0 +1,234 @@
+import os
+import time
+import socket
+import pytest
+
+from util.remote import RemoteMachine, ConnectionPool, execute_command_on_multiple_machines, \
+    receive_paths_from_multiple_machines
+
+
+def get_closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def machine(fake_hosts):
+    hostname = next(iter(fake_hosts.ports))
+    machine = RemoteMachine(hostname, "fake", "fake", port=fake_hosts.ports[hostname])
+    assert machine.connect() is machine
+    yield machine
+    machine.close_connection()
+
+
+@pytest.fixture
+def executor():
+    from util.async_remote import AsyncRemoteExecutor
+    executor = AsyncRemoteExecutor()
+    yield executor
+    executor.shutdown()
+
+
+def get_fake_machines(fake_hosts):
+    from util.fake_ssh_server import FakeMachine
+    return [FakeMachine(hostname, port) for hostname, port in sorted(fake_hosts.ports.items())]
+
+
+def make_remote_tree(root):
+    """A file and a directory to reap, as a VM would leave them."""
+    os.makedirs(os.path.join(root, "results", "sub"))
+    with open(os.path.join(root, "results", "sub", "data.txt"), 'w') as f:
+        f.write("links 42\n")
+    with open(os.path.join(root, "log.txt"), 'w') as f:
+        f.write("setup done\n")
+    return [os.path.join(root, "log.txt"), os.path.join(root, "results"), os.path.join(root, "missing")]
+
+
+######################## Thread-based executor ########################
+
+def test_run_channel_returns_exit_status_and_output(machine):
+    outputs = {"stdout": b"", "stderr": b""}
+    def on_data(stream, data):
+        outputs[stream] += data
+    assert machine.run_channel("echo out; echo err >&2; exit 3", on_data) == 3
+    assert outputs == {"stdout": b"out\n", "stderr": b"err\n"}
+    assert machine.run_channel("true", on_data, timeout=10) == 0
+
+
+def test_execute_command_returns_exit_status(fake_hosts):
+    pool = ConnectionPool()
+    machines = [pool.get_machine(hostname, "fake", "fake", port) for hostname, port in sorted(fake_hosts.ports.items())]
+    commands = {machine.hostname: (f"echo {machine.hostname}; exit {i}", "/tmp") for i, machine in enumerate(machines)}
+    results = execute_command_on_multiple_machines(machines, commands)
+    assert results == {machine.hostname: (i, f"{machine.hostname}\n") for i, machine in enumerate(machines)}
+    assert machines[0].execute_command("echo out; echo err >&2") == (0, "out\n")
+    pool.close()
+
+    # A machine that can not be reached has no exit status
+    machine = RemoteMachine("127.0.0.1", "fake", "fake", port=get_closed_port())
+    assert machine.execute_command("true") == (None, "")
+
+
+def test_streaming_passes_lines_and_exit_status(machine, tmp_path):
+    lines = []
+    log_filepath = str(tmp_path / "host.log")
+    exit_status = machine.execute_command_streaming(
+        "echo 50% links are added; echo oops >&2; echo -n last", log_filepath,
+        line_callback=lambda hostname, stream, line: lines.append((hostname, stream, line)), timeout=10)
+    assert exit_status == 0
+    assert sorted(lines) == sorted([(machine.hostname, "stdout", "50% links are added"),
+                                    (machine.hostname, "stderr", "oops"),
+                                    (machine.hostname, "stdout", "last")])
+    with open(log_filepath) as f:
+        assert "[stderr] oops\n" in f.read()
+
+
+def test_streaming_timeout_kills_remote_command(machine, tmp_path):
+    marker_filepath = tmp_path / "marker"
+    start_ts = time.time()
+    assert machine.execute_command_streaming(f"sleep 2 && touch {marker_filepath}", timeout=0.5) is None
+    assert time.time() - start_ts < 2
+    # The command would have created the marker by now if it had kept running
+    time.sleep(2.5)
+    assert not marker_filepath.exists()
+
+
+def test_connection_pool_reuses_and_reconnects(fake_hosts):
+    hostname = next(iter(fake_hosts.ports))
+    port = fake_hosts.ports[hostname]
+    pool = ConnectionPool()
+    try:
+        machine = pool.get_machine(hostname, "fake", "fake", port)
+        transport = machine.ssh.get_transport()
+        assert pool.get_machine(hostname, "fake", "fake", port) is machine
+        assert machine.ssh.get_transport() is transport
+
+        # A dropped connection is reopened on the same machine
+        transport.close()
+        assert not machine.is_connected()
+        assert pool.get_machine(hostname, "fake", "fake", port) is machine
+        assert machine.is_connected()
+
+        # Other credentials get a new machine
+        other = pool.get_machine(hostname, "other", "other", port)
+        assert other is not machine and other.is_connected()
+        pool.close([hostname])
+        assert hostname not in pool.machines
+    finally:
+        pool.close()
+
+
+def test_connection_pool_returns_none_for_unreachable_host():
+    pool = ConnectionPool()
+    assert pool.get_machine("127.0.0.1", "fake", "fake", get_closed_port()) is None
+
+
+def test_receive_paths_skips_missing_paths(machine, tmp_path):
+    remote_paths = make_remote_tree(str(tmp_path / "remote"))
+    local_dir = str(tmp_path / "local")
+    assert machine.receive_paths(remote_paths, local_dir) is True
+    with open(os.path.join(local_dir, "results", "sub", "data.txt")) as f:
+        assert f.read() == "links 42\n"
+    assert os.path.exists(os.path.join(local_dir, "log.txt"))
+    assert not os.path.exists(os.path.join(local_dir, "missing"))
+
+
+def test_receive_paths_from_multiple_machines(fake_hosts, tmp_path):
+    machines = [RemoteMachine(hostname, "fake", "fake", port=port) for hostname, port in fake_hosts.ports.items()]
+    try:
+        for machine in machines:
+            machine.connect()
+        remote_paths = make_remote_tree(str(tmp_path / "remote"))
+        path_lists = {machine.hostname: (remote_paths, str(tmp_path / machine.hostname)) for machine in machines}
+        results = receive_paths_from_multiple_machines(machines, path_lists)
+        assert all(results[machine.hostname].startswith("Files received") for machine in machines)
+        for machine in machines:
+            assert os.path.exists(os.path.join(tmp_path, machine.hostname, "results", "sub", "data.txt"))
+    finally:
+        for machine in machines:
+            machine.close_connection()
+
+
+######################## Asyncio executor ########################
+
+def test_async_execute_returns_exit_status(fake_hosts, executor):
+    machines = get_fake_machines(fake_hosts)
+    commands = {machine.hostname: (f"echo {machine.hostname}; exit {i}", "/tmp") for i, machine in enumerate(machines)}
+    results = executor.execute_command_on_multiple_machines(machines, commands)
+    for i, machine in enumerate(machines):
+        assert results[machine.hostname]["error"] is None
+        assert results[machine.hostname]["exit_status"] == i
+        assert results[machine.hostname]["stdout"] == f"{machine.hostname}\n"
+
+
+def test_async_unreachable_host_is_an_error(executor):
+    from util.fake_ssh_server import FakeMachine
+    machine = FakeMachine("127.0.0.1", get_closed_port())
+    results = executor.execute_command_on_multiple_machines([machine], {machine.hostname: ("true", "/tmp")})
+    assert results[machine.hostname]["error"] is not None
+    assert results[machine.hostname]["exit_status"] is None
+
+
+def test_async_stream_timeout_kills_remote_command(fake_hosts, executor, tmp_path):
+    machines = get_fake_machines(fake_hosts)[:1]
+    marker_filepath = tmp_path / "marker"
+    lines = []
+    results = executor.stream_command_on_multiple_machines(
+        machines, {machines[0].hostname: (f"echo started; sleep 2 && touch {marker_filepath}", "/tmp")},
+        line_callback=lambda hostname, stream, line: lines.append(line), timeout=0.5)
+    assert results[machines[0].hostname]["error"] is not None
+    assert lines == ["started"]
+    time.sleep(2.5)
+    assert not marker_filepath.exists()
+
+
+def test_async_stream_returns_exit_status(fake_hosts, executor, tmp_path):
+    machines = get_fake_machines(fake_hosts)
+    results = executor.stream_command_on_multiple_machines(
+        machines, {machine.hostname: ("echo line; echo; exit 5", "/tmp") for machine in machines},
+        log_dir=str(tmp_path), timeout=10)
+    for machine in machines:
+        assert results[machine.hostname]["exit_status"] == 5
+        with open(tmp_path / f"{machine.hostname}.log") as f:
+            assert f.read() == "line\n\n"
+
+
+def test_async_non_utf8_output_does_not_lose_other_hosts(fake_hosts, executor, tmp_path):
+    machines = get_fake_machines(fake_hosts)
+    commands = {machines[0].hostname: ("printf 'bad \\377\\n'", "/tmp"), machines[1].hostname: ("echo good", "/tmp")}
+    results = executor.execute_command_on_multiple_machines(machines, commands)
+    assert results[machines[0].hostname]["exit_status"] == 0
+    assert results[machines[0].hostname]["stdout"] == "bad \ufffd\n"
+    assert results[machines[1].hostname]["stdout"] == "good\n"
+
+    lines = []
+    results = executor.stream_command_on_multiple_machines(
+        machines, commands, line_callback=lambda hostname, stream, line: lines.append((hostname, line)), timeout=10)
+    assert all(results[machine.hostname]["exit_status"] == 0 for machine in machines)
+    assert sorted(lines) == sorted([(machines[0].hostname, "bad \ufffd"), (machines[1].hostname, "good")])
+
+
+def test_async_failure_on_one_host_is_its_own_error(fake_hosts, executor):
+    machines = get_fake_machines(fake_hosts)
+    def line_callback(hostname, stream, line):
+        if hostname == machines[0].hostname:
+            raise ValueError("broken callback")
+    results = executor.stream_command_on_multiple_machines(
+        machines, {machine.hostname: ("echo line", "/tmp") for machine in machines}, line_callback=line_callback)
+    assert results[machines[0].hostname]["error"] == "broken callback"
+    assert results[machines[1].hostname]["error"] is None and results[machines[1].hostname]["exit_status"] == 0
+
+
+def test_async_receive_paths_skips_missing_paths(fake_hosts, executor, tmp_path):
+    machines = get_fake_machines(fake_hosts)
+    remote_paths = make_remote_tree(str(tmp_path / "remote"))
+    results = executor.receive_paths_from_multiple_machines(
+        machines, {machine.hostname: (remote_paths, str(tmp_path / machine.hostname)) for machine in machines})
+    for machine in machines:
+        result = results[machine.hostname]
+        assert result["error"] is None and result["exit_status"] == 0
+        assert "missing" in result["stderr"]
+        with open(os.path.join(tmp_path, machine.hostname, "results", "sub", "data.txt")) as f:
+            assert f.read() == "links 42\n"
+        assert not os.path.exists(os.path.join(tmp_path, machine.hostname, "missing"))
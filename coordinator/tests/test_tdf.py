@@ -0,0 +1,89 @@
+import math
+import numpy as np
+import pytest
+
+from util.mvs.partition import compute_tdf
+from util.mvs.partition.graph import TopoGraph
+
+
+def get_pm_tdf(graph, node2pmid, pm_num):
+    return compute_tdf.compute_tdf(graph, node2pmid, {pmid: pmid for pmid in range(pm_num)})
+
+
+def get_pm_loads(graph, node2pmid, pm_num):
+    """Links set up on each PM, as refine_partition_tdf balances them."""
+    src_pms, dst_pms = node2pmid[graph.edge_src], node2pmid[graph.edge_dst]
+    return np.bincount(src_pms, minlength=pm_num) + np.bincount(dst_pms[src_pms != dst_pms], minlength=pm_num)
+
+
+def get_scattered_partition(graph, pm_num, seed=0):
+    """Communities mostly on their own PM, with a tenth of the nodes scattered across the others."""
+    rng = np.random.default_rng(seed)
+    node2pmid = (np.arange(graph.node_num) * pm_num // graph.node_num).astype(np.int32)
+    scattered = rng.random(graph.node_num) < 0.1
+    node2pmid[scattered] = rng.integers(0, pm_num, np.count_nonzero(scattered))
+    return node2pmid
+
+
+def assert_within_imbalance(graph, node2pmid, refined, pm_num, imbalance):
+    sizes, refined_sizes = np.bincount(node2pmid, minlength=pm_num), np.bincount(refined, minlength=pm_num)
+    assert np.all(refined_sizes <= np.ceil(imbalance * sizes) + 1)
+    loads, refined_loads = get_pm_loads(graph, node2pmid, pm_num), get_pm_loads(graph, refined, pm_num)
+    assert np.all(refined_loads <= np.ceil(imbalance * loads) + 1)
+
+
+def test_compute_tdf():
+    graph = TopoGraph.from_edges(["1", "2", "3", "4"], [0, 1, 2, 0], [1, 2, 3, 2])
+    # Servers 0 and 1 on PM 0, server 2 on PM 1: links 2-3 and 1-3 cross PMs
+    tdf = compute_tdf.compute_tdf(graph, np.array([0, 1, 2, 2]), {0: 0, 1: 0, 2: 1})
+    assert tdf == pytest.approx(2 * compute_tdf.VLINK_BW / compute_tdf.DEFAULT_CROSS_MACHINE_BW)
+    assert compute_tdf.compute_tdf(graph, np.array([0, 0, 1, 1]), {0: 0, 1: 0}) == 0
+
+
+def test_relative_load_without_bandwidth():
+    pair_links = np.array([[0, 3, 0], [3, 0, 2], [0, 2, 0]])
+    bw = np.array([[np.inf, 0, 0], [0, np.inf, 100], [0, 100, np.inf]], dtype=np.float64)
+    with np.errstate(all="raise"):
+        relative_load = compute_tdf.get_relative_load(pair_links, bw)
+    # Loaded pairs without bandwidth are infinitely loaded, unloaded ones are not loaded at all
+    assert relative_load[0, 1] == math.inf and relative_load[0, 2] == 0
+    assert relative_load[1, 2] == pytest.approx(2 * compute_tdf.VLINK_BW / 100)
+    assert not np.isnan(relative_load).any()
+
+
+@pytest.mark.parametrize("pm_num", [2, 3, 4])
+def test_refinement_lowers_tdf_within_imbalance(community_graph, pm_num):
+    node2pmid = get_scattered_partition(community_graph, pm_num)
+    refined = compute_tdf.refine_partition_tdf(community_graph, node2pmid, pm_num, imbalance=1.03)
+    assert get_pm_tdf(community_graph, refined, pm_num) < get_pm_tdf(community_graph, node2pmid, pm_num)
+    assert_within_imbalance(community_graph, node2pmid, refined, pm_num, 1.03)
+
+
+def test_refinement_relieves_the_slowest_pm_pair(community_graph, monkeypatch):
+    monkeypatch.setitem(compute_tdf.cross_machine_bw, (0, 1), 1000)
+    node2pmid = get_scattered_partition(community_graph, 3)
+    pair_links = compute_tdf.get_cross_machine_links(community_graph, node2pmid, 3)
+    refined = compute_tdf.refine_partition_tdf(community_graph, node2pmid, 3)
+    refined_pair_links = compute_tdf.get_cross_machine_links(community_graph, refined, 3)
+    assert refined_pair_links[0, 1] < pair_links[0, 1]
+    assert get_pm_tdf(community_graph, refined, 3) < get_pm_tdf(community_graph, node2pmid, 3)
+
+
+def test_refinement_without_bandwidth(community_graph, monkeypatch):
+    monkeypatch.setitem(compute_tdf.cross_machine_bw, (0, 1), 0)
+    node2pmid = get_scattered_partition(community_graph, 3)
+    assert get_pm_tdf(community_graph, node2pmid, 3) == math.inf
+    pair_links = compute_tdf.get_cross_machine_links(community_graph, node2pmid, 3)
+
+    with np.errstate(invalid="raise"):
+        refined = compute_tdf.refine_partition_tdf(community_graph, node2pmid, 3)
+    # Links move off the pair without bandwidth, without unbalancing the PMs
+    refined_pair_links = compute_tdf.get_cross_machine_links(community_graph, refined, 3)
+    assert refined_pair_links[0, 1] < pair_links[0, 1]
+    assert_within_imbalance(community_graph, node2pmid, refined, 3, 1.03)
+    assert not math.isnan(get_pm_tdf(community_graph, refined, 3))
+
+
+def test_refinement_keeps_a_single_pm(community_graph):
+    node2pmid = np.zeros(community_graph.node_num, dtype=np.int32)
+    assert np.array_equal(compute_tdf.refine_partition_tdf(community_graph, node2pmid, 1), node2pmid)
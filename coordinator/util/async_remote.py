@@ -0,0 +1,257 @@
+import os
+import time
+import asyncio
+import threading
+from .remote import SSH_KEEPALIVE_INTERVAL, SSH_RECV_SIZE, build_remote_command, parse_command_info, \
+    build_archive_command, get_extract_command, build_killable_command, build_kill_command, get_remote_pid_filepath
+
+# Operations in flight across all hosts, and channels open at once on one host
+# (sshd allows 10 sessions per connection by default)
+ASYNC_MAX_CONCURRENCY = 256
+ASYNC_PER_HOST_CONCURRENCY = 4
+ASYNC_CONNECT_TIMEOUT = 30
+
+
+def import_asyncssh():
+    # asyncssh is only needed by the asyncio executor, so it is imported on first use
+    try:
+        import asyncssh
+    except ImportError:
+        print("The asyncio remote executor requires asyncssh, please install it with `pip install asyncssh`")
+        exit(1)
+    return asyncssh
+
+
+class AsyncRemoteExecutor:
+    """
+    Runs commands and file transfers on many machines from a single event loop thread,
+    with one SSH connection per host kept open across calls.
+
+    Takes the same machines (anything with hostname, username, password and port, e.g. RemoteMachine)
+    and dict-of-commands / dict-of-paths arguments as the thread-based functions of remote.py,
+    and returns {hostname: result} where every result is a dict of
+    exit_status, stdout, stderr, duration (seconds) and error (None if the operation ran).
+    """
+
+    def __init__(self, max_concurrency=ASYNC_MAX_CONCURRENCY, per_host_concurrency=ASYNC_PER_HOST_CONCURRENCY,
+                 connect_timeout=ASYNC_CONNECT_TIMEOUT):
+        self.asyncssh = import_asyncssh()
+        self.per_host_concurrency = per_host_concurrency
+        self.connect_timeout = connect_timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.host_semaphores = {}
+        self.connect_locks = {}
+        self.connections = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def run(self, coro):
+        """Runs a coroutine on the event loop of the executor and waits for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def get_connection(self, machine):
+        hostname = machine.hostname
+        if hostname not in self.connect_locks:
+            self.connect_locks[hostname] = asyncio.Lock()
+        async with self.connect_locks[hostname]:
+            conn = self.connections.get(hostname)
+            if conn is None or conn.is_closed():
+                conn = await self.asyncssh.connect(
+                    hostname, port=machine.port, username=machine.username, password=machine.password,
+                    known_hosts=None, keepalive_interval=SSH_KEEPALIVE_INTERVAL,
+                    connect_timeout=self.connect_timeout)
+                self.connections[hostname] = conn
+        return conn
+
+    async def run_on_machine(self, machine, operation):
+        """Runs operation(conn) -> (exit_status, stdout, stderr) on machine within the concurrency limits."""
+        if machine.hostname not in self.host_semaphores:
+            self.host_semaphores[machine.hostname] = asyncio.Semaphore(self.per_host_concurrency)
+        async with self.semaphore, self.host_semaphores[machine.hostname]:
+            start_ts = time.time()
+            try:
+                conn = await self.get_connection(machine)
+                exit_status, stdout, stderr = await operation(conn)
+                error = None
+            except Exception as e:
+                # Any failure is only this host's, the other hosts keep their results
+                exit_status, stdout, stderr, error = None, "", "", str(e) or type(e).__name__
+            return {
+                "exit_status": exit_status,
+                "stdout": stdout,
+                "stderr": stderr,
+                "duration": time.time() - start_ts,
+                "error": error,
+            }
+
+    async def run_on_machines(self, machine2operation):
+        machines = list(machine2operation)
+        results = await asyncio.gather(
+            *(self.run_on_machine(machine, machine2operation[machine]) for machine in machines))
+        return {machine.hostname: result for machine, result in zip(machines, results)}
+
+    def connect_to_multiple_machines(self, machines):
+        """Connects to all machines (reusing live connections), the results tell which ones failed."""
+        async def connect(conn):
+            return 0, "", ""
+        return self.run(self.run_on_machines({machine: connect for machine in machines}))
+
+    def execute_command_on_multiple_machines(self, machines, commands):
+        """
+        :param commands: A dictionary where the key is the machine hostname and the value is a tuple:
+                         (command, working_directory, output_file, use_sudo).
+        """
+        def make_operation(machine):
+            command, working_dir, output_file, use_sudo = parse_command_info(commands[machine.hostname])
+            full_command = build_remote_command(command, working_dir, machine.password, output_file, use_sudo)
+
+            async def execute(conn):
+                # Output that is not valid UTF-8 is kept with replacement characters
+                result = await conn.run(full_command, check=False, errors="replace")
+                return result.exit_status, result.stdout, result.stderr
+            return execute
+
+        return self.run(self.run_on_machines(
+            {machine: make_operation(machine) for machine in machines if machine.hostname in commands}))
+
+    def stream_command_on_multiple_machines(self, machines, commands, log_dir=None, line_callback=None,
+                                            timeout=None):
+        """
+        Like execute_command_on_multiple_machines, but streams the output lines of each machine into
+        <log_dir>/<hostname>.log (stderr lines prefixed with [stderr]) and to line_callback(hostname, stream, line)
+        as they arrive, instead of returning them. A command running longer than timeout seconds fails,
+        and is killed with its whole process group.
+        """
+        def make_operation(machine):
+            command, working_dir, output_file, use_sudo = parse_command_info(commands[machine.hostname])
+            full_command = build_remote_command(command, working_dir, machine.password, output_file, use_sudo)
+            if timeout is not None:
+                pid_filepath = get_remote_pid_filepath()
+                full_command = build_killable_command(full_command, pid_filepath)
+            log_filepath = os.path.join(log_dir, f"{machine.hostname}.log") if log_dir else None
+
+            async def stream(conn):
+                with open(log_filepath if log_filepath else os.devnull, 'w', buffering=1) as log_file:
+                    async def pump(reader, stream_name):
+                        async for line in reader:
+                            # The reader yields an empty string at EOF, an empty line is still "\n"
+                            if not line:
+                                break
+                            line = line.rstrip("\n")
+                            log_file.write(f"{line}\n" if stream_name == "stdout" else f"[stderr] {line}\n")
+                            if line_callback:
+                                line_callback(machine.hostname, stream_name, line)
+
+                    async with conn.create_process(full_command, errors="replace") as process:
+                        try:
+                            await asyncio.wait_for(asyncio.gather(
+                                pump(process.stdout, "stdout"), pump(process.stderr, "stderr"), process.wait()),
+                                timeout)
+                        except asyncio.TimeoutError:
+                            await conn.run(build_kill_command(pid_filepath, machine.password), check=False)
+                            raise
+                        return process.exit_status, "", ""
+            return stream
+
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        return self.run(self.run_on_machines(
+            {machine: make_operation(machine) for machine in machines if machine.hostname in commands}))
+
+    def send_file_to_multiple_machines(self, machines, file_paths):
+        """
+        :param file_paths: A dictionary where the key is the machine hostname and the value is a tuple:
+                           (local_path, remote_path, recursive).
+        """
+        def make_operation(machine):
+            local_path, remote_path, recursive = file_paths[machine.hostname]
+
+            async def send(conn):
+                await self.asyncssh.scp(local_path, (conn, remote_path), recurse=recursive)
+                return 0, "", ""
+            return send
+
+        return self.run(self.run_on_machines(
+            {machine: make_operation(machine) for machine in machines if machine.hostname in file_paths}))
+
+    def receive_file_from_multiple_machines(self, machines, file_paths):
+        """
+        :param file_paths: A dictionary where the key is the machine hostname and the value is a tuple:
+                           (remote_path, local_path, recursive).
+        """
+        def make_operation(machine):
+            remote_path, local_path, recursive = file_paths[machine.hostname]
+
+            async def receive(conn):
+                await self.asyncssh.scp((conn, remote_path), local_path, recurse=recursive)
+                return 0, "", ""
+            return receive
+
+        return self.run(self.run_on_machines(
+            {machine: make_operation(machine) for machine in machines if machine.hostname in file_paths}))
+
+    def receive_paths_from_multiple_machines(self, machines, path_lists):
+        """
+        Receives several files and directories from each machine as one compressed archive stream,
+        extracted locally while it is being received.
+
+        :param path_lists: A dictionary where the key is the machine hostname and the value is a tuple:
+                           (list of remote paths, local directory).
+        """
+        def make_operation(machine):
+            remote_paths, local_dir = path_lists[machine.hostname]
+
+            async def receive(conn):
+                os.makedirs(local_dir, exist_ok=True)
+                async with conn.create_process(build_archive_command(remote_paths), encoding=None) as process:
+                    stderr_task = asyncio.ensure_future(process.stderr.read())
+                    # Wait for the magic number to choose the decompressor
+                    magic = b""
+                    while len(magic) < 4 and (data := await process.stdout.read(SSH_RECV_SIZE)):
+                        magic += data
+                    extractor = await asyncio.create_subprocess_exec(
+                        *get_extract_command(local_dir, magic), stdin=asyncio.subprocess.PIPE)
+                    data = magic
+                    while data:
+                        extractor.stdin.write(data)
+                        await extractor.stdin.drain()
+                        data = await process.stdout.read(SSH_RECV_SIZE)
+                    extractor.stdin.close()
+                    await process.wait()
+                    extract_status = await extractor.wait()
+                    stderr = (await stderr_task).decode(errors="replace")
+                exit_status = process.exit_status if extract_status == 0 else extract_status
+                return exit_status, "", stderr
+            return receive
+
+        return self.run(self.run_on_machines(
+            {machine: make_operation(machine) for machine in machines if machine.hostname in path_lists}))
+
+    def close(self, hostnames=None):
+        """Closes the connections to hostnames (all hosts if None)."""
+        async def close_connections():
+            for hostname in list(self.connections) if hostnames is None else hostnames:
+                conn = self.connections.pop(hostname, None)
+                if conn is not None:
+                    conn.close()
+                    await conn.wait_closed()
+        self.run(close_connections())
+
+    def shutdown(self):
+        self.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+def print_host_results(results, label):
+    """Prints a summary line and the failures of {hostname: result} returned by AsyncRemoteExecutor."""
+    failed = {hostname: result for hostname, result in results.items()
+              if result["error"] is not None or result["exit_status"] != 0}
+    durations = [result["duration"] for result in results.values()]
+    print(f"{label}: {len(results) - len(failed)}/{len(results)} hosts succeeded, "
+          f"slowest {max(durations, default=0):.2f}s")
+    for hostname, result in sorted(failed.items()):
+        reason = result["error"] if result["error"] is not None else f"exit status {result['exit_status']}"
+        print(f"{hostname} failed ({reason}): {result['stderr'].strip()}")
@@ -0,0 +1,129 @@
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+from .async_remote import import_asyncssh, AsyncRemoteExecutor, print_host_results
+
+# In-process SSH server accepting any password, to test and benchmark the remote executors locally.
+# It listens on loopback addresses (127.0.0.0/8 on Linux), one per fake host.
+
+
+def create_fake_ssh_server_class(asyncssh):
+    class AnyPasswordSSHServer(asyncssh.SSHServer):
+        def begin_auth(self, username):
+            return True
+
+        def password_auth_supported(self):
+            return True
+
+        def validate_password(self, username, password):
+            return True
+    return AnyPasswordSSHServer
+
+
+def make_process_handler(run_commands, command_delay):
+    """
+    Handles an exec request: runs the command in a local shell if run_commands is set,
+    otherwise just echoes it back after command_delay seconds.
+    """
+    async def handle_process(process):
+        if run_commands:
+            proc = await asyncio.create_subprocess_shell(
+                process.command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+
+            # Forward the output as it is produced, like a real sshd
+            async def forward(reader, writer):
+                while data := await reader.read(1 << 16):
+                    writer.write(data)
+            await asyncio.gather(forward(proc.stdout, process.stdout), forward(proc.stderr, process.stderr))
+            process.exit(await proc.wait())
+        else:
+            await asyncio.sleep(command_delay)
+            process.stdout.write(f"{process.command}\n".encode())
+            process.exit(0)
+    return handle_process
+
+
+def get_fake_hostnames(host_num):
+    return [f"127.0.{1 + i // 250}.{1 + i % 250}" for i in range(host_num)]
+
+
+class FakeSSHServer:
+    """Fake SSH server on its own event loop thread, serving SCP/SFTP from the local file system."""
+
+    def __init__(self, hostnames, port=0, run_commands=True, command_delay=0):
+        asyncssh = import_asyncssh()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        host_key = asyncssh.generate_private_key("ssh-ed25519")
+
+        async def create_server():
+            return await asyncssh.create_server(
+                create_fake_ssh_server_class(asyncssh), list(hostnames), port,
+                server_host_keys=[host_key], process_factory=make_process_handler(run_commands, command_delay),
+                sftp_factory=True, allow_scp=True, encoding=None)
+        self.acceptor = asyncio.run_coroutine_threadsafe(create_server(), self.loop).result()
+        # With port 0, every address gets its own free port
+        self.ports = {sock.getsockname()[0]: sock.getsockname()[1] for sock in self.acceptor.sockets}
+
+    def close(self):
+        async def close_acceptor():
+            self.acceptor.close()
+            await self.acceptor.wait_closed()
+        asyncio.run_coroutine_threadsafe(close_acceptor(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class FakeMachine:
+    def __init__(self, hostname, port):
+        self.hostname = hostname
+        self.username = "fake"
+        self.password = "fake"
+        self.port = port
+
+
+def benchmark(host_num, command_delay, rounds, per_host_concurrency):
+    hostnames = get_fake_hostnames(host_num)
+    server = FakeSSHServer(hostnames, run_commands=False, command_delay=command_delay)
+    machines = [FakeMachine(hostname, server.ports[hostname]) for hostname in hostnames]
+    executor = AsyncRemoteExecutor(per_host_concurrency=per_host_concurrency)
+    try:
+        cur_ts = time.time()
+        print_host_results(executor.connect_to_multiple_machines(machines), "Connect")
+        print(f"Connecting to {host_num} hosts consumes {time.time() - cur_ts:.2f}s")
+
+        for i in range(rounds):
+            cur_ts = time.time()
+            results = executor.execute_command_on_multiple_machines(
+                machines, {hostname: (f"echo {hostname}", "/tmp") for hostname in hostnames})
+            print_host_results(results, f"Execute round {i}")
+            print(f"Executing on {host_num} hosts consumes {time.time() - cur_ts:.2f}s")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            local_path = os.path.join(tmp_dir, "payload")
+            with open(local_path, 'wb') as f:
+                f.write(os.urandom(1 << 16))
+            cur_ts = time.time()
+            results = executor.send_file_to_multiple_machines(
+                machines, {hostname: (local_path, os.path.join(tmp_dir, f"payload.{hostname}"), False)
+                           for hostname in hostnames})
+            print_host_results(results, "Send")
+            print(f"Sending 64KB to {host_num} hosts consumes {time.time() - cur_ts:.2f}s")
+    finally:
+        executor.shutdown()
+        server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the asyncio remote executor against a fake SSH server')
+    parser.add_argument('-n', '--host-num', type=int, default=500, help='Number of fake hosts')
+    parser.add_argument('-d', '--command-delay', type=float, default=0.1, help='Seconds every fake command takes')
+    parser.add_argument('-r', '--rounds', type=int, default=3, help='Rounds of commands on all hosts')
+    parser.add_argument('-c', '--per-host-concurrency', type=int, default=4, help='Channels open at once per host')
+    args = parser.parse_args()
+    benchmark(args.host_num, args.command_delay, args.rounds, args.per_host_concurrency)
@@ -3,61 +3,210 @@ import os
 import time
 import math
 import csv
-import concurrent
-from .partition.partition_topo_vm import partition_graph_across_vm
+import numpy as np
+import multiprocessing
+import concurrent.futures
+from .partition.partition_topo_vm import partition_graph_across_vm, get_vm_partition_options
+from .partition.algorithm import create_metis_graph, build_partition_tree, \
+    get_edge_balance_weights, refine_partition_max_load
+from .partition.shared_graph import SharedGraph, attach_shared_graph
+from .partition.partition_cache import hash_graph, load_cached_partition, save_cached_partition
+from .partition.streaming import count_links
 
 ################## E_max_n derivation functions ##################
 
-def get_partition_stats(nodes, adjacency_list, node2serverid, n):
-    # Count the number of edges in each partition as well dangling edges
-    partition_stats = {}
-    for _, server_id in node2serverid.items():
-        if server_id not in partition_stats:
-            partition_stats[server_id] = {
-                "node_count": 0,
-                "edge_count": 0,
-                "dangling_edges": 0
-            }
-    # Count nodes in each partition
-    for node in nodes:
-        server_id = node2serverid[node]
-        if server_id in partition_stats:
-            partition_stats[server_id]["node_count"] += 1
+def get_partition_stats(graph, node2serverid, n):
+    """
+    Node count, link count and dangling link count of every partition. A link inside a partition
+    counts once for it, a link across two partitions counts once (as a dangling link) for each.
+    The links are read chunk by chunk, so graph may also be a TopoStream or MaskedTopoStream.
+    """
+    node2serverid = np.asarray(node2serverid)
+    server_num = max(n, int(node2serverid.max(initial=-1)) + 1)
+    node_counts = np.bincount(node2serverid, minlength=server_num)
+    dangling_edges = np.zeros(server_num, dtype=np.int64)
+    edge_counts = np.zeros(server_num, dtype=np.int64)
+    for edge_src, edge_dst in graph.iter_edge_chunks():
+        not_loop = edge_src != edge_dst
+        src_server_ids = node2serverid[edge_src[not_loop]]
+        dst_server_ids = node2serverid[edge_dst[not_loop]]
+        cross = src_server_ids != dst_server_ids
+        dangling_edges += np.bincount(src_server_ids[cross], minlength=server_num) + \
+            np.bincount(dst_server_ids[cross], minlength=server_num)
+        edge_counts += np.bincount(src_server_ids[~cross], minlength=server_num)
+    edge_counts += dangling_edges
+    partition_stats = {
+        server_id: {
+            "node_count": int(node_counts[server_id]),
+            "edge_count": int(edge_counts[server_id]),
+            "dangling_edges": int(dangling_edges[server_id])
+        } for server_id in np.flatnonzero(node_counts).tolist()
+    }
+    return partition_stats
+
+
+def _partition_for_E_max(graph, n, metis_graph, options, tree=None):
+    """Returns E_max(n), the partition and the partitioning time, and E_max(n) before the edge-balancing refinement if any."""
+    get_max_edge_count = lambda partition_stats: \
+        max(partition_stats[server_id]["edge_count"] for server_id in partition_stats)
+    start_time = time.time()
+    node2serverid = partition_graph_across_vm(
+        graph, n, 0, random=False, metis_graph=metis_graph, options=options, tree=tree,
+        refine_max_load=False)
+    partition_time = time.time() - start_time
+    # Refine here rather than in partition_graph_across_vm, to report E_max(n) before refinement
+    unrefined_max_edge_count = None
+    if options.get("balance", "nodes") == "edges" and n > 1:
+        unrefined_max_edge_count = get_max_edge_count(get_partition_stats(graph, node2serverid, n))
+        start_time = time.time()
+        node2serverid = refine_partition_max_load(graph, node2serverid, n)
+        partition_time += time.time() - start_time
+    max_edge_count = get_max_edge_count(get_partition_stats(graph, node2serverid, n))
+    return max_edge_count, node2serverid, partition_time, unrefined_max_edge_count
+
+
+def _E_max_task(shared_graph_handle, n, options):
+    """Runs in a planning worker: partitions the shared PM sub-graph into n parts and returns E_max(n)."""
+    graph, metis_graph = attach_shared_graph(shared_graph_handle)
+    return (n,) + _partition_for_E_max(graph, n, metis_graph, options)
+
+
+def get_planning_worker_num(exp_config):
+    # 0 (the default) means one worker per coordinator core
+    worker_num = exp_config.get("PlanningWorkerNum", 0)
+    if worker_num <= 0:
+        worker_num = os.cpu_count() or 1
+    return worker_num
+
+
+class EmaxEvaluator:
+    """
+    Derives E_max(n) of PM sub-graphs on demand. Values found in the partition cache are read back,
+    the others are derived by running the requested (PM, n) partitionings in one pool of worker_num
+    processes, which attach to the CSR/METIS arrays of the PM sub-graphs through shared memory.
+    The pool and the shared graphs are kept across calls to evaluate() until close().
+    With the "tree" partitioning method, one partition tree is built per PM sub-graph and
+    every n is cut from it in this process instead. The "stream" method also runs in this process,
+    and takes TopoStream or MaskedTopoStream sub-topologies as well, read link chunk by link chunk.
+    """
+
+    def __init__(self, pmid2graph, worker_num, options):
+        self.pmid2graph = pmid2graph
+        self.worker_num = worker_num
+        self.options = options
+        self.pmid2digest = {pmid: hash_graph(graph) for pmid, graph in pmid2graph.items()}
+        self.pmid2E_max_data = {pmid: {} for pmid in pmid2graph}
+        self.pmid2partitions = {pmid: {} for pmid in pmid2graph}
+        self.pmid2partition_num = {pmid: 0 for pmid in pmid2graph}
+        # E_max(n) before and after the edge-balancing refinement, for the partitions derived here
+        self.pmid2refinement = {pmid: {} for pmid in pmid2graph}
+        self.pmid2metis_graph = {}
+        self.pmid2tree = {}
+        self.pmid2shared_graph = {}
+        self.executor = None
+        for pmid, graph in pmid2graph.items():
+            # Every link is inside the single partition when n = 1
+            self.pmid2E_max_data[pmid][1] = count_links(graph)
+            self.pmid2partitions[pmid][1] = np.zeros(graph.node_num, dtype=np.int32)
+
+    def evaluate(self, pmid2n_values):
+        """Derives E_max(n) for every PM and every n in pmid2n_values[pmid] not derived yet."""
+        pmid2missing_n_values = {}
+        for pmid, n_values in pmid2n_values.items():
+            cached_num = 0
+            for n in n_values:
+                if n in self.pmid2E_max_data[pmid] or n in pmid2missing_n_values.get(pmid, []):
+                    continue
+                cached = load_cached_partition(
+                    self.pmid2digest[pmid], self.options, n, self.pmid2graph[pmid].node_num)
+                if cached is None:
+                    pmid2missing_n_values.setdefault(pmid, []).append(n)
+                else:
+                    self.pmid2partitions[pmid][n], self.pmid2E_max_data[pmid][n] = cached
+                    cached_num += 1
+            if cached_num > 0:
+                print(f"E_max derivation for pm #{pmid}: {cached_num} values read from the partition cache")
+        if len(pmid2missing_n_values) == 0:
+            return
+
+        start_time = time.time()
+        if self.options["method"] == "tree":
+            for pmid, n_values in pmid2missing_n_values.items():
+                graph = self.pmid2graph[pmid]
+                if pmid not in self.pmid2tree:
+                    tree_start_time = time.time()
+                    vwgt = get_edge_balance_weights(graph, self.options["dangling_cost"]) \
+                        if self.options.get("balance", "nodes") == "edges" else None
+                    self.pmid2tree[pmid] = build_partition_tree(
+                        graph, max([self.options["leaf_num"]] + n_values), vwgt=vwgt)
+                    print(f"Partition tree of pm #{pmid} with {self.pmid2tree[pmid]['leaf_num']} leaves built in {time.time() - tree_start_time:.3f}s")
+                for n in n_values:
+                    self._add_result(pmid, n, *_partition_for_E_max(
+                        graph, n, None, self.options, self.pmid2tree[pmid]))
+        elif self.options["method"] == "stream":
+            for pmid, n_values in pmid2missing_n_values.items():
+                for n in n_values:
+                    self._add_result(pmid, n, *_partition_for_E_max(
+                        self.pmid2graph[pmid], n, None, self.options))
+        elif self.worker_num == 1:
+            for pmid, n_values in pmid2missing_n_values.items():
+                if pmid not in self.pmid2metis_graph:
+                    self.pmid2metis_graph[pmid] = create_metis_graph(self.pmid2graph[pmid])
+                for n in n_values:
+                    self._add_result(pmid, n, *_partition_for_E_max(
+                        self.pmid2graph[pmid], n, self.pmid2metis_graph[pmid], self.options))
         else:
-            partition_stats[server_id] = {
-                "node_count": 1,
-                "edge_count": 0,
-                "dangling_edges": 0
-            }
+            if self.executor is None:
+                # Spawned rather than forked, as the SSH connection pool may have live threads.
+                # The workers only need the shared-memory handles, nothing inherited.
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.worker_num, mp_context=multiprocessing.get_context("spawn"))
+            future2pmid = {}
+            for pmid, n_values in pmid2missing_n_values.items():
+                if pmid not in self.pmid2shared_graph:
+                    self.pmid2shared_graph[pmid] = SharedGraph(self.pmid2graph[pmid])
+                for n in n_values:
+                    future = self.executor.submit(
+                        _E_max_task, self.pmid2shared_graph[pmid].handle, n, self.options)
+                    future2pmid[future] = pmid
+            for future in concurrent.futures.as_completed(future2pmid):
+                self._add_result(future2pmid[future], *future.result())
+        partition_num = sum(len(n_values) for n_values in pmid2missing_n_values.values())
+        print(f"E_max derivation: {partition_num} partitionings with {self.worker_num} workers in {time.time() - start_time:.3f}s")
 
-    # Count edges in each partition
-    for u in nodes:
-        for v in adjacency_list[u]:
-            if u >= v:
-                continue
-            u_server_id = node2serverid[u]
-            v_server_id = node2serverid[v]
-            if u_server_id == v_server_id:
-                partition_stats[u_server_id]["edge_count"] += 1
-            else:
-                partition_stats[u_server_id]["edge_count"] += 1
-                partition_stats[u_server_id]["edge_count"] += 1
-                partition_stats[u_server_id]["dangling_edges"] += 1
-                partition_stats[v_server_id]["dangling_edges"] += 1
-    # print(partition_stats)
-    return partition_stats
+    def _add_result(self, pmid, n, max_edge_count, node2serverid, partition_time, unrefined_max_edge_count):
+        self.pmid2E_max_data[pmid][n] = max_edge_count
+        if unrefined_max_edge_count is not None:
+            self.pmid2refinement[pmid][n] = (unrefined_max_edge_count, max_edge_count)
+        self.pmid2partitions[pmid][n] = node2serverid
+        self.pmid2partition_num[pmid] += 1
+        save_cached_partition(self.pmid2digest[pmid], self.options, n, node2serverid, max_edge_count)
 
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        for shared_graph in self.pmid2shared_graph.values():
+            shared_graph.close()
+        self.pmid2shared_graph = {}
 
-def get_E_max_data_for_pm_topo(nodes, adjacency_list, pm_core_num):
-    E_max_data = {}
-    n_range = range(1, pm_core_num + 1)
-    for n in n_range:
-        # Partition the topology with METIS
-        node2serverid = partition_graph_across_vm(nodes, adjacency_list, n, 0, random=False)
-        partition_stats = get_partition_stats(nodes, adjacency_list, node2serverid, n)
-        max_edge_count = max(partition_stats[server_id]["edge_count"] for server_id in partition_stats)
-        E_max_data[n] = max_edge_count
-    return E_max_data
+
+def get_E_max_data_for_all_pm_topos(pmid2graph, pmid2n_values, worker_num, options=None):
+    """Returns E_max(n) and the node->VM vector for every PM sub-graph and every n in pmid2n_values[pmid]."""
+    evaluator = EmaxEvaluator(pmid2graph, worker_num, options or get_vm_partition_options({}))
+    try:
+        evaluator.evaluate(pmid2n_values)
+    finally:
+        evaluator.close()
+    pmid2E_max_data = {
+        pmid: {n: evaluator.pmid2E_max_data[pmid][n] for n in sorted(pmid2n_values[pmid])}
+        for pmid in pmid2graph
+    }
+    pmid2partitions = {
+        pmid: {n: evaluator.pmid2partitions[pmid][n] for n in pmid2n_values[pmid]}
+        for pmid in pmid2graph
+    }
+    return pmid2E_max_data, pmid2partitions
 
 ################## Optimization functions ##################
 
@@ -89,45 +238,101 @@ def Gain_sn(n, m, V, E_max, X, Y, Z, Theta, m_req):
     gain_sn = numerator / dominator
     return gain_sn
 
-def get_optimal_vm_allocation_for_pm(
-    pmid, nodes, adjacency_list,
-    pm_config, exp_config,
-    FIXED_VM_NUM, FIXED_M, FIXED_BBNS_NUM):
-
-    # Parse the PM config
-    pm_core_num = pm_config["coreNum"]
-    m_platform = pm_config["Memory"]
-    X = pm_config["Parameters"]["X"]
-    Y = pm_config["Parameters"]["Y"]
-    Z = pm_config["Parameters"]["Z"]
+def get_pm_model(pm_config, exp_config, FIXED_BBNS_NUM):
+    """Returns the memory and time model parameters of a PM, and the Gain function to optimize."""
     theta_m_table = {
         int(m): theta_m for m, theta_m in \
             pm_config["Parameters"]["theta_m_table"].items()
     }
-    Theta = lambda m: theta_m_table[m]
+    Gain = Gain_sn if FIXED_BBNS_NUM == 0 else Gain_mvs
+    return {
+        "m_platform": pm_config["Memory"],
+        "m_req": exp_config["MemoryReq(GB)"],
+        "X": pm_config["Parameters"]["X"],
+        "Y": pm_config["Parameters"]["Y"],
+        "Z": pm_config["Parameters"]["Z"],
+        "theta_m_table": theta_m_table,
+        "Gain": Gain,
+        "T": T_sn if Gain is Gain_sn else T_mvs,
+    }
 
-    # Constants
-    m_req = exp_config["MemoryReq(GB)"]
+def get_candidate_vm_nums(pm_config, model, FIXED_VM_NUM, FIXED_M):
+    """
+    Returns {n: smallest Theta(m)} over the n values that can be optimal, i.e. such that an allowed m
+    satisfies m_req <= n * m <= m_platform (n and m pinned by FIXED_VM_NUM and FIXED_M if set).
+    """
+    candidate_vm_nums = {}
+    for n in range(1, pm_config["coreNum"]):
+        if FIXED_VM_NUM > 0 and n != FIXED_VM_NUM:
+            continue
+        for m, theta_m in model["theta_m_table"].items():
+            if FIXED_M > 0 and m != FIXED_M:
+                continue
+            if n * m < model["m_req"] or n * m > model["m_platform"]:
+                continue
+            candidate_vm_nums[n] = min(theta_m, candidate_vm_nums.get(n, theta_m))
+    return candidate_vm_nums
 
-    # # If VM number is fixed, use the fixed VM number
-    # if FIXED_VM_NUM > 0:
-    #     # Set m to the key which is nearest to m_req/FIXED_VM_NUM in the theta_m_table
-    #     m = min(theta_m_table.keys(), key=lambda x: abs(x - m_req / FIXED_VM_NUM))
-    #     return search_results, (FIXED_VM_NUM, m, min(4, int(pm_core_num / FIXED_VM_NUM)))
+def Gain_upper_bound(n, theta_m_min, V, E_max_1, model, E_max_n_lb=None):
+    """
+    Upper bound of Gain(n, m) before E_max(n) is known. Every link is counted in at least one
+    partition, so E_max(n) >= E_max(1) / n unless a tighter E_max_n_lb is given, and T(n) grows with E_max(n).
+    """
+    X, Y, Z, T = model["X"], model["Y"], model["Z"], model["T"]
+    T_1 = T(1, V, lambda _: E_max_1, X, Y, Z)
+    if T_1 == 0:
+        return 0
+    if E_max_n_lb is None:
+        E_max_n_lb = E_max_1 / n
+    T_n_lb = T(n, V, lambda _: E_max_n_lb, X, Y, Z)
+    return (T_1 - T_n_lb) / T_1 * model["m_req"] / (n * theta_m_min)
 
-    # Get the V and E_max(n) for the topology
-    V = len(nodes)
-    E_max_data = get_E_max_data_for_pm_topo(nodes, adjacency_list, pm_core_num)
-    print(f"E_max data for pm #{pmid}: {E_max_data}")
-    E_max = lambda n: E_max_data[n]
+def get_geometric_samples(n_values, ratio=2):
+    """Picks the n values closest to ratio, ratio^2, ... among n_values, along with the smallest and largest ones."""
+    n_values = sorted(n_values)
+    if len(n_values) == 0:
+        return []
+    samples = {n_values[0], n_values[-1]}
+    target = ratio
+    while target < n_values[-1]:
+        samples.add(min(n_values, key=lambda n: (abs(math.log(n / target)), n)))
+        target *= ratio
+    return sorted(samples)
 
-    # Setup the T and M models and Gain computation functions
-    # T_mvs = lambda n, V, E_max: compute_T_mvs(n, V, E_max, X, Y, Z)
-    # T_sn = lambda n, V, E_max: compute_T_sn(n, V, E_max, X, Y, Z)
-    # M_mvs = lambda n, m: compute_M_mvs(n, m)
-    # Gain_mvs = lambda n, m: compute_gain_mvs(n, m, T_mvs, M_mvs, m_req)
-    # Gain_sn = lambda n, m: compute_gain_sn(n, m, T_sn, M_mvs, m_req)
-    Gain = Gain_sn if FIXED_BBNS_NUM == 0 else Gain_mvs
+def fit_E_max_curve(E_max_samples, min_band=0.02):
+    """
+    Fits E_max(n) by piecewise linear interpolation of the samples in log-log space.
+    Returns the estimator and its relative error band, or None if there is nothing to fit.
+    The band is twice the largest error of predicting an inner sample from its two neighbors
+    (leave-one-out), and at least min_band, as points between samples are closer to them.
+    """
+    sample_ns = sorted(E_max_samples)
+    if len(sample_ns) < 3 or min(E_max_samples.values()) <= 0:
+        return None
+    log_n = np.log(sample_ns)
+    log_E_max = np.log([E_max_samples[n] for n in sample_ns])
+
+    def interpolate(x, xs, ys):
+        # Extrapolate beyond the last sample along the last segment
+        if x > xs[-1]:
+            return ys[-1] + (ys[-1] - ys[-2]) / (xs[-1] - xs[-2]) * (x - xs[-1])
+        return np.interp(x, xs, ys)
+
+    band = 0
+    for i in range(1, len(sample_ns) - 1):
+        xs, ys = np.delete(log_n, i), np.delete(log_E_max, i)
+        predicted = math.exp(interpolate(log_n[i], xs, ys))
+        band = max(band, abs(predicted - E_max_samples[sample_ns[i]]) / E_max_samples[sample_ns[i]])
+    estimate = lambda n: math.exp(interpolate(math.log(n), log_n, log_E_max))
+    return estimate, max(2 * band, min_band)
+
+def search_vm_allocation(pm_config, model, V, E_max_data, FIXED_VM_NUM, FIXED_M):
+    """Searches the (n, m) pair that maximizes Gain, over the n values E_max(n) was derived for."""
+    theta_m_table = model["theta_m_table"]
+    Theta = lambda m: theta_m_table[m]
+    E_max = lambda n: E_max_data[n]
+    X, Y, Z, Gain, m_req, m_platform = \
+        model["X"], model["Y"], model["Z"], model["Gain"], model["m_req"], model["m_platform"]
 
     # Search for the optimal n and m value that maximizes Gain
     n_opt = 1
@@ -135,7 +340,7 @@ def get_optimal_vm_allocation_for_pm(
     m_extra_opt = n_opt * Theta(m_opt)
     # max_gain = Gain(n_opt, m_opt, V, E_max, X, Y, Z, Theta, m_req)
     max_gain = -1
-    search_n_range = range(1, pm_core_num)
+    search_n_range = [n for n in range(1, pm_config["coreNum"]) if n in E_max_data]
     search_m_range = list(theta_m_table.keys())
     search_results = []
     for n in search_n_range:
@@ -156,12 +361,201 @@ def get_optimal_vm_allocation_for_pm(
                 n_opt = n
                 m_opt = m
                 m_extra_opt = m_extra
-    vcpu_num_opt = min(8, int(pm_core_num / n_opt))
+    vcpu_num_opt = min(8, int(pm_config["coreNum"] / n_opt))
     optimal_result = (n_opt, m_opt, vcpu_num_opt)
+    return search_results, optimal_result, max_gain
+
+def get_E_max_data_by_branch_and_bound(
+    evaluator, pm_config_list, exp_config,
+    FIXED_VM_NUM, FIXED_M, FIXED_BBNS_NUM):
+    """
+    Derives E_max(n) lazily: only for candidate n values, best upper bound first, in rounds of
+    up to worker_num partitionings over all PMs. An n is pruned once its Gain upper bound falls
+    below the best Gain found so far on its PM, since it can not be optimal any more.
+
+    With "EmaxEstimation": "sampled", E_max(n) is first derived at a geometric sample of the
+    candidates and fitted; the other candidates are then derived in order of their Gain estimated
+    from the fitted curve, so that the neighborhood of the Gain maximum comes first. The fit is no
+    guaranteed bound, so pruning still uses E_max(n) >= E_max(1) / n and the chosen n is the exact one.
+    """
+    pmid2model = {}
+    pmid2pending = {}
+    pmid2candidate_vm_nums = {}
+    for pmid, graph in evaluator.pmid2graph.items():
+        model = get_pm_model(pm_config_list[pmid], exp_config, FIXED_BBNS_NUM)
+        candidate_vm_nums = get_candidate_vm_nums(pm_config_list[pmid], model, FIXED_VM_NUM, FIXED_M)
+        E_max_1 = evaluator.pmid2E_max_data[pmid][1]
+        bounds = {
+            n: Gain_upper_bound(n, theta_m_min, graph.node_num, E_max_1, model)
+            for n, theta_m_min in candidate_vm_nums.items()
+        }
+        pmid2model[pmid] = model
+        pmid2pending[pmid] = sorted(bounds.items(), key=lambda x: (-x[1], x[0]))
+        pmid2candidate_vm_nums[pmid] = candidate_vm_nums
+
+    pmid2max_gain = {pmid: -1 for pmid in pmid2pending}
+    def update_max_gain(pmid):
+        _, _, pmid2max_gain[pmid] = search_vm_allocation(
+            pm_config_list[pmid], pmid2model[pmid], evaluator.pmid2graph[pmid].node_num,
+            evaluator.pmid2E_max_data[pmid], FIXED_VM_NUM, FIXED_M)
+
+    if exp_config.get("EmaxEstimation", "exact") == "sampled":
+        pmid2samples = {
+            pmid: get_geometric_samples(candidate_vm_nums.keys())
+            for pmid, candidate_vm_nums in pmid2candidate_vm_nums.items()
+        }
+        evaluator.evaluate(pmid2samples)
+        for pmid, samples in pmid2samples.items():
+            update_max_gain(pmid)
+            E_max_data = evaluator.pmid2E_max_data[pmid]
+            fit = fit_E_max_curve({n: E_max_data[n] for n in [1] + samples})
+            if fit is None:
+                continue
+            estimate, band = fit
+            print(f"E_max(n) of pm #{pmid} fitted on n = {samples}: error band +/-{band * 100:.1f}% (leave-one-out)")
+            E_max_1 = E_max_data[1]
+            estimated_gains = {
+                n: Gain_upper_bound(
+                    n, pmid2candidate_vm_nums[pmid][n], evaluator.pmid2graph[pmid].node_num, E_max_1,
+                    pmid2model[pmid], max(E_max_1 / n, estimate(n)))
+                for n, _ in pmid2pending[pmid]
+            }
+            # Only the order changes, the candidates keep their guaranteed bounds for pruning
+            pmid2pending[pmid] = sorted(pmid2pending[pmid], key=lambda x: (-estimated_gains[x[0]], x[0]))
+
+    while True:
+        # Drop the candidates that can not beat the best Gain any more
+        for pmid in pmid2pending:
+            pmid2pending[pmid] = [
+                (n, bound) for n, bound in pmid2pending[pmid]
+                if bound >= pmid2max_gain[pmid] - 1e-9 and n not in evaluator.pmid2E_max_data[pmid]
+            ]
+        active_pmids = [pmid for pmid, pending in pmid2pending.items() if len(pending) > 0]
+        if len(active_pmids) == 0:
+            break
+        batch_size = max(1, math.ceil(evaluator.worker_num / len(active_pmids)))
+        evaluator.evaluate({
+            pmid: [n for n, _ in pmid2pending[pmid][:batch_size]] for pmid in active_pmids
+        })
+        for pmid in active_pmids:
+            update_max_gain(pmid)
+
+    for pmid in evaluator.pmid2graph:
+        evaluated_num = len(evaluator.pmid2E_max_data[pmid]) - 1
+        print(f"E_max derivation for pm #{pmid}: E_max(n) derived for {evaluated_num} of {len(pmid2candidate_vm_nums[pmid])} candidate VM numbers, {evaluator.pmid2partition_num[pmid]} partitionings run")
+        refinement = evaluator.pmid2refinement[pmid]
+        if len(refinement) > 0:
+            print(f"Edge-balancing refinement for pm #{pmid}: E_max(n) before -> after: " + \
+                ", ".join(f"n={n}: {before} -> {after}" for n, (before, after) in sorted(refinement.items())))
+    return {pmid: dict(sorted(E_max_data.items())) for pmid, E_max_data in evaluator.pmid2E_max_data.items()}
+
+################## Cross-PM capacity weighting ##################
+
+def get_planned_vm_num(model, candidate_vm_nums, V, E):
+    """
+    VM number the planner would pick for V nodes and E links on a PM, assuming balanced links (E_max(n) = E / n),
+    i.e. the candidate n with the best Gain for its cheapest m (1, as in search_vm_allocation, if none is feasible).
+    """
+    if len(candidate_vm_nums) == 0:
+        return 1
+    return max(candidate_vm_nums,
+               key=lambda n: (Gain_upper_bound(n, candidate_vm_nums[n], V, E, model), -n))
+
+def predict_pm_setup_time(model, candidate_vm_nums, V, E):
+    """Predicted construction time of V nodes and E links on a PM, with the VM number the planner would pick."""
+    n = get_planned_vm_num(model, candidate_vm_nums, V, E)
+    return model["T"](n, V, lambda n: E / n, model["X"], model["Y"], model["Z"]), n
+
+def get_pm_capacity_weights(graph, pm_config_list, exp_config, FIXED_VM_NUM, FIXED_M, FIXED_BBNS_NUM,
+                            iter_num=60):
+    """
+    Shares of the topology per PM that equalize the predicted construction times: finds by bisection the
+    time T at which the shares f_i with T_i(f_i * V, f_i * E) = T sum to 1 (T_i grows with f_i).
+    """
+    V = graph.node_num
+    E = count_links(graph)
+    models = [get_pm_model(pm_config, exp_config, FIXED_BBNS_NUM) for pm_config in pm_config_list]
+    candidates = [get_candidate_vm_nums(pm_config, model, FIXED_VM_NUM, FIXED_M)
+                  for pm_config, model in zip(pm_config_list, models)]
+    def predict(pmid, share):
+        return predict_pm_setup_time(models[pmid], candidates[pmid], share * V, share * E)[0]
+    def share_for_time(pmid, T):
+        lo, hi = 0.0, 1.0
+        for _ in range(iter_num):
+            mid = (lo + hi) / 2
+            if predict(pmid, mid) <= T:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+
+    pmids = range(len(pm_config_list))
+    T_lo, T_hi = 0.0, max(predict(pmid, 1) for pmid in pmids)
+    if T_hi == 0:
+        return [1 / len(pm_config_list)] * len(pm_config_list)
+    for _ in range(iter_num):
+        T_mid = (T_lo + T_hi) / 2
+        if sum(share_for_time(pmid, T_mid) for pmid in pmids) < 1:
+            T_lo = T_mid
+        else:
+            T_hi = T_mid
+    shares = [share_for_time(pmid, T_hi) for pmid in pmids]
+    return [share / sum(shares) for share in shares]
+
+def get_cross_pm_weights(graph, pm_config_list, exp_config, FIXED_VM_NUM, FIXED_M, FIXED_BBNS_NUM):
+    """Target shares of the PMs for cross-PM partitioning ("CrossPMWeighting": "equal" or "capacity"), None if equal."""
+    weighting = exp_config.get("CrossPMWeighting", "equal").lower()
+    if weighting == "equal" or len(pm_config_list) == 1:
+        return None
+    elif weighting == "capacity":
+        pm_weights = get_pm_capacity_weights(
+            graph, pm_config_list, exp_config, FIXED_VM_NUM, FIXED_M, FIXED_BBNS_NUM)
+        print(f"Capacity-weighted PM shares: {[round(w, 4) for w in pm_weights]}")
+        return pm_weights
+    else:
+        print(f"Cross-PM weighting {weighting} is not identified, exiting...")
+        exit(1)
+
+def print_pm_setup_time_predictions(pmid2graph, pm_config_list, exp_config, FIXED_VM_NUM, FIXED_M, FIXED_BBNS_NUM):
+    for pmid, graph in sorted(pmid2graph.items()):
+        model = get_pm_model(pm_config_list[pmid], exp_config, FIXED_BBNS_NUM)
+        candidate_vm_nums = get_candidate_vm_nums(pm_config_list[pmid], model, FIXED_VM_NUM, FIXED_M)
+        E = count_links(graph)
+        T, n = predict_pm_setup_time(model, candidate_vm_nums, graph.node_num, E)
+        print(f"PM {pmid}: predicted construction time {T:.2f}s with {n} VMs, E_max ~ {E / n:.0f}")
+
+def get_optimal_vm_allocation_for_pm(
+    pmid, graph,
+    pm_config, exp_config,
+    FIXED_VM_NUM, FIXED_M, FIXED_BBNS_NUM,
+    E_max_data=None):
+
+    # # If VM number is fixed, use the fixed VM number
+    # if FIXED_VM_NUM > 0:
+    #     # Set m to the key which is nearest to m_req/FIXED_VM_NUM in the theta_m_table
+    #     m = min(theta_m_table.keys(), key=lambda x: abs(x - m_req / FIXED_VM_NUM))
+    #     return search_results, (FIXED_VM_NUM, m, min(4, int(pm_core_num / FIXED_VM_NUM)))
+
+    # Get the V and E_max(n) for the topology
+    V = graph.node_num
+    if E_max_data is None:
+        evaluator = EmaxEvaluator(
+            {pmid: graph}, get_planning_worker_num(exp_config), get_vm_partition_options(exp_config))
+        try:
+            E_max_data = get_E_max_data_by_branch_and_bound(
+                evaluator, {pmid: pm_config}, exp_config,
+                FIXED_VM_NUM, FIXED_M, FIXED_BBNS_NUM)[pmid]
+        finally:
+            evaluator.close()
+    print(f"E_max data for pm #{pmid}: {E_max_data}")
+
+    model = get_pm_model(pm_config, exp_config, FIXED_BBNS_NUM)
+    search_results, optimal_result, _ = search_vm_allocation(
+        pm_config, model, V, E_max_data, FIXED_VM_NUM, FIXED_M)
     return search_results, optimal_result
 
 def get_optimal_vm_allocation_for_all_pms(
-    pmid2nodes, pmid2adjacencylist,
+    pmid2graph,
     pm_config_list, exp_config,
     FIXED_VM_NUM_PER_PM, FIXED_M, FIXED_BBNS_NUM):
 
@@ -170,27 +564,46 @@ def get_optimal_vm_allocation_for_all_pms(
     pmid2vmalloc = {}
     n_opt_legal = {}
 
+    # Derive E_max(n) of all PMs at once, only where it can change the optimum
+    evaluator = EmaxEvaluator(
+        pmid2graph, get_planning_worker_num(exp_config), get_vm_partition_options(exp_config))
+    try:
+        pmid2E_max_data = get_E_max_data_by_branch_and_bound(
+            evaluator, pm_config_list, exp_config,
+            FIXED_VM_NUM_PER_PM, FIXED_M, FIXED_BBNS_NUM)
+    finally:
+        evaluator.close()
+    pmid2partitions = evaluator.pmid2partitions
+
     def compute_vm_allocation(pmid):
         search_results, optimal_result = get_optimal_vm_allocation_for_pm(
-            pmid, pmid2nodes[pmid], pmid2adjacencylist[pmid],
+            pmid, pmid2graph[pmid],
             pm_config_list[pmid], exp_config,
-            FIXED_VM_NUM_PER_PM, FIXED_M, FIXED_BBNS_NUM
+            FIXED_VM_NUM_PER_PM, FIXED_M, FIXED_BBNS_NUM,
+            pmid2E_max_data[pmid]
         )
         n_opt, m_opt, vcpu_num_opt = optimal_result
         legal = n_opt <= pm_config_list[pmid]["maxVMNum"]
         return pmid, search_results, optimal_result, legal
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        results = list(executor.map(compute_vm_allocation, pmid2nodes.keys()))
+    results = [compute_vm_allocation(pmid) for pmid in pmid2graph.keys()]
     for pmid, search_results, vmalloc, legal in results:
         pmid2search_results[pmid] = search_results
         pmid2vmalloc[pmid] = vmalloc
         n_opt_legal[pmid] = legal
 
+    # Keep the partitions computed for planning so that the one deployed is the one modelled.
+    # Only the partition into n_opt VMs is kept unless all of them are asked for.
+    if not exp_config.get("KeepAllPlanningPartitions", False):
+        pmid2partitions = {
+            pmid: {pmid2vmalloc[pmid][0]: pmid2partitions[pmid][pmid2vmalloc[pmid][0]]}
+            for pmid in pmid2partitions
+        }
+
     # for pmid, pm_config in enumerate(pm_config_list):
     #     pmid = pm_config["id"]
     #     search_results, optimal_result = get_optimal_vm_allocation(
-    #         pmid2nodes[pmid], pmid2adjacencylist[pmid],
+    #         pmid2graph[pmid],
     #         pm_config_list[pmid], FIXED_VM_NUM_PER_PM, FIXED_BBNS_NUM
     #     )
     #     n_opt, m_opt = optimal_result[0], optimal_result[1]
@@ -201,7 +614,7 @@ def get_optimal_vm_allocation_for_all_pms(
     #         print(f"Warning: Optimal VM number {n_opt} exceeds maximum VM number {max_vm_num} on PM {pmid}. Skipping current test.")
     #         n_opt_legal[pmid] = False
 
-    return pmid2search_results, pmid2vmalloc, n_opt_legal
+    return pmid2search_results, pmid2vmalloc, n_opt_legal, pmid2partitions
 
 def output_vm_alloc_results(search_results, output_filepath):
     # Output the optimal n and m for each topology to a csv file into separate files
@@ -1,65 +1,69 @@
 import os
+import math
 import metis
 import shutil
 import argparse
+import itertools
 import subprocess
-import metis
+import tempfile
 import numpy as np
-import random
 import time
 from .fmt_convert import *
 
 ########################## Naive Partitioning ##########################
 
 def partition_naive(
-    nodes, num_partitions):
-
-    "Random Partitioning"
+    graph, num_partitions, tpwgts=None):
 
-    node2pmid = {}
-    for node in nodes:
-        node2pmid[node] = random.randint(0, num_partitions - 1)
+    "Random Partitioning, with part probabilities tpwgts if given"
 
-    return node2pmid
+    return np.random.choice(num_partitions, size=graph.node_num, p=tpwgts).astype(np.int32)
 
 ########################## METIS Partitioning ##########################
 
-def create_metis_adjacency_list(nodes, adjacency_list):
-    """Converts the adjacency list to METIS format where indices must be contiguous."""
-    node_to_index = {node: idx for idx, node in enumerate(nodes)}
-    index_to_node = {idx: node for node, idx in node_to_index.items()}
-    metis_adjacency_list = []
+def create_metis_graph(graph, vwgt=None):
+    """
+    Converts the CSR graph to the METIS graph structure, without going through Python lists.
+    vwgt optionally gives the vertex weights, as returned by get_edge_balance_weights.
+    """
+    # METIS does not accept self loops
+    row = np.repeat(np.arange(graph.node_num, dtype=np.int64), np.diff(graph.indptr))
+    not_loop = graph.indices != row
+    idx_dtype = np.dtype(metis.idx_t)
+    adjncy = np.ascontiguousarray(graph.indices[not_loop], dtype=idx_dtype)
+    xadj = np.zeros(graph.node_num + 1, dtype=idx_dtype)
+    np.cumsum(np.bincount(row[not_loop], minlength=graph.node_num), out=xadj[1:])
 
-    start_time = time.time()
-    neighbor_count = 0
-    for node in nodes:
-        # Convert the node's neighbors from IDs to indices
-        # neighbors_with_weight = [(node_to_index[neighbor], 1) for neighbor in adjacency_list[node]]  # Add default weight 1
-        # metis_adjacency_list.append(neighbors_with_weight)
-        neighbors = [node_to_index[neighbor] for neighbor in adjacency_list[node]]  # Add default weight 1
-        metis_adjacency_list.append(neighbors)
-        neighbor_count += 1
-        # if neighbor_count % 1000 == 0:
-        #     print(f"Neighbor count: {neighbor_count}")
-    # print("Adjacency list conversion completed. Time-cost: ", time.time() - start_time)
+    metis_graph = metis.METIS_Graph(
+        metis.idx_t(graph.node_num), metis.idx_t(1),
+        (metis.idx_t * len(xadj)).from_buffer(xadj),
+        (metis.idx_t * len(adjncy)).from_buffer(adjncy),
+        None, None, None)
+    if vwgt is not None:
+        metis_graph = with_vertex_weights(metis_graph, vwgt)
+    return metis_graph
 
-    return metis_adjacency_list, node_to_index, index_to_node
+
+def with_vertex_weights(metis_graph, vwgt):
+    """Returns the METIS graph with vertex weights vwgt, sharing its adjacency arrays."""
+    vwgt = np.ascontiguousarray(vwgt, dtype=np.dtype(metis.idx_t))
+    return metis_graph._replace(vwgt=(metis.idx_t * len(vwgt)).from_buffer(vwgt))
 
 
 def partition_metis(
-    nodes, adjacency_list, num_partitions, random=False):
+    graph, num_partitions, random=False, metis_graph=None, seed=None, tpwgts=None):
     
-    """Partitions the graph into num_partitions using METIS and writes each subgraph."""
-    node2serverid = {}
+    """
+    Partitions the graph into num_partitions using METIS and returns the node->part vector.
+    A METIS graph already built by create_metis_graph may be passed to skip the conversion.
+    tpwgts optionally gives the target share of each part (summing to 1).
+    """
     if num_partitions == 1:
-        server_id = 0
-        for node in nodes:
-            node2serverid[node] = 0
-        return node2serverid
+        return np.zeros(graph.node_num, dtype=np.int32)
 
-    # Convert adjacency list to METIS format with correct indices
-    start_time = time.time()
-    metis_adjacency_list, node_to_index, index_to_node = create_metis_adjacency_list(nodes, adjacency_list)
+    # Convert the CSR graph to METIS format
+    if metis_graph is None:
+        metis_graph = create_metis_graph(graph)
 
     # Partition the graph into num_partitions parts using METIS
     # print("Calling metis.part_graph...")
@@ -69,9 +73,11 @@ def partition_metis(
             if random:
                 # Generate an random integer as seed
                 seed = int(np.random.randint(0, 100))
-                _, parts = metis.part_graph(metis_adjacency_list, nparts=num_partitions, niter=20, recursive=True, seed=seed)
+                _, parts = metis.part_graph(metis_graph, nparts=num_partitions, tpwgts=tpwgts, niter=20, recursive=True, seed=seed)
+            elif seed is not None:
+                _, parts = metis.part_graph(metis_graph, nparts=num_partitions, tpwgts=tpwgts, seed=seed)
             else:
-                _, parts = metis.part_graph(metis_adjacency_list, nparts=num_partitions)
+                _, parts = metis.part_graph(metis_graph, nparts=num_partitions, tpwgts=tpwgts)
             break
         except metis.METIS_InputError as e:
             print(f"METIS Input Error: {e}")
@@ -79,12 +85,221 @@ def partition_metis(
             continue
     # print("Partitioning completed. Time-cost: ", time.time() - start_time)
 
-    for idx, part in enumerate(parts):
-        node = index_to_node[idx]  # Convert index back to original node ID
-        server_id = part
-        node2serverid[node] = server_id
+    return np.asarray(parts, dtype=np.int32)
+
+####################### Partition Tree Partitioning #######################
+
+def build_partition_tree(graph, max_num_partitions, metis_graph=None, vwgt=None):
+    """
+    Builds a balanced bisection tree of the graph with one recursive-bisection METIS run into
+    2^d >= max_num_partitions leaves. METIS numbers the parts of each bisection subtree
+    contiguously, so sorting the nodes by leaf lays the tree out in depth-first order.
+    With vertex weights vwgt, the bisections and later cuts balance weights instead of nodes.
+    """
+    leaf_num = 1 << max(0, int(max_num_partitions - 1).bit_length())
+    # Small graphs get fewer leaves, with at least two nodes each
+    metis_leaf_num = leaf_num
+    while metis_leaf_num > 1 and 2 * metis_leaf_num > graph.node_num:
+        metis_leaf_num //= 2
+    if metis_leaf_num == 1:
+        leaves = np.zeros(graph.node_num, dtype=np.int32)
+    else:
+        if metis_graph is None:
+            metis_graph = create_metis_graph(graph)
+        if vwgt is not None:
+            metis_graph = with_vertex_weights(metis_graph, vwgt)
+        _, leaves = metis.part_graph(metis_graph, nparts=metis_leaf_num, recursive=True)
+        leaves = np.asarray(leaves, dtype=np.int32)
+    tree = {
+        "leaf_num": leaf_num,
+        "order": np.argsort(leaves, kind="stable").astype(np.int32),
+    }
+    if vwgt is not None:
+        tree["weights"] = np.asarray(vwgt, dtype=np.int64)[tree["order"]]
+    return tree
+
+
+def cut_partition_tree(tree, num_partitions):
+    """Cuts the depth-first node order of the tree into num_partitions contiguous parts of equal size (or weight)."""
+    order = tree["order"]
+    parts = np.empty(len(order), dtype=np.int32)
+    if "weights" in tree:
+        # Every node goes to the chunk its weight midpoint falls in
+        weights = tree["weights"]
+        midpoints = np.cumsum(weights) - weights / 2
+        chunks = np.floor(midpoints * num_partitions / max(weights.sum(), 1)).astype(np.int64)
+        parts[order] = np.minimum(chunks, num_partitions - 1)
+    else:
+        parts[order] = np.arange(len(order), dtype=np.int64) * num_partitions // max(len(order), 1)
+    return parts
+
+
+def refine_partition_boundary(graph, parts, num_partitions, imbalance=1.03, passes=2, vwgt=None):
+    """
+    Greedy boundary refinement: moves each boundary node to the part holding most of its neighbors
+    when that cuts fewer links and keeps every part within imbalance of the average size
+    (of the average weight if vwgt is given).
+    """
+    parts = np.array(parts, dtype=np.int32)
+    weights = np.ones(graph.node_num, dtype=np.int64) if vwgt is None else np.asarray(vwgt, dtype=np.int64)
+    node_nums = np.bincount(parts, minlength=num_partitions)
+    sizes = np.bincount(parts, weights=weights, minlength=num_partitions).astype(np.int64)
+    max_size = math.ceil(imbalance * weights.sum() / num_partitions)
+    row = np.repeat(np.arange(graph.node_num, dtype=np.int32), np.diff(graph.indptr))
+    indptr, indices = graph.indptr, graph.indices
+    for _ in range(passes):
+        moved = 0
+        boundary = np.unique(row[parts[row] != parts[indices]])
+        for x in boundary.tolist():
+            p = parts[x]
+            counts = np.bincount(parts[indices[indptr[x]:indptr[x + 1]]], minlength=num_partitions)
+            q = int(np.argmax(counts))
+            if counts[q] > counts[p] and sizes[q] + weights[x] <= max_size and node_nums[p] > 1:
+                parts[x] = q
+                node_nums[p] -= 1
+                node_nums[q] += 1
+                sizes[p] -= weights[x]
+                sizes[q] += weights[x]
+                moved += 1
+        if moved == 0:
+            break
+    return parts
+
+
+def partition_tree(graph, num_partitions, tree=None, refine=True, metis_graph=None, vwgt=None):
+    """Partitions the graph into num_partitions by cutting its partition tree, built here if not given."""
+    if num_partitions == 1:
+        return np.zeros(graph.node_num, dtype=np.int32)
+    if tree is None or tree["leaf_num"] < num_partitions:
+        tree = build_partition_tree(graph, num_partitions, metis_graph, vwgt)
+    parts = cut_partition_tree(tree, num_partitions)
+    if refine:
+        parts = refine_partition_boundary(graph, parts, num_partitions, vwgt=vwgt)
+    return parts
+
+##################### Edge-Balanced Partitioning ######################
+
+def get_edge_balance_weights(graph, dangling_cost=2):
+    """
+    Vertex weights approximating the links a node brings to its VM, in units of half a link:
+    a link inside the graph costs 1 to each endpoint, a link to another PM (a dangling VXLAN
+    link, counted in full on this side) costs dangling_cost.
+    """
+    row = np.repeat(np.arange(graph.node_num, dtype=np.int32), np.diff(graph.indptr))
+    weights = np.bincount(row[graph.indices != row], minlength=graph.node_num).astype(np.float64)
+    if graph.ext_degree is not None:
+        weights += dangling_cost * graph.ext_degree
+    return np.maximum(np.rint(weights), 1).astype(np.dtype(metis.idx_t))
+
+
+def get_partition_edge_loads(graph, parts, num_partitions):
+    """Links set up by each part: its internal links, and its side of every link to another part."""
+    not_loop = graph.edge_src != graph.edge_dst
+    src_parts, dst_parts = parts[graph.edge_src[not_loop]], parts[graph.edge_dst[not_loop]]
+    return np.bincount(src_parts, minlength=num_partitions) + \
+        np.bincount(dst_parts[src_parts != dst_parts], minlength=num_partitions)
+
+
+def refine_partition_max_load(graph, parts, num_partitions, imbalance=1.2, max_passes=None):
+    """
+    Lowers the largest per-part link count by moving boundary nodes out of the most loaded part.
+    Moving node x with d links, c_r of them to part r, from part p to part q changes the load of p
+    by -(d - c_p) and the load of q by +(d - c_q). A move is taken when both new loads stay below
+    the old load of p and q stays within imbalance of the average node count.
+    """
+    parts = np.array(parts, dtype=np.int32)
+    if num_partitions == 1:
+        return parts
+    loads = get_partition_edge_loads(graph, parts, num_partitions)
+    sizes = np.bincount(parts, minlength=num_partitions)
+    max_size = math.ceil(imbalance * graph.node_num / num_partitions)
+    row = np.repeat(np.arange(graph.node_num, dtype=np.int32), np.diff(graph.indptr))
+    not_loop = graph.indices != row
+    row, col = row[not_loop], graph.indices[not_loop]
+    indptr = np.zeros(graph.node_num + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row, minlength=graph.node_num), out=indptr[1:])
+    if max_passes is None:
+        max_passes = 8 * num_partitions
+
+    for _ in range(max_passes):
+        p = int(np.argmax(loads))
+        moved = 0
+        boundary = np.unique(row[(parts[row] == p) & (parts[col] != p)])
+        for x in boundary.tolist():
+            counts = np.bincount(parts[col[indptr[x]:indptr[x + 1]]], minlength=num_partitions)
+            d = indptr[x + 1] - indptr[x]
+            targets = np.flatnonzero(counts)
+            targets = targets[(targets != p) & (sizes[targets] < max_size)]
+            if len(targets) == 0:
+                continue
+            new_target_loads = loads[targets] + d - counts[targets]
+            q = int(targets[np.argmin(new_target_loads)])
+            new_p_load = loads[p] - (d - counts[p])
+            if max(new_target_loads.min(), new_p_load) < loads[p]:
+                parts[x] = q
+                loads[p] = new_p_load
+                loads[q] += d - counts[q]
+                sizes[p] -= 1
+                sizes[q] += 1
+                moved += 1
+                # Stop once another part is the most loaded one
+                if loads[p] < loads.max():
+                    break
+        if moved == 0:
+            break
+    return parts
+
+##################### Hierarchical Partitioning ######################
+
+def refine_hierarchical_boundary(graph, parts, part2pm, cross_pm_cost=4, weights=None,
+                                 imbalance=1.03, passes=2, fixed_pms=False):
+    """
+    Greedy boundary refinement of a two-level partition (parts nested in PMs, part2pm giving the PM
+    of each part), a cut link costing 1 inside a PM and cross_pm_cost across PMs. A node in part s
+    with c_t links to part t, C_P to PM P and d in all costs (C_pm(s) - c_s) + cross_pm_cost * (d - C_pm(s)).
+    Each boundary node moves to its cheapest neighboring part when that keeps the part weight
+    within imbalance of its weight before refinement. With fixed_pms, nodes only move between
+    parts of their own PM, so that the PM layout used for planning is kept.
+    """
+    parts = np.array(parts, dtype=np.int32)
+    part2pm = np.asarray(part2pm, dtype=np.int32)
+    num_partitions, pm_num = len(part2pm), int(part2pm.max()) + 1
+    weights = np.ones(graph.node_num, dtype=np.int64) if weights is None \
+        else np.asarray(weights, dtype=np.int64)
+    sizes = np.bincount(parts, weights=weights, minlength=num_partitions)
+    max_sizes = np.ceil(imbalance * sizes) + weights.max()
+    row = np.repeat(np.arange(graph.node_num, dtype=np.int32), np.diff(graph.indptr))
+    not_loop = graph.indices != row
+    row, col = row[not_loop], graph.indices[not_loop]
+    indptr = np.zeros(graph.node_num + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row, minlength=graph.node_num), out=indptr[1:])
 
-    return node2serverid
+    for _ in range(passes):
+        moved = 0
+        boundary = np.unique(row[parts[row] != parts[col]])
+        for x in boundary.tolist():
+            p = parts[x]
+            counts = np.bincount(parts[col[indptr[x]:indptr[x + 1]]], minlength=num_partitions)
+            pm_counts = np.bincount(part2pm, weights=counts, minlength=pm_num)
+            d = indptr[x + 1] - indptr[x]
+            targets = np.flatnonzero(counts)
+            targets = targets[targets != p]
+            if fixed_pms:
+                targets = targets[part2pm[targets] == part2pm[p]]
+            targets = np.append(targets, p)
+            same_pm = pm_counts[part2pm[targets]]
+            costs = same_pm - counts[targets] + cross_pm_cost * (d - same_pm)
+            fits = sizes[targets] + weights[x] <= max_sizes[targets]
+            fits[-1] = True
+            q = int(targets[np.flatnonzero(fits)[np.argmin(costs[fits])]])
+            if q != p and costs[targets == q][0] < costs[-1] and sizes[p] > weights[x]:
+                parts[x] = q
+                sizes[p] -= weights[x]
+                sizes[q] += weights[x]
+                moved += 1
+        if moved == 0:
+            break
+    return parts
 
 ########################### TBS Partitioning ###########################
 # TBS partitioning need to be downloaded from https://github.com/tbs2022/tbs. Please change this path to the "build" directory compiled out from that project.
@@ -92,36 +307,41 @@ TBS_BIN_DIR = "/home/cnic/open-src/tbs/build"
 TBS_BIN_PATH = os.path.join(TBS_BIN_DIR, "tbs")
 
 
-def run_tbs(full_graph_metis_filepath, pm_num, cpu_capacity):
+# Capacity factors tried at once, and seconds before an attempt is given up
+TBS_PARALLEL_ATTEMPTS = 4
+TBS_ATTEMPT_TIMEOUT = 1800
+
+
+def run_tbs(full_graph_metis_filepath, pm_num, cpu_capacity, work_dir):
+    """
+    Starts TBS in work_dir, where it writes tmppartition<pm_num>. Returns the running process,
+    its stderr goes to work_dir/stderr.txt.
+    """
     generate_topology_cmd = [
-        TBS_BIN_PATH, full_graph_metis_filepath,
+        TBS_BIN_PATH, os.path.abspath(full_graph_metis_filepath),
         f"--k={pm_num}",
         f"--cpu_capacity={cpu_capacity}",
         "--preconfiguration=esocial"
     ]
     print(f"Running TBS partitioning with command: {' '.join(generate_topology_cmd)}")
-    original_dir = os.getcwd()
-    os.chdir(TBS_BIN_DIR)
-    try:
-        stderr_output = []
-        with subprocess.Popen(generate_topology_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as proc:
-            # for line in proc.stdout:
-            #     print(line, end='')
-            for line in proc.stderr:
-                stderr_output.append(line)
-            #     print(line, end='')
-            proc.wait()
-    finally:
-        os.chdir(original_dir)
-    # If returncode is 0, but stderr is non-empty and contains 'Traceback', treat as error, and exit the program
-    # print(f"proc.returncode: {proc.returncode}")
-    # if any("Traceback" in line for line in stderr_output):
-    if proc.returncode != 0 or any("Traceback" in line for line in stderr_output):
+    with open(os.path.join(work_dir, "stderr.txt"), 'w') as stderr_file:
+        return subprocess.Popen(
+            generate_topology_cmd, cwd=work_dir, stdout=subprocess.DEVNULL, stderr=stderr_file, text=True)
+
+
+def check_tbs_run(proc, work_dir, pm_num):
+    """Returns the partition file of a finished TBS run, or None if the run failed."""
+    with open(os.path.join(work_dir, "stderr.txt"), 'r') as f:
+        stderr_output = f.readlines()
+    # If returncode is 0, but stderr is non-empty and contains 'Traceback', treat as error
+    partition_output_filepath = os.path.join(work_dir, f"tmppartition{pm_num}")
+    if proc.returncode != 0 or any("Traceback" in line for line in stderr_output) or \
+            not os.path.exists(partition_output_filepath):
         print("Error occurred while running TBS partitioning:")
         for line in stderr_output:
             print(line, end='')
-        return False
-    return True
+        return None
+    return partition_output_filepath
 
 
 def trial_cpu_capacity_factors():
@@ -141,49 +361,75 @@ def trial_cpu_capacity_factors():
             last_yield = "inc"
 
 
+def wait_tbs_attempts(attempts, pm_num, timeout=TBS_ATTEMPT_TIMEOUT):
+    """
+    Waits for TBS attempts [cpu_capacity_factor, work_dir, proc, start_ts] in the order the factors
+    were tried, until the first one left succeeds or all attempts fail, each attempt being given
+    timeout seconds from its own start. Returns its partition file (None if all failed) and
+    kills the attempts still running.
+    """
+    partition_output_filepath = None
+    try:
+        while attempts and partition_output_filepath is None:
+            cpu_capacity_factor, work_dir, proc, start_ts = attempts[0]
+            try:
+                proc.wait(timeout=max(start_ts + timeout - time.time(), 0))
+            except subprocess.TimeoutExpired:
+                print(f"TBS with cpu_capacity_factor {cpu_capacity_factor} timed out after {timeout}s")
+                proc.kill()
+                proc.wait()
+                attempts.pop(0)
+                continue
+            partition_output_filepath = check_tbs_run(proc, work_dir, pm_num)
+            if partition_output_filepath is not None:
+                print(f"TBS succeeded with cpu_capacity_factor {cpu_capacity_factor}")
+            attempts.pop(0)
+    finally:
+        for _, _, proc, _ in attempts:
+            proc.kill()
+            proc.wait()
+    return partition_output_filepath
+
+
 def partition_tbs(
-    nodes, adjacency_list,
-    pm_config_list, input_topo_filepath):
+    graph, pm_config_list, input_topo_filepath):
 
     distinct_pm_ids = set()
     for pm_id, _ in enumerate(pm_config_list):
         distinct_pm_ids.add(pm_id)
     
-    # Convert the topology file into metis graph format
-    topo_file_dir = os.path.dirname(input_topo_filepath)
-    topo_filename = os.path.basename(input_topo_filepath)
-    topo_filename_elements = topo_filename.split('.')
-    full_graph_metis_filename = '.'.join(topo_filename_elements[:-1]) + ".graph"
-    full_graph_metis_filepath = os.path.join(topo_file_dir, full_graph_metis_filename)
-    node_ids, nodeid2name, adj_matrix, edge_num = \
-        convert_adjlist_to_metis_graph(nodes, adjacency_list, full_graph_metis_filepath)
-    node_num = len(node_ids)
-
-    # Call TBS partitioning program
-    pm_num = len(distinct_pm_ids)
-    node_num = len(node_ids)
-    cpu_capacity_factor_to_try = trial_cpu_capacity_factors()
-    for cpu_capacity_factor in cpu_capacity_factor_to_try:
-        print(f"Using cpu_capacity_factor {cpu_capacity_factor} for TBS")
-        cpu_capacity = int(cpu_capacity_factor * node_num // pm_num)
-        run_success = run_tbs(full_graph_metis_filepath, pm_num, cpu_capacity)
-        if run_success:
-            break
+    # Every run works in its own directory, so that concurrent runs never share TBS files
+    with tempfile.TemporaryDirectory(prefix="tbs-") as run_dir:
+        # Convert the topology file into metis graph format
+        topo_filename = os.path.basename(input_topo_filepath)
+        full_graph_metis_filename = '.'.join(topo_filename.split('.')[:-1]) + ".graph"
+        full_graph_metis_filepath = os.path.join(run_dir, full_graph_metis_filename)
+        node_num, _ = convert_graph_to_metis_graph(graph, full_graph_metis_filepath)
+
+        # Call TBS partitioning program with several capacity factors at once,
+        # the first factor of trial_cpu_capacity_factors TBS succeeds with wins, as when trying them one by one
+        pm_num = len(distinct_pm_ids)
+        attempt_num = max(1, min(TBS_PARALLEL_ATTEMPTS, os.cpu_count() or 1))
+        cpu_capacity_factor_to_try = trial_cpu_capacity_factors()
+        attempt_id = 0
+        partition_output_filepath = None
+        while partition_output_filepath is None:
+            attempts = []
+            for cpu_capacity_factor in itertools.islice(cpu_capacity_factor_to_try, attempt_num):
+                print(f"Using cpu_capacity_factor {cpu_capacity_factor} for TBS")
+                cpu_capacity = int(cpu_capacity_factor * node_num // pm_num)
+                work_dir = os.path.join(run_dir, f"attempt{attempt_id}")
+                attempt_id += 1
+                os.makedirs(work_dir)
+                attempts.append([cpu_capacity_factor, work_dir, run_tbs(
+                    full_graph_metis_filepath, pm_num, cpu_capacity, work_dir), time.time()])
+            partition_output_filepath = wait_tbs_attempts(attempts, pm_num)
 
-    # Acquire partition result
-    partition_output_filepath = os.path.join(TBS_BIN_DIR, f"tmppartition{pm_num}")
-    nodeid2pmid = {}
-    with open(partition_output_filepath, 'r') as f:
-        for i, line in enumerate(f):
-            node_id = i + 1
-            pm_id = int(line.strip())
-            nodeid2pmid[node_id] = pm_id
-            if pm_id not in distinct_pm_ids:
-                print(f"Node {node_id} is assigned to PM {pm_id}, which is not in the server list.")
-                exit(1)
-    node2pmid = {}
-    for node_id, pm_id in nodeid2pmid.items():
-        node_name = nodeid2name[node_id]
-        node2pmid[node_name] = pm_id
+        # Acquire partition result, the i-th line holds the PM of node i
+        node2pmid = np.loadtxt(partition_output_filepath, dtype=np.int32, ndmin=1)
+    for node_id, pm_id in enumerate(node2pmid.tolist()):
+        if pm_id not in distinct_pm_ids:
+            print(f"Node {node_id + 1} is assigned to PM {pm_id}, which is not in the server list.")
+            exit(1)
 
     return node2pmid
@@ -1,3 +1,5 @@
+import numpy as np
+
 DEFAULT_CROSS_MACHINE_BW = 10000 # Mbps
 
 cross_machine_bw = {
@@ -27,35 +29,142 @@ def get_cross_machine_bw(pm_id_0, pm_id_1):
     cross_machine_bw_key = (pm_id_0, pm_id_1)
     return cross_machine_bw.get(cross_machine_bw_key, DEFAULT_CROSS_MACHINE_BW)
 
-def compute_tdf(nodes, adjacency_list, node2server_id, serverid2pmid):
+def load_cross_machine_bw(pm_config):
+    """
+    Replaces the bandwidth table with the "crossMachineBandwidth(Mbps)" section of pm_config.json:
+    {"default": bw, "pairs": [{"pms": [pm_id_0, pm_id_1], "bw": bw}, ...]}
+    """
+    global DEFAULT_CROSS_MACHINE_BW
+    bw_config = pm_config.get("crossMachineBandwidth(Mbps)")
+    if bw_config is None:
+        return
+    DEFAULT_CROSS_MACHINE_BW = bw_config.get("default", DEFAULT_CROSS_MACHINE_BW)
+    cross_machine_bw.clear()
+    for pair in bw_config.get("pairs", []):
+        pm_id_0, pm_id_1 = pair["pms"]
+        cross_machine_bw[(min(pm_id_0, pm_id_1), max(pm_id_0, pm_id_1))] = pair["bw"]
+
+def get_cross_machine_bw_matrix(pm_num):
+    bw = np.full((pm_num, pm_num), np.inf)
+    for pm_id_0 in range(pm_num):
+        for pm_id_1 in range(pm_id_0 + 1, pm_num):
+            bw[pm_id_0, pm_id_1] = bw[pm_id_1, pm_id_0] = get_cross_machine_bw(pm_id_0, pm_id_1)
+    return bw
+
+def get_cross_machine_links(graph, node2pmid, pm_num):
+    """Symmetric pm_num x pm_num histogram of the links between every two PMs (zero diagonal)."""
+    pair_links = np.zeros(pm_num * pm_num, dtype=np.int64)
+    # The graph may be any link source with iter_edge_chunks (a TopoGraph or a TopoStream)
+    for edge_src, edge_dst in graph.iter_edge_chunks():
+        src_pms, dst_pms = node2pmid[edge_src], node2pmid[edge_dst]
+        cross = src_pms != dst_pms
+        pair_links += np.bincount(
+            src_pms[cross].astype(np.int64) * pm_num + dst_pms[cross], minlength=pm_num * pm_num)
+    pair_links = pair_links.reshape(pm_num, pm_num)
+    return pair_links + pair_links.T
+
+def get_relative_load(pair_links, bw):
+    """Relative load of every PM pair: infinite for loaded pairs without bandwidth, zero for unloaded ones."""
+    load = pair_links * VLINK_BW
+    relative_load = np.zeros(load.shape)
+    loaded = load > 0
+    has_bw = loaded & (bw > 0)
+    relative_load[loaded] = np.inf
+    relative_load[has_bw] = load[has_bw] / bw[has_bw]
+    return relative_load
+
+def compute_tdf(graph, node2server_id, serverid2pmid):
     # Suppose each virtual link is 100 Mbps, the load on a cross-machine
     # link is the sum of the loads of all virtual links that traverse it.
+    server_num = max(serverid2pmid) + 1
+    server2pmid = np.zeros(server_num, dtype=np.int64)
+    server2pmid[list(serverid2pmid)] = list(serverid2pmid.values())
+    pm_num = int(server2pmid.max()) + 1
 
-    # Traverse the adjacency list and compute the load on each cross-machine link
-    cross_machine_load = {}
-    for node in nodes:
-        server_id = node2server_id[node]
-        pm_id = serverid2pmid[server_id]
-        for neighbor in adjacency_list[node]:
-            neighbor_server_id = node2server_id[neighbor]
-            neighbor_pm_id = serverid2pmid[neighbor_server_id]
-            if pm_id < neighbor_pm_id: # Avoid double counting
-                # This is a cross-machine link
-                cross_machine_bw_key = (min(pm_id, neighbor_pm_id), max(pm_id, neighbor_pm_id))
-                if cross_machine_bw_key not in cross_machine_load:
-                    cross_machine_load[cross_machine_bw_key] = 0
-                cross_machine_load[cross_machine_bw_key] += VLINK_BW  # Assuming each link has a load of 10Mbps
-
-    # Calculate cross-machine relative load
-    cross_machine_relative_load = {}
-    for (pm_id_0, pm_id_1), load in cross_machine_load.items():
-        bw = get_cross_machine_bw(pm_id_0, pm_id_1)
-        if bw > 0:
-            relative_load = load / bw
-        else:
-            relative_load = float('inf')  # Infinite load if bandwidth is zero
-        cross_machine_relative_load[(pm_id_0, pm_id_1)] = relative_load
+    # Cross-machine relative load, assuming each link has a load of 10Mbps, infinite if the bandwidth is zero
+    relative_load = get_relative_load(
+        get_cross_machine_links(graph, server2pmid[np.asarray(node2server_id)], pm_num),
+        get_cross_machine_bw_matrix(pm_num))
 
     # Calculate TDF
-    tdf = max(cross_machine_relative_load.values(), default=0)
+    tdf = float(relative_load.max())
     return tdf
+
+def refine_partition_tdf(graph, node2pmid, pm_num, imbalance=1.03, max_passes=None):
+    """
+    Moves boundary nodes between PMs to lower the relative load of the busiest PM-pair link, i.e. the TDF.
+    Moving node x from PM p to PM q, with c_r of its links going to PM r, takes c_r links off every
+    pair (p, r) and puts c_r links on every pair (q, r). A move is taken when every pair it changes
+    stays below the current TDF (or loses links, for pairs without bandwidth), and the link count and node count of q stay within imbalance of their
+    values before refinement, so that E_max stays balanced.
+    """
+    node2pmid = np.array(node2pmid, dtype=np.int32)
+    if pm_num == 1:
+        return node2pmid
+    bw = get_cross_machine_bw_matrix(pm_num)
+    not_loop = graph.edge_src != graph.edge_dst
+    src, dst = graph.edge_src[not_loop], graph.edge_dst[not_loop]
+    src_pms, dst_pms = node2pmid[src], node2pmid[dst]
+    pair_links = get_cross_machine_links(graph, node2pmid, pm_num)
+    # Links set up on each PM: internal links, plus its side of every cross-PM link
+    loads = np.bincount(src_pms, minlength=pm_num) + np.bincount(dst_pms[src_pms != dst_pms], minlength=pm_num)
+    sizes = np.bincount(node2pmid, minlength=pm_num)
+    max_loads = np.ceil(imbalance * loads) + 1
+    max_sizes = np.ceil(imbalance * sizes) + 1
+
+    row = np.repeat(np.arange(graph.node_num, dtype=np.int32), np.diff(graph.indptr))
+    keep = graph.indices != row
+    row, col = row[keep], graph.indices[keep]
+    indptr = np.zeros(graph.node_num + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row, minlength=graph.node_num), out=indptr[1:])
+    if max_passes is None:
+        max_passes = 4 * pm_num * pm_num
+
+    relative_load = lambda: get_relative_load(pair_links, bw)
+    for _ in range(max_passes):
+        relative = relative_load()
+        tdf = relative.max()
+        if tdf == 0:
+            break
+        a, b = np.unravel_index(np.argmax(relative), relative.shape)
+        moved = 0
+        # Nodes on either side of the busiest pair with a link across it
+        candidates = np.unique(row[((node2pmid[row] == a) & (node2pmid[col] == b)) |
+                                   ((node2pmid[row] == b) & (node2pmid[col] == a))])
+        for x in candidates.tolist():
+            p = node2pmid[x]
+            counts = np.bincount(node2pmid[col[indptr[x]:indptr[x + 1]]], minlength=pm_num)
+            d = indptr[x + 1] - indptr[x]
+            best = None
+            for q in np.flatnonzero(counts).tolist():
+                if q == p or sizes[q] + 1 > max_sizes[q] or loads[q] + d - counts[q] > max_loads[q]:
+                    continue
+                new_pair_links = pair_links.copy()
+                new_pair_links[p, :] -= counts
+                new_pair_links[:, p] -= counts
+                new_pair_links[q, :] += counts
+                new_pair_links[:, q] += counts
+                np.fill_diagonal(new_pair_links, 0)
+                changed = (new_pair_links != pair_links)
+                new_relative = get_relative_load(new_pair_links, bw)
+                # Fewer pairs without bandwidth first, then the lowest total relative load
+                finite = np.isfinite(new_relative)
+                cost = (np.count_nonzero(~finite), new_relative[finite].sum())
+                # Pairs without bandwidth stay infinite until they are empty, so fewer links count as lower
+                lowered = (new_relative < tdf) | ((bw <= 0) & (new_pair_links < pair_links))
+                if changed.any() and lowered[changed].all() and \
+                        (best is None or cost < best[1]):
+                    best = (q, cost, new_pair_links)
+            if best is not None:
+                q, _, pair_links = best
+                node2pmid[x] = q
+                loads[p] -= d - counts[p]
+                loads[q] += d - counts[q]
+                sizes[p] -= 1
+                sizes[q] += 1
+                moved += 1
+                if relative_load()[a, b] < relative_load().max():
+                    break
+        if moved == 0:
+            break
+    return node2pmid
@@ -1,125 +1,50 @@
 import argparse
+import numpy as np
+from .fmt_util import read_graph_from_topo_file
 
 
 def convert_topo_to_metis_graph(input_filepath, output_filepath):
-    node_names = None
-    adj_matrix = None
-    edge_weight = 1
-    edge_num = 0
-
-    # First scan of file: Get nodes and remove dangling nodes
-    tmp_adj_matrix = {}
-    with open(input_filepath, 'r') as f:
-        # Parse all nodes first
-        nodes_str = f.readline().strip()
-        node_names = nodes_str.split()
-
-        for node_name in node_names:
-            tmp_adj_matrix[node_name] = []
-
-        # Scan links
-        for line in f:
-            node_name_i, node_name_j = line.strip().split()
-            if node_name_i not in tmp_adj_matrix:
-                tmp_adj_matrix[node_name_i] = []
-            if node_name_j not in tmp_adj_matrix:
-                tmp_adj_matrix[node_name_j] = []
-            tmp_adj_matrix[node_name_i].append(node_name_j)
-            tmp_adj_matrix[node_name_j].append(node_name_i)
-        
-        # Remove dangling nodes
-        for node_name in tmp_adj_matrix:
-            if len(tmp_adj_matrix[node_name]) == 0:
-                node_names.remove(node_name)
-        
-        # Allocate integer node id
-        node_name2id = {}
-        nodeid2name = {}
-        for i, node_name in enumerate(node_names):
-            node_name2id[node_name] = i + 1
-            nodeid2name[i + 1] = node_name
-        node_ids = nodeid2name.keys()
-
-    # Second scan of file: Read all links
-    with open(input_filepath, 'r') as f:
-        # Skip the first line
-        nodes_str = f.readline()
-
-        # Scan links
-        adj_matrix = {}
-        for line in f:
-            node_name_i, node_name_j = line.strip().split()
-            node_id_i, node_id_j = node_name2id[node_name_i], node_name2id[node_name_j]
-            if node_id_i not in adj_matrix:
-                adj_matrix[node_id_i] = []
-            if node_id_j not in adj_matrix:
-                adj_matrix[node_id_j] = []
-            adj_matrix[node_id_i].append((node_id_j, edge_weight))
-            adj_matrix[node_id_j].append((node_id_i, edge_weight))
-            edge_num += 1
-
-    # Generate a graph with edge weight
-    node_num = len(node_ids)
-    with open(output_filepath, 'w') as f:
-        f.write(f"{node_num} {edge_num} 1\n")
-        for i, node_id in enumerate(sorted(adj_matrix)):
-            assert i == node_id - 1
-            # Write a line containing node name
-            node_name = nodeid2name[node_id]
-            f.write(f"% node_name: {node_name}\n")
-            # Write a line for neighbors
-            adj_line = ""
-            adj = adj_matrix[node_id]
-            for neighbor, edge_weight in adj:
-                adj_line += f" {neighbor} {edge_weight}"
-            f.write(f"{adj_line}\n")
-
-    return node_ids, nodeid2name, adj_matrix, edge_num
+    graph = read_graph_from_topo_file(input_filepath)
+    node_num, edge_num = convert_graph_to_metis_graph(graph, output_filepath)
+    return graph, node_num, edge_num
 
 
 def convert_metis_graph_to_topo(input_filepath, output_filepath):
     pass
 
 
-def convert_adjlist_to_metis_graph(nodes, adjacency_list, output_filepath):
-    # Allocate integer node id
-    node_name2id = {}
-    nodeid2name = {}
-    for i, node_name in enumerate(nodes):
-        node_name2id[node_name] = i + 1
-        nodeid2name[i + 1] = node_name
-    node_ids = nodeid2name.keys()
-
-    # Generate a graph with edge weight
-    edge_weight = 1
-    edge_num = 0
-    adj_matrix = {}
-    for node_name in nodes:
-        node_id = node_name2id[node_name]
-        for neighbor in adjacency_list[node_name]:
-            neighbor_id = node_name2id[neighbor]
-            if node_id not in adj_matrix:
-                adj_matrix[node_id] = []
-            if neighbor_id not in adj_matrix:
-                adj_matrix[neighbor_id] = []
-            adj_matrix[node_id].append((neighbor_id, edge_weight))
-            adj_matrix[neighbor_id].append((node_id, edge_weight)) # adjacency_list is already bidirectional
-            edge_num += 1
+def convert_graph_to_metis_graph(graph, output_filepath):
+    """Writes a TopoGraph in METIS graph format (1-based ids, parallel links merged into edge weights)."""
+    # METIS does not accept self loops or parallel edges
+    edge_src, edge_dst = graph.edge_src, graph.edge_dst
+    not_loop = edge_src != edge_dst
+    u = np.minimum(edge_src[not_loop], edge_dst[not_loop]).astype(np.int64)
+    v = np.maximum(edge_src[not_loop], edge_dst[not_loop]).astype(np.int64)
+    keys, edge_weights = np.unique(u * graph.node_num + v, return_counts=True)
+    u, v = keys // graph.node_num, keys % graph.node_num
+
+    # Both directions of every edge, grouped by source node
+    src = np.concatenate([u, v])
+    dst = np.concatenate([v, u])
+    weights = np.concatenate([edge_weights, edge_weights])
+    order = np.argsort(src, kind="stable")
+    dst, weights = (dst[order] + 1).tolist(), weights[order].tolist()
+    indptr = np.zeros(graph.node_num + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=graph.node_num), out=indptr[1:])
+    indptr = indptr.tolist()
 
     # Generate a graph with edge weight
-    node_num = len(node_ids)
+    node_num, edge_num = graph.node_num, len(keys)
     with open(output_filepath, 'w') as f:
         f.write(f"{node_num} {edge_num} 1\n")
-        for i, node_id in enumerate(sorted(adj_matrix)):
-            assert i == node_id - 1
+        for node_id in range(node_num):
             # Write a line containing node name
-            node_name = nodeid2name[node_id]
-            f.write(f"% node_name: {node_name}\n")
+            f.write(f"% node_name: {graph.names[node_id]}\n")
             # Write a line for neighbors
-            adj_line = ""
-            adj = adj_matrix[node_id]
-            for neighbor, edge_weight in adj:
-                adj_line += f" {neighbor} {edge_weight}"
+            start, end = indptr[node_id], indptr[node_id + 1]
+            adj_line = ''.join(
+                f" {neighbor} {edge_weight}"
+                for neighbor, edge_weight in zip(dst[start:end], weights[start:end]))
             f.write(f"{adj_line}\n")
 
-    return node_ids, nodeid2name, adj_matrix, edge_num
\ No newline at end of file
+    return node_num, edge_num
@@ -1,112 +1,299 @@
-def read_graph_from_topo_file(input_filepath):
-    """Reads the graph from the old format and returns a node list and adjacency list in the correct format."""
-    nodes = None
-    adjacency_list = None
-    edge_num = 0
-
-    ################# NODE_NAMES to NODES
-    ############ return based on tmp_adjacency_list ? adj_list containing node names
-    ############# modify partition_topo_pm, let it not read input file
-
-    # First scan of file: Get nodes and remove dangling nodes
-    tmp_adjacency_list = {}
-    with open(input_filepath, 'r') as f:
-        # Parse all nodes first
-        nodes_str = f.readline().strip()
-        nodes = nodes_str.split()
-
-        for node_name in nodes:
-            tmp_adjacency_list[node_name] = []
-
-        # Scan links
-        for line in f:
-            node_name_i, node_name_j = line.strip().split()
-            if node_name_i not in tmp_adjacency_list:
-                tmp_adjacency_list[node_name_i] = []
-            if node_name_j not in tmp_adjacency_list:
-                tmp_adjacency_list[node_name_j] = []
-            tmp_adjacency_list[node_name_i].append(node_name_j)
-            tmp_adjacency_list[node_name_j].append(node_name_i)
-        
-        # Remove dangling nodes
-        for node_name in tmp_adjacency_list:
-            if len(tmp_adjacency_list[node_name]) == 0:
-                nodes.remove(node_name)
-
-    # Second scan of file: Read all links
+import os
+import queue
+import shutil
+import multiprocessing
+import numpy as np
+from .graph import TopoGraph
+from .topo_cache import *
+
+# Sub-topology writers are mostly I/O bound, a few processes are enough
+SUBTOPO_WRITER_NUM = 4
+
+
+def read_graph_from_topo_file(input_filepath, use_cache=True):
+    """
+    Returns the topology as a CSR TopoGraph (dangling nodes dropped).
+    The binary cache next to the file is used when it matches the file content, and refreshed otherwise.
+    """
+    if not use_cache:
+        return parse_topo_file(input_filepath)
+
+    digest = hash_topo_file(input_filepath)
+    cache_filepath = get_topo_cache_filepath(input_filepath)
+    graph = load_cached_graph(cache_filepath, digest)
+    if graph is None:
+        graph = parse_topo_file(input_filepath)
+        save_cached_graph(cache_filepath, graph, digest)
+    return graph
+
+
+def parse_topo_file(input_filepath):
+    """Reads the topology file in one pass and returns it as a CSR TopoGraph (dangling nodes dropped)."""
     with open(input_filepath, 'r') as f:
-        # Skip the first line
-        nodes_str = f.readline()
-
-        # Scan links
-        adjacency_list = {}
-        for line in f:
-            node_name_i, node_name_j = line.strip().split()
-            if node_name_i not in adjacency_list:
-                adjacency_list[node_name_i] = []
-            if node_name_j not in adjacency_list:
-                adjacency_list[node_name_j] = []
-            adjacency_list[node_name_i].append(node_name_j)
-            adjacency_list[node_name_j].append(node_name_i)
-            edge_num += 1
-
-    return nodes, adjacency_list
-
-
-def write_subtopo_to_file(filepath, nodes, edges, dangling_edges):
-    """Writes the subgraph to the new format file."""
-    with open(filepath, 'w') as f:
-        # Write nodes
-        f.write(' '.join(map(str, nodes)) + '\n')
-        # Write internal edges
-        for edge in edges:
-            f.write(f"{edge[0]} {edge[1]}\n")
-        # Write dangling edges
-        for edge in dangling_edges:
-            f.write(f"{edge[0]} {edge[1]}\n")
+        # Parse all nodes first, then all link endpoints at once
+        names = list(dict.fromkeys(f.readline().split()))
+        tokens = f.read().split()
+    if len(tokens) % 2 != 0:
+        raise ValueError(f"Malformed topology file {input_filepath}: odd number of link endpoints")
 
+    try:
+        names, endpoint_ids = intern_integer_names(names, tokens)
+    except ValueError:
+        # Intern arbitrary node names to dense ids, nodes only seen in links are appended
+        name2id = {name: i for i, name in enumerate(names)}
+        endpoint_ids = np.fromiter(
+            (name2id.setdefault(token, len(name2id)) for token in tokens),
+            dtype=np.int32, count=len(tokens))
+        names = list(name2id)
 
-def write_subtopos_to_file(
-    nodes, adjacency_list,
-    node2serverid, server_num, input_topo_filepath):
-    # Collect nodes and edges for each partition
-    subgraphs = {i: {'nodes': [], 'edges': [], 'dangling': []} for i in range(server_num)}
-
-    # Group nodes into their respective subgraphs
-    for node, serverid in node2serverid.items():
-        subgraphs[serverid]['nodes'].append(node)
-
-    # Allocate Vxlan IDs for dangling edges
-    to_alloc_vxlan_id = 4097
-    edge2id = {}
-
-    # Group edges into internal and dangling
-    for u in nodes:
-        for v in adjacency_list[u]:
-            if u >= v:
+    return TopoGraph.from_edges(
+        names, endpoint_ids[0::2], endpoint_ids[1::2], drop_isolated=True)
+
+
+def intern_integer_names(names, tokens):
+    """Vectorized interning for integer node names (what the agent expects), raises ValueError otherwise."""
+    name_values = np.array(names, dtype=np.int64)
+    token_values = np.array(tokens, dtype=np.int64)
+    if len(np.unique(name_values)) != len(name_values):
+        raise ValueError("Node names are not distinct integers")
+
+    # Look up the endpoints among the listed nodes, with a direct table when the ids are dense
+    lo = min(name_values.min(initial=0), token_values.min(initial=0))
+    hi = max(name_values.max(initial=0), token_values.max(initial=0))
+    if hi - lo < 4 * (len(name_values) + len(token_values)):
+        table = np.full(hi - lo + 1, -1, dtype=np.int64)
+        table[name_values - lo] = np.arange(len(name_values))
+        endpoint_ids = table[token_values - lo]
+        known = endpoint_ids >= 0
+    else:
+        sorter = np.argsort(name_values, kind="stable")
+        sorted_values = np.append(name_values[sorter], np.iinfo(np.int64).max)
+        pos = np.minimum(np.searchsorted(sorted_values, token_values), len(names))
+        known = sorted_values[pos] == token_values
+        endpoint_ids = np.append(sorter, -1)[pos]
+
+    # Endpoints missing from the node line get new ids in order of first appearance
+    if not known.all():
+        unknown_values, first_index, inverse = np.unique(
+            token_values[~known], return_index=True, return_inverse=True)
+        appearance_rank = np.empty(len(unknown_values), dtype=np.int64)
+        appearance_rank[np.argsort(first_index, kind="stable")] = np.arange(len(unknown_values))
+        endpoint_ids[~known] = len(names) + appearance_rank[inverse]
+        unknown_tokens = np.flatnonzero(~known)[np.sort(first_index)]
+        names = names + [tokens[i] for i in unknown_tokens.tolist()]
+
+    return names, endpoint_ids.astype(np.int32)
+
+
+def get_subtopo_filepath(input_topo_filepath, server_id):
+    tmp_filepath_arr = input_topo_filepath.strip().split('.')
+    tmp_filepath_arr = tmp_filepath_arr[0:1] + [f"sub{server_id}"] + tmp_filepath_arr[1:]
+    return '.'.join(tmp_filepath_arr)
+
+
+class SubtopoWriter:
+    """
+    Buffered writers for the sub-topology files of a set of servers.
+    Links are given as id arrays and only turned into text here, chunk by chunk.
+    Dangling links are spilled to a temporary file per server and appended after all internal links.
+    """
+
+    def __init__(self, names, server_filepaths, buffer_size=1 << 20):
+        self.names = names
+        self.server_filepaths = server_filepaths
+        self.buffer_size = buffer_size
+        self.files = {
+            server_id: open(filepath, 'w', buffering=buffer_size)
+            for server_id, filepath in server_filepaths.items()
+        }
+        self.dangling_files = {}
+
+    def write_nodes(self, server_id, node_ids):
+        self.files[server_id].write(' '.join(map(self.names.__getitem__, node_ids.tolist())) + '\n')
+
+    def write_links(self, server_ids, local_ids, peer_ids, peer_server_ids, vxlan_ids):
+        """Writes internal links (peer_server_id < 0) and dangling links, grouped by server."""
+        order = np.argsort(server_ids, kind="stable")
+        server_ids, bounds = np.unique(server_ids[order], return_index=True)
+        bounds = np.append(bounds, len(order)).tolist()
+        for i, server_id in enumerate(server_ids.tolist()):
+            sel = order[bounds[i]:bounds[i + 1]]
+            dangling = peer_server_ids[sel] >= 0
+            internal_sel, dangling_sel = sel[~dangling], sel[dangling]
+            lines = map("{} {}\n".format,
+                        map(self.names.__getitem__, local_ids[internal_sel].tolist()),
+                        map(self.names.__getitem__, peer_ids[internal_sel].tolist()))
+            self.files[server_id].write(''.join(lines))
+            if len(dangling_sel) == 0:
                 continue
-            u_server_id = node2serverid[u]
-            v_server_id = node2serverid[v]
-            if u_server_id == v_server_id:
-                subgraphs[u_server_id]['edges'].append((u, v))
+            if server_id not in self.dangling_files:
+                self.dangling_files[server_id] = open(
+                    f"{self.server_filepaths[server_id]}.dangling.tmp", 'w+', buffering=self.buffer_size)
+            lines = map("{} {}_external_{}_{}\n".format,
+                        map(self.names.__getitem__, local_ids[dangling_sel].tolist()),
+                        map(self.names.__getitem__, peer_ids[dangling_sel].tolist()),
+                        peer_server_ids[dangling_sel].tolist(), vxlan_ids[dangling_sel].tolist())
+            self.dangling_files[server_id].write(''.join(lines))
+
+    def close(self):
+        for server_id, f in self.files.items():
+            dangling_file = self.dangling_files.pop(server_id, None)
+            if dangling_file is not None:
+                dangling_file.seek(0)
+                shutil.copyfileobj(dangling_file, f)
+                dangling_file.close()
+                os.remove(dangling_file.name)
+            f.close()
+
+
+class VxlanIdAllocator:
+    """
+    Gives every node pair one VXLAN ID, from 4097 in order of first appearance, whatever the number
+    of links between the pair (the agent names VXLAN devices after the node pair).
+    """
+
+    def __init__(self, node_num, first_vxlan_id=4097):
+        self.node_num = node_num
+        self.next_vxlan_id = first_vxlan_id
+        self.keys = np.empty(0, dtype=np.int64)
+        self.vxlan_ids = np.empty(0, dtype=np.int64)
+
+    def allocate(self, u, v):
+        keys = np.minimum(u, v).astype(np.int64) * self.node_num + np.maximum(u, v)
+        chunk_keys, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        pos = np.minimum(np.searchsorted(self.keys, chunk_keys), len(self.keys))
+        known = np.zeros(len(chunk_keys), dtype=bool)
+        if len(self.keys) > 0:
+            known = self.keys[np.minimum(pos, len(self.keys) - 1)] == chunk_keys
+        chunk_vxlan_ids = np.empty(len(chunk_keys), dtype=np.int64)
+        chunk_vxlan_ids[known] = self.vxlan_ids[pos[known]]
+
+        # New pairs get IDs in order of first appearance
+        new = np.flatnonzero(~known)
+        new = new[np.argsort(first_index[new], kind="stable")]
+        chunk_vxlan_ids[new] = self.next_vxlan_id + np.arange(len(new))
+        self.next_vxlan_id += len(new)
+        if len(new) > 0:
+            self.keys = np.concatenate([self.keys, chunk_keys[new]])
+            self.vxlan_ids = np.concatenate([self.vxlan_ids, chunk_vxlan_ids[new]])
+            order = np.argsort(self.keys, kind="stable")
+            self.keys, self.vxlan_ids = self.keys[order], self.vxlan_ids[order]
+        return chunk_vxlan_ids[inverse]
+
+
+def _subtopo_writer_worker(names, server_filepaths, task_queue):
+    writer = SubtopoWriter(names, server_filepaths)
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            if task[0] == "nodes":
+                writer.write_nodes(*task[1:])
             else:
-                # Allocate vxlan ID for the dangling edge
-                cur_vxlan_id = edge2id.get((u, v))
-                if cur_vxlan_id is None:
-                    edge2id[(u, v)] = to_alloc_vxlan_id
-                    cur_vxlan_id = edge2id[(u, v)]
-                    to_alloc_vxlan_id += 1
-                # Add the dangling edge
-                subgraphs[u_server_id]['dangling'].append((u, f"{v}_external_{v_server_id}_{cur_vxlan_id}"))
-                subgraphs[v_server_id]['dangling'].append((v, f"{u}_external_{u_server_id}_{cur_vxlan_id}"))
-
-    # Write each subgraph to a file in the new format
-    for i in range(server_num):
-        tmp_filepath_arr = input_topo_filepath.strip().split('.')
-        tmp_filepath_arr = tmp_filepath_arr[0:1] + [f"sub{i}"] + tmp_filepath_arr[1:]
-        output_filepath = '.'.join(tmp_filepath_arr)
-        write_subtopo_to_file(output_filepath,
-                               subgraphs[i]['nodes'],
-                               subgraphs[i]['edges'],
-                               subgraphs[i]['dangling'])
-        print(f"Subgraph {i} written to {output_filepath}")
+                writer.write_links(*task[1:])
+    finally:
+        writer.close()
+
+
+def _put_task(task_queue, proc, task):
+    # Do not block forever on a full queue if the worker died
+    while True:
+        try:
+            task_queue.put(task, timeout=1)
+            return
+        except queue.Full:
+            if not proc.is_alive():
+                raise RuntimeError(f"Sub-topology writer {proc.name} exited with code {proc.exitcode}")
+
+
+def write_subtopos_to_file(
+    graph, node2serverid, server_num, input_topo_filepath,
+    worker_num=None, chunk_size=1 << 18):
+    """
+    Writes one sub-topology file per server in a single vectorized pass over the links.
+    graph may be any link source with names and iter_edge_chunks (a TopoGraph or a TopoStream).
+    Cross-server links become dangling links "{v}_external_{server_id}_{vxlan_id}" on both sides,
+    with one VXLAN ID per node pair. As before, internal links are written "u v" with u < v
+    (as strings) and come before the dangling links of each file.
+    Files are split among worker_num writer processes, fed with bounded queues.
+    The writers are spawned rather than forked, as the SSH connection pool may have live threads.
+    """
+    node2serverid = np.asarray(node2serverid)
+    server_filepaths = {i: get_subtopo_filepath(input_topo_filepath, i) for i in range(server_num)}
+    if worker_num is None:
+        worker_num = min(SUBTOPO_WRITER_NUM, os.cpu_count() or 1)
+    worker_num = max(1, min(worker_num, server_num))
+
+    # Server i is written by worker i % worker_num
+    if worker_num == 1:
+        writers = [SubtopoWriter(graph.names, server_filepaths)]
+        submit = lambda worker_id, task: getattr(writers[0], f"write_{task[0]}")(*task[1:])
+    else:
+        mp_context = multiprocessing.get_context("spawn")
+        procs, task_queues = [], []
+        for worker_id in range(worker_num):
+            task_queue = mp_context.Queue(maxsize=4)
+            proc = mp_context.Process(
+                target=_subtopo_writer_worker, name=f"subtopo-writer-{worker_id}",
+                args=(graph.names,
+                      {i: p for i, p in server_filepaths.items() if i % worker_num == worker_id},
+                      task_queue))
+            proc.start()
+            procs.append(proc)
+            task_queues.append(task_queue)
+        submit = lambda worker_id, task: _put_task(task_queues[worker_id], procs[worker_id], task)
+
+    try:
+        # Node lines go first
+        order = np.argsort(node2serverid, kind="stable")
+        bounds = np.searchsorted(node2serverid[order], np.arange(server_num + 1)).tolist()
+        for server_id in range(server_num):
+            submit(server_id % worker_num, ("nodes", server_id, order[bounds[server_id]:bounds[server_id + 1]]))
+
+        # Rank of every node name in string order
+        name_ranks = np.empty(len(graph.names), dtype=np.int64)
+        name_ranks[np.argsort(np.array(graph.names, dtype=str), kind="stable")] = np.arange(len(graph.names))
+
+        # Allocate Vxlan IDs for dangling edges, one per node pair
+        vxlan_id_allocator = VxlanIdAllocator(len(graph.names))
+        for edge_src, edge_dst in graph.iter_edge_chunks(chunk_size):
+            not_loop = edge_src != edge_dst
+            u, v = edge_src[not_loop], edge_dst[not_loop]
+            swap = name_ranks[u] > name_ranks[v]
+            u, v = np.where(swap, v, u), np.where(swap, u, v)
+            u_server_ids, v_server_ids = node2serverid[u], node2serverid[v]
+            cross = u_server_ids != v_server_ids
+            vxlan_ids = np.full(len(u), -1, dtype=np.int64)
+            vxlan_ids[cross] = vxlan_id_allocator.allocate(u[cross], v[cross])
+
+            # Internal links once, dangling links from both sides
+            server_ids = np.concatenate([u_server_ids, v_server_ids[cross]])
+            local_ids = np.concatenate([u, v[cross]])
+            peer_ids = np.concatenate([v, u[cross]])
+            peer_server_ids = np.concatenate([np.where(cross, v_server_ids, -1), u_server_ids[cross]])
+            vxlan_ids = np.concatenate([vxlan_ids, vxlan_ids[cross]])
+            worker_ids = server_ids % worker_num
+            for worker_id in np.unique(worker_ids).tolist():
+                sel = worker_ids == worker_id
+                submit(worker_id, ("links", server_ids[sel], local_ids[sel],
+                                   peer_ids[sel], peer_server_ids[sel], vxlan_ids[sel]))
+    finally:
+        if worker_num == 1:
+            writers[0].close()
+        else:
+            for task_queue, proc in zip(task_queues, procs):
+                try:
+                    _put_task(task_queue, proc, None)
+                except RuntimeError:
+                    # Reported below from the exit code, nothing will read what is left in the queue
+                    task_queue.cancel_join_thread()
+            for proc in procs:
+                proc.join()
+
+    if worker_num > 1:
+        for proc in procs:
+            if proc.exitcode != 0:
+                raise RuntimeError(f"Sub-topology writer {proc.name} exited with code {proc.exitcode}")
+    for server_id in range(server_num):
+        print(f"Subgraph {server_id} written to {server_filepaths[server_id]}")
@@ -0,0 +1,96 @@
+import numpy as np
+
+
+class TopoGraph:
+    """
+    Compact CSR representation of an undirected topology.
+
+    Node names are interned to dense ids in [0, node_num). Every link of the
+    topology is kept once in (edge_src, edge_dst), and the CSR arrays
+    (indptr, indices) hold both directions of every link.
+    """
+
+    def __init__(self, names, edge_src, edge_dst, global_ids=None, ext_degree=None,
+                 indptr=None, indices=None):
+        self.names = names
+        self.edge_src = np.asarray(edge_src, dtype=np.int32)
+        self.edge_dst = np.asarray(edge_dst, dtype=np.int32)
+        # Ids of the nodes in the graph this one was cut from (None for a full topology)
+        self.global_ids = global_ids
+        # Number of links of each node that were cut away when building a sub-graph
+        self.ext_degree = ext_degree
+        if indptr is None:
+            indptr, indices = build_csr(len(names), self.edge_src, self.edge_dst)
+        self.indptr, self.indices = indptr, indices
+
+    @classmethod
+    def from_edges(cls, names, edge_src, edge_dst, drop_isolated=True):
+        """Builds a graph from interned edges, optionally dropping nodes without links."""
+        edge_src = np.asarray(edge_src, dtype=np.int32)
+        edge_dst = np.asarray(edge_dst, dtype=np.int32)
+        if drop_isolated:
+            degree = np.bincount(edge_src, minlength=len(names)) + \
+                np.bincount(edge_dst, minlength=len(names))
+            keep = degree > 0
+            if not keep.all():
+                new_ids = np.cumsum(keep, dtype=np.int64) - 1
+                names = [name for name, k in zip(names, keep.tolist()) if k]
+                edge_src = new_ids[edge_src].astype(np.int32)
+                edge_dst = new_ids[edge_dst].astype(np.int32)
+        return cls(names, edge_src, edge_dst)
+
+    @property
+    def node_num(self):
+        return len(self.names)
+
+    @property
+    def edge_num(self):
+        return len(self.edge_src)
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def neighbors(self, node_id):
+        return self.indices[self.indptr[node_id]:self.indptr[node_id + 1]]
+
+    def iter_edge_chunks(self, chunk_size=1 << 20):
+        """Yields the links as (edge_src, edge_dst) slices of at most chunk_size links."""
+        for start in range(0, self.edge_num, chunk_size):
+            yield self.edge_src[start:start + chunk_size], self.edge_dst[start:start + chunk_size]
+
+    def subgraph(self, node_mask):
+        """Returns the sub-graph induced by the nodes selected in node_mask."""
+        node_mask = np.asarray(node_mask, dtype=bool)
+        global_ids = np.flatnonzero(node_mask).astype(np.int32)
+        new_ids = np.full(self.node_num, -1, dtype=np.int32)
+        new_ids[global_ids] = np.arange(len(global_ids), dtype=np.int32)
+        src_in, dst_in = node_mask[self.edge_src], node_mask[self.edge_dst]
+        internal = src_in & dst_in
+
+        # Links with exactly one endpoint inside become external links of that endpoint
+        ext_degree = np.bincount(new_ids[self.edge_src[src_in & ~dst_in]], minlength=len(global_ids)) + \
+            np.bincount(new_ids[self.edge_dst[dst_in & ~src_in]], minlength=len(global_ids))
+        if self.ext_degree is not None:
+            ext_degree += self.ext_degree[global_ids]
+
+        names = [self.names[i] for i in global_ids.tolist()]
+        if self.global_ids is not None:
+            global_ids = self.global_ids[global_ids]
+        return TopoGraph(
+            names,
+            new_ids[self.edge_src[internal]], new_ids[self.edge_dst[internal]],
+            global_ids=global_ids, ext_degree=ext_degree)
+
+
+def build_csr(node_num, edge_src, edge_dst):
+    """Builds CSR arrays holding both directions of every link, in file order."""
+    # Interleave (u, v) and (v, u) so that a stable sort keeps the order links were read in
+    src = np.empty(2 * len(edge_src), dtype=np.int32)
+    dst = np.empty(2 * len(edge_src), dtype=np.int32)
+    src[0::2], src[1::2] = edge_src, edge_dst
+    dst[0::2], dst[1::2] = edge_dst, edge_src
+    order = np.argsort(src, kind="stable")
+    indices = dst[order]
+    indptr = np.zeros(node_num + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=node_num), out=indptr[1:])
+    return indptr, indices
@@ -0,0 +1,175 @@
+import collections
+import numpy as np
+
+# Partition of a test, saved next to its results:
+#   "<node> <server_id>" for every node, then
+#   "<node> <node> <server_id> <server_id>" for every cross-server link (VXLAN)
+PARTITION_FILENAME = "partition.txt"
+
+
+def save_partition(partition_filepath, graph, node2serverid):
+    node2serverid = np.asarray(node2serverid)
+    with open(partition_filepath, 'w') as f:
+        f.write(''.join(map("{} {}\n".format, graph.names, node2serverid.tolist())))
+        for edge_src, edge_dst in graph.iter_edge_chunks():
+            cross = node2serverid[edge_src] != node2serverid[edge_dst]
+            u, v = edge_src[cross], edge_dst[cross]
+            f.write(''.join(map(
+                "{} {} {} {}\n".format,
+                map(graph.names.__getitem__, u.tolist()), map(graph.names.__getitem__, v.tolist()),
+                node2serverid[u].tolist(), node2serverid[v].tolist())))
+
+
+def load_partition(partition_filepath):
+    """Returns {node: server_id} and the set of VXLANs of a saved partition."""
+    name2serverid, vxlans = {}, set()
+    with open(partition_filepath, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 2:
+                name2serverid[fields[0]] = int(fields[1])
+            elif len(fields) == 4:
+                vxlans.add(_vxlan_key(fields[0], fields[1], int(fields[2]), int(fields[3])))
+    return name2serverid, vxlans
+
+
+def _vxlan_key(u, v, u_server_id, v_server_id):
+    return (u, v, u_server_id, v_server_id) if u <= v else (v, u, v_server_id, u_server_id)
+
+
+def _get_max_sizes(graph, num_partitions, server_shares, imbalance):
+    shares = np.full(num_partitions, 1 / num_partitions) if server_shares is None else \
+        np.asarray(server_shares, dtype=np.float64) / np.sum(server_shares)
+    return np.ceil(imbalance * shares * graph.node_num).astype(np.int64)
+
+
+def assign_new_nodes(graph, parts, num_partitions, max_sizes):
+    """
+    Assigns the nodes without a server (parts < 0) in BFS order from the assigned ones, each to the
+    server most of its assigned neighbors are on, among the servers with room left.
+    Nodes out of reach of any assigned node start from the least loaded server.
+    """
+    parts = np.array(parts, dtype=np.int32)
+    sizes = np.bincount(parts[parts >= 0], minlength=num_partitions)
+    indptr, indices = graph.indptr, graph.indices
+
+    def assign(x):
+        counts = np.bincount(parts[indices[indptr[x]:indptr[x + 1]]] + 1, minlength=num_partitions + 1)[1:]
+        counts[sizes >= max_sizes] = -1
+        p = int(np.argmax(counts)) if counts.max() > 0 else int(np.argmin(sizes))
+        parts[x] = p
+        sizes[p] += 1
+
+    unassigned = np.flatnonzero(parts < 0)
+    if len(unassigned) == 0:
+        return parts
+    row = np.repeat(np.arange(graph.node_num, dtype=np.int32), np.diff(indptr))
+    queue = collections.deque(np.unique(row[(parts[row] < 0) & (parts[indices] >= 0)]).tolist())
+    for seed in unassigned.tolist():
+        if parts[seed] >= 0:
+            continue
+        if not queue:
+            queue.append(seed)
+        while queue:
+            x = queue.popleft()
+            if parts[x] >= 0:
+                continue
+            assign(x)
+            for y in indices[indptr[x]:indptr[x + 1]].tolist():
+                if parts[y] < 0:
+                    queue.append(y)
+    return parts
+
+
+def rebalance_partition(graph, parts, num_partitions, max_sizes):
+    """
+    Moves as few nodes as possible out of the servers above max_sizes: boundary nodes first, to the
+    neighboring server with room they have the most links to, the ones losing the fewest links first.
+    Servers still above their size then hand their lowest-degree nodes to the least loaded servers.
+    """
+    parts = np.array(parts, dtype=np.int32)
+    sizes = np.bincount(parts, minlength=num_partitions)
+    indptr, indices = graph.indptr, graph.indices
+    row = np.repeat(np.arange(graph.node_num, dtype=np.int32), np.diff(indptr))
+    for p in np.flatnonzero(sizes > max_sizes).tolist():
+        moves = []
+        for x in np.unique(row[(parts[row] == p) & (parts[indices] != p)]).tolist():
+            counts = np.bincount(parts[indices[indptr[x]:indptr[x + 1]]], minlength=num_partitions)
+            targets = np.flatnonzero(counts)
+            targets = targets[(targets != p) & (sizes[targets] < max_sizes[targets])]
+            if len(targets) > 0:
+                q = int(targets[np.argmax(counts[targets])])
+                moves.append((counts[p] - counts[q], x, q))
+        for _, x, q in sorted(moves):
+            if sizes[p] <= max_sizes[p]:
+                break
+            if sizes[q] < max_sizes[q]:
+                parts[x] = q
+                sizes[p] -= 1
+                sizes[q] += 1
+        if sizes[p] > max_sizes[p]:
+            nodes = np.flatnonzero(parts == p)
+            for x in nodes[np.argsort(np.diff(indptr)[nodes], kind="stable")].tolist():
+                if sizes[p] <= max_sizes[p]:
+                    break
+                room = max_sizes - sizes
+                room[p] = np.iinfo(np.int64).min
+                q = int(np.argmax(room))
+                parts[x] = q
+                sizes[p] -= 1
+                sizes[q] += 1
+    return parts
+
+
+def repartition_incrementally(graph, name2serverid, num_partitions, server_shares=None, imbalance=1.05):
+    """
+    Derives a node->server vector for graph from the one of a previous, similar topology:
+    known nodes stay on their server (if it still exists), new nodes are placed next to their
+    neighbors, and overloaded servers are relieved with as few moves as possible.
+    """
+    parts = np.fromiter(
+        (name2serverid.get(name, -1) for name in graph.names), dtype=np.int32, count=graph.node_num)
+    parts[parts >= num_partitions] = -1
+    max_sizes = _get_max_sizes(graph, num_partitions, server_shares, imbalance)
+    parts = assign_new_nodes(graph, parts, num_partitions, max_sizes)
+    return rebalance_partition(graph, parts, num_partitions, max_sizes)
+
+
+def get_partition_delta(graph, node2serverid, name2serverid, vxlans):
+    """Nodes added, removed and moved, and VXLANs added and removed since a saved partition."""
+    node2serverid = np.asarray(node2serverid)
+    names = set(graph.names)
+    delta = {
+        "nodes_added": [name for name in graph.names if name not in name2serverid],
+        "nodes_removed": [name for name in name2serverid if name not in names],
+        "nodes_moved": [
+            name for name, server_id in zip(graph.names, node2serverid.tolist())
+            if name in name2serverid and name2serverid[name] != server_id],
+    }
+    new_vxlans = set()
+    for edge_src, edge_dst in graph.iter_edge_chunks():
+        cross = node2serverid[edge_src] != node2serverid[edge_dst]
+        u, v = edge_src[cross], edge_dst[cross]
+        new_vxlans.update(map(
+            _vxlan_key,
+            map(graph.names.__getitem__, u.tolist()), map(graph.names.__getitem__, v.tolist()),
+            node2serverid[u].tolist(), node2serverid[v].tolist()))
+    delta["vxlans_added"] = sorted(new_vxlans - vxlans)
+    delta["vxlans_removed"] = sorted(vxlans - new_vxlans)
+
+    # Servers whose node set or VXLANs changed
+    changed_server_ids = set(name2serverid[name] for name in delta["nodes_removed"] + delta["nodes_moved"])
+    name2index = {name: i for i, name in enumerate(graph.names)}
+    changed_server_ids.update(
+        int(node2serverid[name2index[name]]) for name in delta["nodes_added"] + delta["nodes_moved"])
+    for u, v, u_server_id, v_server_id in delta["vxlans_added"] + delta["vxlans_removed"]:
+        changed_server_ids.update((u_server_id, v_server_id))
+    delta["changed_servers"] = sorted(changed_server_ids)
+    return delta
+
+
+def print_partition_delta(delta, file=None):
+    print(f"Nodes added: {len(delta['nodes_added'])}, removed: {len(delta['nodes_removed'])}, "
+          f"moved: {len(delta['nodes_moved'])}", file=file)
+    print(f"VXLANs added: {len(delta['vxlans_added'])}, removed: {len(delta['vxlans_removed'])}", file=file)
+    print(f"Servers with changed sub-topologies: {delta['changed_servers']}", file=file)
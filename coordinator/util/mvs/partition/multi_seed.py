@@ -0,0 +1,57 @@
+import os
+import multiprocessing
+import concurrent.futures
+import numpy as np
+from .algorithm import partition_metis, get_partition_edge_loads
+from .compute_tdf import compute_tdf
+from .shared_graph import SharedGraph, attach_shared_graph
+
+# Metrics a partition can be selected by, lower is better
+SEED_METRICS = ["emax", "tdf"]
+
+
+def score_partition(graph, parts, num_partitions, metric):
+    """Largest per-part link count (emax), or TDF when the parts are physical machines (tdf)."""
+    if metric == "emax":
+        return int(get_partition_edge_loads(graph, parts, num_partitions).max())
+    elif metric == "tdf":
+        return compute_tdf(graph, parts, {i: i for i in range(num_partitions)})
+    raise ValueError(f"Unknown partition metric {metric}")
+
+
+def _seed_task(shared_graph_handle, num_partitions, seed, metric, tpwgts):
+    graph, metis_graph = attach_shared_graph(shared_graph_handle)
+    parts = partition_metis(graph, num_partitions, metis_graph=metis_graph, seed=seed, tpwgts=tpwgts)
+    return seed, score_partition(graph, parts, num_partitions, metric), parts
+
+
+def partition_metis_best_of_seeds(
+    graph, num_partitions, seed_num, metric,
+    metis_graph=None, worker_num=1, label="parts", tpwgts=None):
+    """
+    Runs METIS with seeds 0..seed_num-1 and returns the partition scoring lowest on metric.
+    With worker_num > 1 the seeds run at the same time in worker processes sharing the graph.
+    """
+    results = []
+    if worker_num > 1:
+        shared_graph = SharedGraph(graph, metis_graph)
+        try:
+            # Spawned rather than forked, as the SSH connection pool may have live threads
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=min(worker_num, seed_num), mp_context=multiprocessing.get_context("spawn")) as executor:
+                futures = [
+                    executor.submit(_seed_task, shared_graph.handle, num_partitions, seed, metric, tpwgts)
+                    for seed in range(seed_num)
+                ]
+                results = [future.result() for future in futures]
+        finally:
+            shared_graph.close()
+    else:
+        for seed in range(seed_num):
+            parts = partition_metis(graph, num_partitions, metis_graph=metis_graph, seed=seed, tpwgts=tpwgts)
+            results.append((seed, score_partition(graph, parts, num_partitions, metric), parts))
+
+    best_seed, best_score, best_parts = min(results, key=lambda x: (x[1], x[0]))
+    scores = [score for _, score, _ in results]
+    print(f"METIS with {seed_num} seeds into {num_partitions} {label}: best {metric} {best_score} (seed {best_seed}), mean {np.mean(scores):.4g}, worst {max(scores)}")
+    return best_parts
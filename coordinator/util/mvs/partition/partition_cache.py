@@ -0,0 +1,67 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# On-disk cache of cross-VM partitions: one .npz per (sub-graph, partition options, n)
+# holding the node->part vector (0-based) and its E_max.
+#   <PARTITION_CACHE_DIR>/<sub-graph hash>/<options hash>/n<n>.npz
+PARTITION_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))),
+    "partition_cache")
+PARTITION_CACHE_VERSION = 3
+
+
+def hash_graph(graph):
+    """
+    Digest of the node count, links and external degrees of a (sub-)graph, in node id order.
+    The external degrees weigh the nodes when balancing edges, so they are part of the key.
+    The links are read chunk by chunk, so that a TopoStream hashes like the graph it streams.
+    """
+    digest = hashlib.sha256()
+    digest.update(np.int64(graph.node_num).tobytes())
+    for end in (0, 1):
+        for edges in graph.iter_edge_chunks():
+            digest.update(np.ascontiguousarray(edges[end], dtype='<i4').tobytes())
+    ext_degree = getattr(graph, "ext_degree", None)
+    if ext_degree is not None:
+        digest.update(b"ext_degree")
+        digest.update(np.ascontiguousarray(ext_degree, dtype='<i8').tobytes())
+    return digest.hexdigest()
+
+
+def hash_partition_options(options):
+    options = dict(options, cache_version=PARTITION_CACHE_VERSION)
+    return hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def get_partition_cache_filepath(graph_digest, options, n, cache_dir=PARTITION_CACHE_DIR):
+    return os.path.join(cache_dir, graph_digest, hash_partition_options(options), f"n{n}.npz")
+
+
+def load_cached_partition(graph_digest, options, n, node_num, cache_dir=PARTITION_CACHE_DIR):
+    """Returns (parts, E_max) of a cached partition, or None if missing or unreadable."""
+    cache_filepath = get_partition_cache_filepath(graph_digest, options, n, cache_dir)
+    try:
+        with np.load(cache_filepath) as data:
+            parts, E_max = data["parts"], int(data["E_max"])
+    except (OSError, KeyError, ValueError):
+        return None
+    if len(parts) != node_num:
+        return None
+    return parts.astype(np.int32), E_max
+
+
+def save_cached_partition(graph_digest, options, n, parts, E_max, cache_dir=PARTITION_CACHE_DIR):
+    """Writes a partition atomically, so that concurrent runs never see a partial file."""
+    cache_filepath = get_partition_cache_filepath(graph_digest, options, n, cache_dir)
+    tmp_filepath = f"{cache_filepath}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_filepath), exist_ok=True)
+        with open(tmp_filepath, 'wb') as f:
+            np.savez(f, parts=np.asarray(parts, dtype=np.int32), E_max=np.int64(E_max))
+        os.replace(tmp_filepath, cache_filepath)
+    except OSError as e:
+        print(f"Failed to write partition cache {cache_filepath}: {e}")
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
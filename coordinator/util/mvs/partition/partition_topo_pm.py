@@ -4,12 +4,23 @@ import shutil
 import argparse
 import subprocess
 from .algorithm import *
+from .multi_seed import *
+from .compute_tdf import *
+from .streaming import *
 
 def partition_graph_across_pm(
     cross_pm_partition_method,
-    nodes, adjacency_list,
-    pm_config_list, input_topo_filepath):
-    """Partitions the graph across multiple physical machines with TBS according to config."""
+    graph,
+    pm_config_list, input_topo_filepath,
+    seed_num=1, seed_metric="tdf", worker_num=None, pm_weights=None, refine_tdf=False):
+    """
+    Partitions the graph across multiple physical machines with TBS according to config.
+    With METIS and seed_num > 1, the best of seed_num seeds on seed_metric is kept,
+    running the seeds in worker_num processes (one per core by default).
+    pm_weights optionally gives the target share of each PM (naive and METIS). METIS then balances
+    node degrees rather than node counts, as the links dominate the construction time of a PM.
+    With refine_tdf, boundary nodes are then moved to lower the TDF under the cross-machine bandwidths.
+    """
 
     # Scan IDs of physical machines
     distinct_pm_ids = set()
@@ -20,54 +31,74 @@ def partition_graph_across_pm(
     if len(distinct_pm_ids) == 1:
         print("Only one PM is available. No partitioning needed.")
         pmid = list(distinct_pm_ids)[0]
-        node2pmid = {}
-        for node in nodes:
-            node2pmid[node] = pmid
-        pmid2nodes = {pmid: nodes}
-        pmid2adjacencylist = {pmid: adjacency_list}
-        return node2pmid, pmid2nodes, pmid2adjacencylist
+        node2pmid = np.full(graph.node_num, pmid, dtype=np.int32)
+        pmid2graph = {pmid: graph}
+        return node2pmid, pmid2graph
+
+    metis_graph = None
+    if pm_weights is not None and cross_pm_partition_method.lower() == "metis":
+        metis_graph = create_metis_graph(graph, get_edge_balance_weights(graph))
 
     if cross_pm_partition_method.lower() == "naive":
         node2pmid = partition_naive(
-            nodes, len(pm_config_list))
+            graph, len(pm_config_list), tpwgts=pm_weights)
+    elif cross_pm_partition_method.lower() == "metis" and seed_num > 1:
+        if seed_metric not in SEED_METRICS:
+            print(f"Seed selection metric {seed_metric} is not identified, exiting...")
+            exit(1)
+        node2pmid = partition_metis_best_of_seeds(
+            graph, len(pm_config_list), seed_num, seed_metric,
+            metis_graph=metis_graph, worker_num=worker_num or os.cpu_count() or 1,
+            label="PMs", tpwgts=pm_weights)
     elif cross_pm_partition_method.lower() == "metis":
         node2pmid = partition_metis(
-            nodes, adjacency_list, len(pm_config_list), random=False)
+            graph, len(pm_config_list), random=False, metis_graph=metis_graph, tpwgts=pm_weights)
+    elif cross_pm_partition_method.lower() == "stream":
+        node2pmid = partition_stream(
+            graph, len(pm_config_list), part_shares=pm_weights,
+            weights=None if pm_weights is None else get_edge_balance_weights(graph))
     elif cross_pm_partition_method.lower() == "tbs":
         node2pmid = partition_tbs(
-            nodes, adjacency_list,
-            pm_config_list, input_topo_filepath)
+            graph, pm_config_list, input_topo_filepath)
     else:
         print(f"Cross-PM partitioning method {cross_pm_partition_method} is not identified, exiting...")
         exit(1)
 
+    if refine_tdf:
+        pm_num = len(pm_config_list)
+        pmid_identity = {i: i for i in range(pm_num)}
+        print(f"TDF before refinement: {compute_tdf(graph, node2pmid, pmid_identity)}")
+        node2pmid = refine_partition_tdf(graph, node2pmid, pm_num)
+        print(f"TDF after refinement: {compute_tdf(graph, node2pmid, pmid_identity)}")
+
     # Construct the sub-graph of each PM for partitioning
-    pmid2nodes = {} # Construct node list
+    pmid2graph = {}
     for pm_id, _ in enumerate(pm_config_list):
-        pmid2nodes[pm_id] = []
-    for node, pm_id in node2pmid.items():
-        pmid2nodes[pm_id].append(node)
-    for pm_id in sorted(pmid2nodes.keys()):
-        print(f"PM {pm_id} has {len(pmid2nodes[pm_id])} nodes.")
-    pmid2adjacencylist = {} # Construct adjacency list
-    pmid2edgenum = {} # Construct adjacency list
-    for pm_id in pmid2nodes.keys():
-        pmid2adjacencylist[pm_id] = {}
-        pmid2edgenum[pm_id] = 0
-        for node in pmid2nodes[pm_id]:
-            pmid2adjacencylist[pm_id][node] = []
-    for node, pm_id in node2pmid.items():
-        # If the node is not dangling, add its neighbors in the same PM into the adjacency list
-        for neighbor in adjacency_list[node]:
-            if node2pmid[neighbor] == pm_id:
-                if neighbor not in pmid2adjacencylist[pm_id]:
-                    pmid2adjacencylist[pm_id][neighbor] = []
-                if node not in pmid2adjacencylist[pm_id]:
-                    pmid2adjacencylist[pm_id][node] = []
-                pmid2adjacencylist[pm_id][node].append(neighbor)
-                pmid2adjacencylist[pm_id][neighbor].append(node)
-                pmid2edgenum[pm_id] += 1
-    for pm_id in sorted(pmid2adjacencylist.keys()):
-        print(f"PM {pm_id} has {pmid2edgenum[pm_id]} edges.")
+        pmid2graph[pm_id] = graph.subgraph(node2pmid == pm_id)
+    for pm_id in sorted(pmid2graph.keys()):
+        print(f"PM {pm_id} has {pmid2graph[pm_id].node_num} nodes.")
+    for pm_id in sorted(pmid2graph.keys()):
+        print(f"PM {pm_id} has {pmid2graph[pm_id].edge_num} edges.")
+
+    return node2pmid, pmid2graph
+
+
+def partition_stream_across_pm(stream, pm_config_list, pm_weights=None, restream_passes=STREAM_RESTREAM_PASSES):
+    """
+    Partitions a TopoStream across the physical machines with partition_stream, without building the graph.
+    pm_weights optionally gives the target share of each PM, balancing node degrees as for the graph.
+    Returns node2pmid and the sub-topology of every PM as a MaskedTopoStream.
+    """
+    pm_num = len(pm_config_list)
+    if pm_num == 1:
+        print("Only one PM is available. No partitioning needed.")
+        return np.zeros(stream.node_num, dtype=np.int32), {0: stream}
+
+    weights = None if pm_weights is None else np.maximum(get_stream_degrees(stream), 1)
+    node2pmid = partition_stream(
+        stream, pm_num, part_shares=pm_weights, weights=weights, restream_passes=restream_passes)
 
-    return node2pmid, pmid2nodes, pmid2adjacencylist
+    pmid2stream = {pm_id: stream.masked(node2pmid == pm_id) for pm_id in range(pm_num)}
+    for pm_id in sorted(pmid2stream.keys()):
+        print(f"PM {pm_id} has {pmid2stream[pm_id].node_num} nodes.")
+    return node2pmid, pmid2stream
@@ -4,52 +4,109 @@ import time
 from .fmt_util import *
 from .compute_tdf import *
 from .algorithm import *
+from .partition_cache import *
+from .multi_seed import *
+from .streaming import *
+from .incremental import *
 
+# Settings of partition_graph_across_vm, part of the partition cache key
+VM_PARTITION_OPTIONS = {"method": "metis", "seed": None, "balance": "nodes"}
 
-def create_metis_adjacency_list(nodes, adjacency_list):
-    """Converts the adjacency list to METIS format where indices must be contiguous."""
-    node_to_index = {node: idx for idx, node in enumerate(nodes)}
-    index_to_node = {idx: node for node, idx in node_to_index.items()}
-    metis_adjacency_list = []
 
-    start_time = time.time()
-    neighbor_count = 0
-    for node in nodes:
-        # Convert the node's neighbors from IDs to indices
-        # neighbors_with_weight = [(node_to_index[neighbor], 1) for neighbor in adjacency_list[node]]  # Add default weight 1
-        # metis_adjacency_list.append(neighbors_with_weight)
-        neighbors = [node_to_index[neighbor] for neighbor in adjacency_list[node]]  # Add default weight 1
-        metis_adjacency_list.append(neighbors)
-        neighbor_count += 1
-        # if neighbor_count % 1000 == 0:
-        #     print(f"Neighbor count: {neighbor_count}")
-    # print("Adjacency list conversion completed. Time-cost: ", time.time() - start_time)
+def get_vm_partition_options(exp_config):
+    """
+    Cross-VM partitioning settings from the experiment config: "VMPartitioning" ("metis", "tree" or "stream")
+    and "VMPartitionBalance" ("nodes", or "edges" to balance the per-VM link count E_max).
+    """
+    method = exp_config.get("VMPartitioning", "metis").lower()
+    if method == "metis":
+        options = dict(VM_PARTITION_OPTIONS)
+    elif method == "tree":
+        options = {
+            "method": "tree", "seed": None,
+            "leaf_num": exp_config.get("TreeLeafNum", 128),
+            "refine": exp_config.get("TreeRefinement", False),
+        }
+    elif method == "stream":
+        options = {
+            "method": "stream", "seed": None,
+            "restream_passes": exp_config.get("StreamRestreamPasses", STREAM_RESTREAM_PASSES),
+        }
+    else:
+        print(f"Cross-VM partitioning method {method} is not identified, exiting...")
+        exit(1)
 
-    return metis_adjacency_list, node_to_index, index_to_node
+    # Best of several METIS seeds
+    seed_num = exp_config.get("MetisSeedNum", 1)
+    if method == "metis" and seed_num > 1:
+        options["seed_num"] = seed_num
+        options["seed_metric"] = exp_config.get("CrossVMSeedMetric", "emax").lower()
+        if options["seed_metric"] not in SEED_METRICS:
+            print(f"Seed selection metric {options['seed_metric']} is not identified, exiting...")
+            exit(1)
 
+    balance = exp_config.get("VMPartitionBalance", "nodes").lower()
+    if balance == "nodes":
+        options["balance"] = "nodes"
+    elif balance == "edges":
+        options["balance"] = "edges"
+        options["dangling_cost"] = exp_config.get("DanglingEdgeCost", 2)
+    else:
+        print(f"Cross-VM partition balance {balance} is not identified, exiting...")
+        exit(1)
+    return options
 
-def partition_graph_across_vm(nodes, adjacency_list, num_partitions, acc_server_num, random=False):
-    """Partitions the graph into num_partitions using METIS and writes each subgraph."""
-    if num_partitions == 1:
-        node2serverid = {}
-        server_id = acc_server_num
-        for node in nodes:
-            node2serverid[node] = server_id
-        return node2serverid
 
-    node2serverid = partition_metis(
-        nodes, adjacency_list, num_partitions, random=False)
+def partition_graph_across_vm(
+    graph, num_partitions, acc_server_num, random=False, metis_graph=None,
+    options=VM_PARTITION_OPTIONS, tree=None, refine_max_load=True):
+    """
+    Partitions the graph into num_partitions and returns the node->server vector.
+    With the "tree" method, a partition tree already built by build_partition_tree may be passed.
+    The "stream" method partitions from the links only, without CSR or METIS arrays.
+    Edge-balanced partitions are followed by refine_partition_max_load unless refine_max_load is False.
+    """
+    if num_partitions == 1:
+        return np.full(graph.node_num, acc_server_num, dtype=np.int32)
 
-    for node in node2serverid:
-        node2serverid[node] += acc_server_num
+    edge_balanced = options.get("balance", "nodes") == "edges"
+    vwgt = get_edge_balance_weights(graph, options["dangling_cost"]) if edge_balanced else None
+    if options["method"] == "tree":
+        if tree is None:
+            tree = build_partition_tree(
+                graph, max(num_partitions, options["leaf_num"]), metis_graph, vwgt)
+        node2serverid = partition_tree(
+            graph, num_partitions, tree, refine=options["refine"], metis_graph=metis_graph, vwgt=vwgt)
+    elif options["method"] == "stream":
+        node2serverid = partition_stream(
+            graph, num_partitions, weights=vwgt, restream_passes=options["restream_passes"])
+    else:
+        if edge_balanced:
+            metis_graph = create_metis_graph(graph, vwgt) if metis_graph is None \
+                else with_vertex_weights(metis_graph, vwgt)
+        if options.get("seed_num", 1) > 1:
+            node2serverid = partition_metis_best_of_seeds(
+                graph, num_partitions, options["seed_num"], options["seed_metric"],
+                metis_graph=metis_graph, label="VMs")
+        else:
+            node2serverid = partition_metis(
+                graph, num_partitions, random=False, metis_graph=metis_graph)
+    if edge_balanced and refine_max_load:
+        node2serverid = refine_partition_max_load(graph, node2serverid, num_partitions)
 
-    return node2serverid
+    return node2serverid + acc_server_num
 
 
 def partition_topo_across_vms_for_all_pms(
-    nodes, adjacency_list,
-    pmid2nodes, pmid2adjacencylist,
-    vm_config_list, input_topo_filepath):
+    graph, pmid2graph,
+    vm_config_list, input_topo_filepath,
+    pmid2partitions=None, partition_options=VM_PARTITION_OPTIONS):
+    """
+    Partitions every PM sub-graph into the VMs of that PM, writes the sub-topologies and
+    returns the TDF and the node->server vector.
+    pmid2partitions holds {pm_id: {vm_num: node->VM vector}} kept from planning;
+    a kept or cached partition is used as is, the others are partitioned with partition_options.
+    """
 
     pm2servernum = {}
     serverid2pmid = {}
@@ -65,35 +122,218 @@ def partition_topo_across_vms_for_all_pms(
 
     # Partition the sub-graph of each PM into VMs
     import concurrent.futures
-    def partition_vm_task(pm_id, pmid2nodes, pmid2adjacencylist, pm_server_num, acc_server_num):
+    def partition_vm_task(pm_id, pmid2graph, pm_server_num, acc_server_num):
         # print(f"Partitioning with PM #{pm_id}...")
-        return partition_graph_across_vm(
-            pmid2nodes[pm_id], pmid2adjacencylist[pm_id], pm_server_num, acc_server_num
-        )
+        # Reuse the partition derived during planning if it was kept or cached
+        pm_graph = pmid2graph[pm_id]
+        if pmid2partitions is not None and pm_server_num in pmid2partitions.get(pm_id, {}):
+            return pm_id, pmid2partitions[pm_id][pm_server_num] + acc_server_num, "planning"
+        cached = load_cached_partition(
+            hash_graph(pm_graph), partition_options, pm_server_num, pm_graph.node_num)
+        if cached is not None:
+            return pm_id, cached[0] + acc_server_num, "the partition cache"
+        return pm_id, partition_graph_across_vm(
+            pm_graph, pm_server_num, acc_server_num, options=partition_options
+        ), None
     with concurrent.futures.ThreadPoolExecutor() as executor:
         futures = []
         acc_server_num = 0
         for pm_id, pm_server_num in pm2servernum.items():
-            futures.append(executor.submit(partition_vm_task, pm_id, pmid2nodes, pmid2adjacencylist, pm_server_num, acc_server_num))
+            futures.append(executor.submit(partition_vm_task, pm_id, pmid2graph, pm_server_num, acc_server_num))
             acc_server_num += pm_server_num
-        node2serverid = {}
+        node2serverid = np.zeros(graph.node_num, dtype=np.int32)
         for future in concurrent.futures.as_completed(futures):
-            node2serverid.update(future.result())
+            pm_id, pm_node2serverid, reused_from = future.result()
+            if reused_from is not None:
+                print(f"PM #{pm_id}: partition into {pm2servernum[pm_id]} VMs reused from {reused_from}")
+            pm_graph = pmid2graph[pm_id]
+            if pm_graph.global_ids is None:
+                node2serverid[:] = pm_node2serverid
+            else:
+                node2serverid[pm_graph.global_ids] = pm_node2serverid
+
+    return write_server_partition(graph, node2serverid, serverid2pmid, input_topo_filepath)
+
+
+def partition_graph_hierarchically(
+    graph, pm_vm_nums, node2pm=None, pm_shares=None,
+    options=VM_PARTITION_OPTIONS, cross_pm_cost=4, pm_partitions=None):
+    """
+    Partitions the graph across PMs and their VMs in one call and returns (node->PM index, node->VM vector),
+    pm_vm_nums[i] being the VM count of the i-th PM and VMs being numbered PM after PM.
+    The PM layout node2pm is computed with METIS (targeting pm_shares) unless given. Every PM is then cut
+    into its VMs with options, or starts from pm_partitions[i] (a 0-based node->VM vector of its sub-graph)
+    if given, and the whole two-level partition is refined on the full graph, a cut link costing
+    cross_pm_cost across PMs and 1 between VMs of the same PM. A given PM layout is kept as is.
+    """
+    pm_num = len(pm_vm_nums)
+    fixed_pms = node2pm is not None
+    if node2pm is None:
+        node2pm = partition_metis(
+            graph, pm_num, tpwgts=None if pm_shares is None else
+            (np.asarray(pm_shares, dtype=np.float64) / np.sum(pm_shares)).tolist()) \
+            if pm_num > 1 else np.zeros(graph.node_num, dtype=np.int32)
+    node2pm = np.asarray(node2pm, dtype=np.int32)
+
+    node2vmid = np.empty(graph.node_num, dtype=np.int32)
+    acc_vm_num = 0
+    for pm_index, vm_num in enumerate(pm_vm_nums):
+        node_mask = node2pm == pm_index
+        if pm_partitions is not None and pm_partitions[pm_index] is not None:
+            node2vmid[node_mask] = np.asarray(pm_partitions[pm_index]) + acc_vm_num
+        else:
+            pm_graph = graph.subgraph(node_mask)
+            node2vmid[node_mask] = partition_graph_across_vm(pm_graph, vm_num, acc_vm_num, options=options)
+        acc_vm_num += vm_num
+
+    vm2pm = np.repeat(np.arange(pm_num, dtype=np.int32), pm_vm_nums)
+    weights = get_edge_balance_weights(graph, options["dangling_cost"]) \
+        if options.get("balance", "nodes") == "edges" else None
+    node2vmid = refine_hierarchical_boundary(
+        graph, node2vmid, vm2pm, cross_pm_cost, weights, fixed_pms=fixed_pms)
+    return vm2pm[node2vmid], node2vmid
+
+
+def partition_topo_hierarchically(
+    graph, node2pmid, pmid2graph, vm_config_list, input_topo_filepath,
+    pmid2partitions=None, partition_options=VM_PARTITION_OPTIONS, cross_pm_cost=4):
+    """
+    Partitions the whole graph into the VMs of all PMs with partition_graph_hierarchically,
+    keeping the PM layout node2pmid used for planning and starting from the partitions kept
+    from planning (pmid2partitions, as in partition_topo_across_vms_for_all_pms) where there are some.
+    A PM whose E_max grows over the planned one in the refinement gets its planned partition back.
+    Prints the planned and deployed E_max of every PM and writes the sub-topologies.
+    """
+    pm2servernum = {}
+    serverid2pmid = {}
+    for i, server in enumerate(vm_config_list):
+        pm_id = server["physicalMachineId"]
+        pm2servernum[pm_id] = pm2servernum.get(pm_id, 0) + 1
+        serverid2pmid[i] = pm_id
+    print(f"Partitioning hierarchically...")
+    print(f"# of physical machines: {len(pm2servernum)}")
+    print(f"# of servers: {len(vm_config_list)}")
+
+    # Servers are numbered PM after PM, in order of first appearance, as for the per-PM partitioning
+    pm_ids = list(pm2servernum)
+    pmid2index = np.full(max(pm_ids) + 1, -1, dtype=np.int32)
+    pmid2index[pm_ids] = np.arange(len(pm_ids), dtype=np.int32)
+    pm_partitions = [
+        pmid2partitions.get(pm_id, {}).get(pm2servernum[pm_id]) if pmid2partitions is not None else None
+        for pm_id in pm_ids
+    ]
+    _, node2serverid = partition_graph_hierarchically(
+        graph, [pm2servernum[pm_id] for pm_id in pm_ids], pmid2index[np.asarray(node2pmid)],
+        options=partition_options, cross_pm_cost=cross_pm_cost, pm_partitions=pm_partitions)
+
+    # Check E_max on the PM sub-graph, as the planner models it, against the plan
+    acc_server_num = 0
+    for pm_id, planned in zip(pm_ids, pm_partitions):
+        pm_graph, vm_num = pmid2graph[pm_id], pm2servernum[pm_id]
+        pm_node_ids = slice(None) if pm_graph.global_ids is None else pm_graph.global_ids
+        deployed_E_max = int(get_partition_edge_loads(
+            pm_graph, node2serverid[pm_node_ids] - acc_server_num, vm_num).max())
+        if planned is None:
+            print(f"PM #{pm_id}: planned E_max n/a, deployed E_max {deployed_E_max}")
+        else:
+            planned_E_max = int(get_partition_edge_loads(pm_graph, np.asarray(planned), vm_num).max())
+            if deployed_E_max > planned_E_max:
+                print(f"PM #{pm_id}: E_max {deployed_E_max} after refinement exceeds the planned {planned_E_max}, keeping the planned partition")
+                node2serverid[pm_node_ids] = np.asarray(planned) + acc_server_num
+                deployed_E_max = planned_E_max
+            print(f"PM #{pm_id}: planned E_max {planned_E_max}, deployed E_max {deployed_E_max}")
+        acc_server_num += vm_num
+
+    return write_server_partition(graph, node2serverid, serverid2pmid, input_topo_filepath)
+
+
+def partition_topo_file_streaming(
+    input_topo_filepath, vm_config_list, node2pmid=None,
+    restream_passes=STREAM_RESTREAM_PASSES, pmid2partitions=None):
+    """
+    Partitions a topology file across PMs and their VMs with partition_stream, reading the links
+    from the file (or its binary cache) on every pass, and writes the sub-topologies.
+    Memory stays proportional to the node count. The PM layout node2pmid is streamed too
+    (with shares following the VM counts) unless given. A PM keeps the partition kept from
+    planning (pmid2partitions, as in partition_topo_across_vms_for_all_pms) if there is one.
+    """
+    pm2servernum = {}
+    serverid2pmid = {}
+    for i, server in enumerate(vm_config_list):
+        pm_id = server["physicalMachineId"]
+        pm2servernum[pm_id] = pm2servernum.get(pm_id, 0) + 1
+        serverid2pmid[i] = pm_id
+    print(f"Partitioning by streaming {input_topo_filepath}...")
+    print(f"# of physical machines: {len(pm2servernum)}")
+    print(f"# of servers: {len(vm_config_list)}")
+
+    stream = TopoStream(input_topo_filepath)
+    pm_ids = list(pm2servernum)
+    if node2pmid is None:
+        pm_index2pmid = np.array(pm_ids, dtype=np.int32)
+        node2pmid = pm_index2pmid[partition_stream(
+            stream, len(pm_ids), [pm2servernum[pm_id] for pm_id in pm_ids],
+            restream_passes=restream_passes)]
+
+    # Servers are numbered PM after PM, in order of first appearance
+    node2serverid = np.empty(stream.node_num, dtype=np.int32)
+    acc_server_num = 0
+    for pm_id in pm_ids:
+        node_mask = np.asarray(node2pmid) == pm_id
+        planned = pmid2partitions.get(pm_id, {}).get(pm2servernum[pm_id]) if pmid2partitions is not None else None
+        if planned is None:
+            planned = partition_stream(stream.masked(node_mask), pm2servernum[pm_id], restream_passes=restream_passes)
+        node2serverid[node_mask] = np.asarray(planned) + acc_server_num
+        acc_server_num += pm2servernum[pm_id]
+
+    return write_server_partition(stream, node2serverid, serverid2pmid, input_topo_filepath)
+
+
+def partition_topo_incrementally(
+    graph, node2pmid, vm_config_list, input_topo_filepath, prev_partition_filepath):
+    """
+    Derives the partition from the one saved in prev_partition_filepath for a previous topology
+    with repartition_incrementally, prints what changed and writes the sub-topologies.
+    Returns the TDF, the node->server vector and the delta.
+    """
+    pm2servernum = {}
+    serverid2pmid = {}
+    for i, server in enumerate(vm_config_list):
+        pm_id = server["physicalMachineId"]
+        pm2servernum[pm_id] = pm2servernum.get(pm_id, 0) + 1
+        serverid2pmid[i] = pm_id
+    print(f"Partitioning incrementally from {prev_partition_filepath}...")
+    print(f"# of physical machines: {len(pm2servernum)}")
+    print(f"# of servers: {len(vm_config_list)}")
+
+    # Every server gets an even part of the nodes its PM had during planning
+    pm_node_nums = np.bincount(np.asarray(node2pmid), minlength=max(pm2servernum) + 1)
+    server_shares = [pm_node_nums[serverid2pmid[i]] / pm2servernum[serverid2pmid[i]]
+                     for i in range(len(vm_config_list))]
+    name2serverid, vxlans = load_partition(prev_partition_filepath)
+    node2serverid = repartition_incrementally(graph, name2serverid, len(vm_config_list), server_shares)
+    delta = get_partition_delta(graph, node2serverid, name2serverid, vxlans)
+    print_partition_delta(delta)
+
+    tdf, node2serverid = write_server_partition(graph, node2serverid, serverid2pmid, input_topo_filepath)
+    return tdf, node2serverid, delta
+
+
+def write_server_partition(graph, node2serverid, serverid2pmid, input_topo_filepath):
+    """Prints the server sizes, writes the sub-topologies and returns the TDF and the node->server vector."""
+    server_num = len(serverid2pmid)
 
     # Print # of nodes in each server
-    serverid2nodes = {}
-    for node_name, server_id in node2serverid.items():
-        if serverid2nodes.get(server_id) is None:
-            serverid2nodes[server_id] = []
-        serverid2nodes[server_id].append(node_name)
-    for server_id in sorted(serverid2nodes.keys()):
-        print(f"Server {server_id}: {len(serverid2nodes[server_id])} nodes")
+    server_node_nums = np.bincount(node2serverid, minlength=server_num)
+    for server_id, server_node_num in enumerate(server_node_nums.tolist()):
+        if server_node_num > 0:
+            print(f"Server {server_id}: {server_node_num} nodes")
 
-    # Scan the adjacency_list, and allocate VXLAN IDs for cross-pm edges and cross-vm-intra-pm edges
-    write_subtopos_to_file(nodes, adjacency_list, node2serverid, acc_server_num, input_topo_filepath)
+    # Scan the links, and allocate VXLAN IDs for cross-pm edges and cross-vm-intra-pm edges
+    write_subtopos_to_file(graph, node2serverid, server_num, input_topo_filepath)
 
     # Calculate and print TDF
-    tdf = compute_tdf(nodes, adjacency_list, node2serverid, serverid2pmid)
+    tdf = compute_tdf(graph, node2serverid, serverid2pmid)
     print(f"TDF: {tdf}")
 
-    return tdf
+    return tdf, node2serverid
@@ -0,0 +1,80 @@
+import metis
+import numpy as np
+from multiprocessing import shared_memory
+from .graph import TopoGraph
+from .algorithm import create_metis_graph
+
+# Arrays of a TopoGraph (and of its METIS conversion) placed in shared memory,
+# so that partitioning workers attach to them instead of receiving a pickled copy.
+# The METIS vertex weights are shared too when the METIS graph has some.
+SHARED_GRAPH_ARRAYS = ["edge_src", "edge_dst", "indptr", "indices", "ext_degree", "xadj", "adjncy"]
+
+
+class SharedGraph:
+    """Owner side of a graph in shared memory. handle is the picklable descriptor passed to workers."""
+
+    def __init__(self, graph, metis_graph=None):
+        if metis_graph is None:
+            metis_graph = create_metis_graph(graph)
+        arrays = {
+            "edge_src": graph.edge_src,
+            "edge_dst": graph.edge_dst,
+            "indptr": graph.indptr,
+            "indices": graph.indices,
+            "ext_degree": graph.ext_degree if graph.ext_degree is not None \
+                else np.zeros(graph.node_num, dtype=np.int64),
+            "xadj": np.ctypeslib.as_array(metis_graph.xadj),
+            "adjncy": np.ctypeslib.as_array(metis_graph.adjncy),
+        }
+        if metis_graph.vwgt is not None:
+            arrays["vwgt"] = np.ctypeslib.as_array(metis_graph.vwgt)
+        self.shms = []
+        self.handle = {"node_num": graph.node_num, "arrays": {}}
+        try:
+            for key in arrays:
+                array = np.ascontiguousarray(arrays[key])
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self.shms.append(shm)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+                self.handle["arrays"][key] = (shm.name, array.shape, array.dtype.str)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        for shm in self.shms:
+            shm.close()
+            shm.unlink()
+        self.shms = []
+
+
+# Graphs already attached by this (worker) process, keyed by the name of their first block
+_attached_graphs = {}
+
+
+def attach_shared_graph(handle):
+    """Worker side: returns (graph, metis_graph) backed by the shared memory blocks of handle."""
+    key = handle["arrays"]["edge_src"][0]
+    if key in _attached_graphs:
+        return _attached_graphs[key][1:]
+
+    shms, arrays = [], {}
+    for name, (shm_name, shape, dtype) in handle["arrays"].items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        shms.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    # Node names are not needed for partitioning, only the node count
+    node_num = handle["node_num"]
+    graph = TopoGraph(range(node_num), arrays["edge_src"], arrays["edge_dst"],
+                      ext_degree=arrays["ext_degree"],
+                      indptr=arrays["indptr"], indices=arrays["indices"])
+    xadj, adjncy, vwgt = arrays["xadj"], arrays["adjncy"], arrays.get("vwgt")
+    metis_graph = metis.METIS_Graph(
+        metis.idx_t(node_num), metis.idx_t(1),
+        (metis.idx_t * len(xadj)).from_buffer(xadj),
+        (metis.idx_t * len(adjncy)).from_buffer(adjncy),
+        (metis.idx_t * len(vwgt)).from_buffer(vwgt) if vwgt is not None else None,
+        None, None)
+    _attached_graphs[key] = (shms, graph, metis_graph)
+    return graph, metis_graph
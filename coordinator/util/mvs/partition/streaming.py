@@ -0,0 +1,319 @@
+import os
+import numpy as np
+from .topo_cache import *
+
+# Restreaming passes run after the one-pass assignment by default
+STREAM_RESTREAM_PASSES = 4
+
+
+class TopoStream:
+    """
+    Topology read link chunk by link chunk instead of being held as a graph. Links come from the
+    memory-mapped binary cache when it matches the text file. Otherwise the first pass over the text
+    file builds the cache (unless write_cache is False, in which case every pass parses the text).
+    Only per-node data (names, ids, degrees) stays in memory.
+    Node ids are the ones read_graph_from_topo_file gives, dangling nodes being dropped.
+    """
+
+    def __init__(self, input_filepath, chunk_size=1 << 20, write_cache=True):
+        self.input_filepath = input_filepath
+        self.chunk_size = chunk_size
+        digest = hash_topo_file(input_filepath)
+        cache_filepath = get_topo_cache_filepath(input_filepath)
+        cached = load_cached_edges(cache_filepath, digest)
+        if cached is None:
+            self._read_text(cache_filepath if write_cache else None, digest)
+            if write_cache:
+                cached = load_cached_edges(cache_filepath, digest)
+        if cached is not None:
+            self.names, self.edge_src, self.edge_dst = cached
+            self.name2id = self.new_ids = None
+            self.edge_num = len(self.edge_src)
+
+    def _read_text(self, cache_filepath, digest):
+        """First pass over the text file: interns the node names and counts the links of every node."""
+        self.edge_src = self.edge_dst = None
+        with open(self.input_filepath, 'r') as f:
+            name2id = {name: i for i, name in enumerate(dict.fromkeys(f.readline().split()))}
+        degree = np.zeros(len(name2id), dtype=np.int64)
+        self.name2id, self.new_ids, self.edge_num = name2id, None, 0
+        # Link endpoints are spilled to disk in the meantime when building the cache
+        spill_filepaths = [f"{cache_filepath}.{os.getpid()}.{end}.tmp" for end in ("src", "dst")] \
+            if cache_filepath is not None else []
+        spill_files = [open(spill_filepath, 'wb') for spill_filepath in spill_filepaths]
+        try:
+            for edge_src, edge_dst in self._iter_text_chunks(min(self.chunk_size, 1 << 16)):
+                if len(name2id) > len(degree):
+                    degree = np.append(degree, np.zeros(len(name2id) - len(degree), dtype=np.int64))
+                degree += np.bincount(edge_src, minlength=len(degree)) + \
+                    np.bincount(edge_dst, minlength=len(degree))
+                self.edge_num += len(edge_src)
+                for spill_file, edges in zip(spill_files, (edge_src, edge_dst)):
+                    spill_file.write(np.ascontiguousarray(edges, dtype='<i4').tobytes())
+            for spill_file in spill_files:
+                spill_file.close()
+
+            names = list(name2id)
+            keep = degree > 0
+            self.new_ids = np.where(keep, np.cumsum(keep, dtype=np.int64) - 1, -1).astype(np.int32)
+            self.names = [name for name, k in zip(names, keep.tolist()) if k]
+            if cache_filepath is not None and self.edge_num > 0:
+                edges = [np.memmap(spill_filepath, dtype='<i4', mode='r+', shape=(self.edge_num,))
+                         for spill_filepath in spill_filepaths]
+                for array in edges:
+                    for start in range(0, self.edge_num, self.chunk_size):
+                        array[start:start + self.chunk_size] = self.new_ids[array[start:start + self.chunk_size]]
+                save_cached_edges(cache_filepath, self.names, edges[0], edges[1], digest, self.chunk_size)
+                del edges
+        finally:
+            for spill_file, spill_filepath in zip(spill_files, spill_filepaths):
+                spill_file.close()
+                if os.path.exists(spill_filepath):
+                    os.remove(spill_filepath)
+
+    @property
+    def node_num(self):
+        return len(self.names)
+
+    def _iter_text_chunks(self, chunk_size=None):
+        # About 16 bytes per link line
+        chunk_bytes = 16 * (chunk_size or self.chunk_size)
+        with open(self.input_filepath, 'r') as f:
+            f.readline()
+            while True:
+                lines = f.readlines(chunk_bytes)
+                if not lines:
+                    break
+                tokens = ''.join(lines).split()
+                if len(tokens) % 2 != 0:
+                    raise ValueError(f"Malformed topology file {self.input_filepath}: odd number of link endpoints")
+                name2id = self.name2id
+                endpoint_ids = np.fromiter(
+                    (name2id.setdefault(token, len(name2id)) for token in tokens),
+                    dtype=np.int32, count=len(tokens))
+                if self.new_ids is not None:
+                    endpoint_ids = self.new_ids[endpoint_ids]
+                yield endpoint_ids[0::2], endpoint_ids[1::2]
+
+    def iter_edge_chunks(self, chunk_size=None):
+        """Yields the links as (edge_src, edge_dst) id arrays, chunk by chunk, in file order."""
+        chunk_size = chunk_size or self.chunk_size
+        if self.edge_src is None:
+            yield from self._iter_text_chunks(chunk_size)
+            return
+        for start in range(0, self.edge_num, chunk_size):
+            yield np.asarray(self.edge_src[start:start + chunk_size]), \
+                np.asarray(self.edge_dst[start:start + chunk_size])
+
+    def masked(self, node_mask):
+        return MaskedTopoStream(self, node_mask)
+
+
+class MaskedTopoStream:
+    """Sub-topology of a stream induced by the nodes selected in node_mask, with dense local ids."""
+
+    def __init__(self, stream, node_mask):
+        self.stream = stream
+        self.node_mask = np.asarray(node_mask, dtype=bool)
+        global_ids = np.flatnonzero(self.node_mask)
+        self.new_ids = np.full(len(self.node_mask), -1, dtype=np.int32)
+        self.new_ids[global_ids] = np.arange(len(global_ids), dtype=np.int32)
+        self.names = [stream.names[i] for i in global_ids.tolist()]
+
+    @property
+    def node_num(self):
+        return len(self.names)
+
+    def iter_edge_chunks(self, chunk_size=None):
+        for edge_src, edge_dst in self.stream.iter_edge_chunks(chunk_size):
+            internal = self.node_mask[edge_src] & self.node_mask[edge_dst]
+            yield self.new_ids[edge_src[internal]], self.new_ids[edge_dst[internal]]
+
+
+def get_stream_degrees(graph, chunk_size=1 << 20):
+    """Link count of every node (self-loops left out) of a TopoGraph, TopoStream or MaskedTopoStream, chunk by chunk."""
+    degree = np.zeros(graph.node_num, dtype=np.int64)
+    for edge_src, edge_dst in graph.iter_edge_chunks(chunk_size):
+        not_loop = edge_src != edge_dst
+        degree += np.bincount(edge_src[not_loop], minlength=graph.node_num) + \
+            np.bincount(edge_dst[not_loop], minlength=graph.node_num)
+    return degree
+
+
+def count_links(graph, chunk_size=1 << 20):
+    """Number of links (self-loops left out) of a TopoGraph, TopoStream or MaskedTopoStream, chunk by chunk."""
+    return sum(int(np.count_nonzero(edge_src != edge_dst))
+               for edge_src, edge_dst in graph.iter_edge_chunks(chunk_size))
+
+
+def _fill_parts(seed_weights, sizes, targets, capacities, preference=None):
+    """
+    Spreads seeds (in order) over the parts below their target size, the most preferred part first,
+    then the least loaded one.
+    """
+    slack = np.maximum(targets - sizes, 0)
+    if slack.sum() < seed_weights.sum():
+        slack = np.maximum(capacities - sizes, 0)
+    part_order = np.argsort(sizes, kind="stable") if preference is None else \
+        np.lexsort((sizes, -preference))
+    midpoints = np.cumsum(seed_weights) - seed_weights / 2
+    slots = np.searchsorted(np.cumsum(slack[part_order]), midpoints, side="right")
+    return part_order[np.minimum(slots, len(sizes) - 1)].astype(np.int32)
+
+
+def _within_capacity(nodes, to_parts, weights, sizes, capacities):
+    """Mask of the moves (in order) that fit in the remaining capacity of their target part."""
+    order = np.argsort(to_parts, kind="stable")
+    sorted_parts = to_parts[order]
+    cum_weights = np.cumsum(weights[nodes[order]])
+    group_starts = np.searchsorted(sorted_parts, sorted_parts)
+    group_offsets = np.concatenate([[0], cum_weights])[group_starts]
+    fits = np.empty(len(nodes), dtype=bool)
+    fits[order] = cum_weights - group_offsets <= capacities[sorted_parts] - sizes[sorted_parts]
+    return fits
+
+
+def _within_exchange(from_parts, to_parts, move_weights, sizes, capacities):
+    """
+    Mask of the moves (in order) kept so that every part stays within capacity: between two parts,
+    moves are kept up to the weight moving the other way, plus a share of the target's free capacity.
+    """
+    num_partitions = len(sizes)
+    keys = from_parts.astype(np.int64) * num_partitions + to_parts
+    demand = np.bincount(keys, weights=move_weights, minlength=num_partitions * num_partitions) \
+        .reshape(num_partitions, num_partitions)
+    free = np.maximum(capacities - sizes, 0) / num_partitions
+    allowed = np.minimum(demand, demand.T + free[None, :]).ravel()
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    cum_weights = np.cumsum(move_weights[order])
+    group_offsets = np.concatenate([[0], cum_weights])[np.searchsorted(sorted_keys, sorted_keys)]
+    fits = np.empty(len(keys), dtype=bool)
+    fits[order] = cum_weights - group_offsets <= allowed[sorted_keys]
+    return fits
+
+
+def _both_directions(edge_src, edge_dst):
+    """(endpoint, peer) pairs of both directions of every link, interleaved to keep the link order."""
+    not_loop = edge_src != edge_dst
+    edge_src, edge_dst = edge_src[not_loop], edge_dst[not_loop]
+    return np.stack([edge_src, edge_dst], axis=1).ravel(), np.stack([edge_dst, edge_src], axis=1).ravel()
+
+
+def _count_cut(graph, parts, chunk_size):
+    return sum(int(np.count_nonzero(parts[edge_src] != parts[edge_dst]))
+               for edge_src, edge_dst in graph.iter_edge_chunks(chunk_size))
+
+
+def partition_stream(graph, num_partitions, part_shares=None, weights=None,
+                     restream_passes=STREAM_RESTREAM_PASSES, imbalance=1.05,
+                     chunk_size=1 << 12, vote_rounds=4):
+    """
+    Streaming (LDG-style) partitioning over the link chunks of graph (a TopoGraph, TopoStream or
+    MaskedTopoStream) in memory proportional to the node count. Nodes are assigned on their first
+    chunk: to the part most of their already assigned peers in the chunk are in, discounted by how
+    full it is (over up to vote_rounds rounds), or else to the part the rest of the chunk went to. Every restreaming pass
+    then finds the majority part of each node's neighbors (Boyer-Moore vote over the stream),
+    counts the links to it, and moves about half of the nodes that gain, balancing the moves
+    between every two parts. The best partition seen is kept.
+    """
+    node_num = graph.node_num
+    if num_partitions == 1:
+        return np.zeros(node_num, dtype=np.int32)
+    weights = np.ones(node_num, dtype=np.int64) if weights is None else np.asarray(weights, dtype=np.int64)
+    shares = np.full(num_partitions, 1 / num_partitions) if part_shares is None else \
+        np.asarray(part_shares, dtype=np.float64) / np.sum(part_shares)
+    targets = shares * weights.sum()
+    capacities = imbalance * targets + weights.max()
+
+    # One-pass assignment
+    parts = np.full(node_num, -1, dtype=np.int32)
+    sizes = np.zeros(num_partitions, dtype=np.float64)
+    for edge_src, edge_dst in graph.iter_edge_chunks(chunk_size):
+        u, v = _both_directions(edge_src, edge_dst)
+        # Nodes assigned in a vote round may in turn give their part to their peers in the next one
+        chunk_votes = np.zeros(num_partitions, dtype=np.float64)
+        for _ in range(vote_rounds):
+            voting = (parts[u] < 0) & (parts[v] >= 0)
+            if not voting.any():
+                break
+            keys, counts = np.unique(
+                u[voting].astype(np.int64) * num_partitions + parts[v[voting]], return_counts=True)
+            nodes, to_parts = keys // num_partitions, (keys % num_partitions).astype(np.int32)
+            scores = counts * (1 - sizes[to_parts] / capacities[to_parts])
+            order = np.lexsort((-scores, nodes))
+            nodes, to_parts, scores = nodes[order], to_parts[order], scores[order]
+            best = np.concatenate([[True], nodes[1:] != nodes[:-1]]) & (scores > 0)
+            nodes, to_parts = nodes[best], to_parts[best]
+            fits = _within_capacity(nodes, to_parts, weights, sizes, capacities)
+            nodes, to_parts = nodes[fits], to_parts[fits]
+            if len(nodes) == 0:
+                break
+            parts[nodes] = to_parts
+            assigned = np.bincount(to_parts, weights=weights[nodes], minlength=num_partitions)
+            sizes += assigned
+            chunk_votes += assigned
+        pending = parts[u] < 0
+        if pending.any():
+            seeds, first_index = np.unique(u[pending], return_index=True)
+            seeds = seeds[np.argsort(first_index, kind="stable")]
+            # The rest of the chunk joins the part most of it went to, as links in a chunk are mostly local
+            parts[seeds] = _fill_parts(weights[seeds], sizes, targets, capacities, chunk_votes)
+            sizes += np.bincount(parts[seeds], weights=weights[seeds], minlength=num_partitions)
+    # Nodes without links (none in a topology read from file)
+    unassigned = np.flatnonzero(parts < 0)
+    if len(unassigned) > 0:
+        parts[unassigned] = _fill_parts(weights[unassigned], sizes, targets, capacities)
+        sizes += np.bincount(parts[unassigned], weights=weights[unassigned], minlength=num_partitions)
+
+    # Restreaming
+    best_parts, best_cut = parts.copy(), None
+    rng = np.random.default_rng(0)
+    for restream_pass in range(restream_passes):
+        # Majority part among the neighbors of every node
+        candidates = np.full(node_num, -1, dtype=np.int32)
+        votes = np.zeros(node_num, dtype=np.int64)
+        for edge_src, edge_dst in graph.iter_edge_chunks(chunk_size):
+            u, v = _both_directions(edge_src, edge_dst)
+            if len(u) == 0:
+                continue
+            keys, counts = np.unique(u.astype(np.int64) * num_partitions + parts[v], return_counts=True)
+            nodes, peer_parts = keys // num_partitions, (keys % num_partitions).astype(np.int32)
+            order = np.lexsort((-counts, nodes))
+            nodes, peer_parts, counts = nodes[order], peer_parts[order], counts[order]
+            first = np.concatenate([[True], nodes[1:] != nodes[:-1]])
+            nodes, peer_parts, counts = nodes[first], peer_parts[first], counts[first]
+            same = candidates[nodes] == peer_parts
+            replace = ~same & (counts > votes[nodes])
+            votes[nodes] = np.where(same, votes[nodes] + counts, np.abs(votes[nodes] - counts))
+            candidates[nodes[replace]] = peer_parts[replace]
+
+        # Links of every node to its own part and to its majority part, and the cut
+        own_links = np.zeros(node_num, dtype=np.int64)
+        candidate_links = np.zeros(node_num, dtype=np.int64)
+        cut = 0
+        for edge_src, edge_dst in graph.iter_edge_chunks(chunk_size):
+            cut += int(np.count_nonzero(parts[edge_src] != parts[edge_dst]))
+            u, v = _both_directions(edge_src, edge_dst)
+            np.add.at(own_links, u[parts[v] == parts[u]], 1)
+            np.add.at(candidate_links, u[parts[v] == candidates[u]], 1)
+        if best_cut is None or cut < best_cut:
+            best_parts, best_cut = parts.copy(), cut
+
+        gains = candidate_links - own_links
+        movable = (candidates >= 0) & (candidates != parts) & (gains > 0)
+        # Every node moves with probability 1/2, so that neighbors do not swap back and forth
+        movable &= rng.random(node_num) < 0.5
+        nodes = np.flatnonzero(movable)
+        nodes = nodes[np.argsort(-gains[nodes], kind="stable")]
+        fits = _within_exchange(parts[nodes], candidates[nodes], weights[nodes], sizes, capacities)
+        nodes = nodes[fits]
+        if len(nodes) == 0:
+            break
+        sizes -= np.bincount(parts[nodes], weights=weights[nodes], minlength=num_partitions)
+        sizes += np.bincount(candidates[nodes], weights=weights[nodes], minlength=num_partitions)
+        parts[nodes] = candidates[nodes]
+
+    if best_cut is not None and _count_cut(graph, parts, chunk_size) > best_cut:
+        parts = best_parts
+    return parts
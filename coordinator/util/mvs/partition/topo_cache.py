@@ -0,0 +1,91 @@
+import os
+import struct
+import hashlib
+import numpy as np
+from .graph import TopoGraph
+
+# Binary companion of a text topology file:
+#   header | edge_src (int32 * edge_num) | edge_dst (int32 * edge_num) | '\n'-joined node names
+# The header records the SHA-256 of the text file it was built from.
+TOPO_CACHE_SUFFIX = ".tbin"
+TOPO_CACHE_MAGIC = b"SNTOPO\x00\x00"
+TOPO_CACHE_VERSION = 1
+TOPO_CACHE_HEADER = struct.Struct("<8sI32sqqq")
+
+
+def get_topo_cache_filepath(topo_filepath):
+    return os.path.splitext(topo_filepath)[0] + TOPO_CACHE_SUFFIX
+
+
+def hash_topo_file(topo_filepath, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(topo_filepath, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.digest()
+
+
+def load_cached_graph(cache_filepath, digest):
+    """Memory-maps a cached graph, returns None if it is missing, corrupted or built from other content."""
+    cached = load_cached_edges(cache_filepath, digest)
+    if cached is None:
+        return None
+    return TopoGraph(*cached)
+
+
+def load_cached_edges(cache_filepath, digest):
+    """Returns the node names and the memory-mapped links (edge_src, edge_dst) of a cached graph, or None."""
+    try:
+        with open(cache_filepath, 'rb') as f:
+            header = f.read(TOPO_CACHE_HEADER.size)
+            if len(header) != TOPO_CACHE_HEADER.size:
+                return None
+            magic, version, cached_digest, node_num, edge_num, names_size = \
+                TOPO_CACHE_HEADER.unpack(header)
+            if magic != TOPO_CACHE_MAGIC or version != TOPO_CACHE_VERSION or cached_digest != digest:
+                return None
+            names_offset = TOPO_CACHE_HEADER.size + 8 * edge_num
+            if os.fstat(f.fileno()).st_size != names_offset + names_size:
+                return None
+            f.seek(names_offset)
+            names = f.read(names_size).decode().split('\n') if node_num > 0 else []
+    except OSError:
+        return None
+    if len(names) != node_num:
+        return None
+
+    if edge_num > 0:
+        edges = np.memmap(cache_filepath, dtype='<i4', mode='r',
+                          offset=TOPO_CACHE_HEADER.size, shape=(2, edge_num))
+        edge_src, edge_dst = edges[0], edges[1]
+    else:
+        edge_src = edge_dst = np.zeros(0, dtype=np.int32)
+    return names, edge_src, edge_dst
+
+
+def save_cached_graph(cache_filepath, graph, digest):
+    """Writes the graph next to its text topology, atomically so that concurrent runs never see a partial file."""
+    save_cached_edges(cache_filepath, graph.names, graph.edge_src, graph.edge_dst, digest)
+
+
+def save_cached_edges(cache_filepath, names, edge_src, edge_dst, digest, chunk_size=1 << 20):
+    """Writes a graph given as names and link arrays (possibly memory-mapped) chunk by chunk, atomically."""
+    names_blob = '\n'.join(names).encode()
+    tmp_filepath = f"{cache_filepath}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_filepath, 'wb') as f:
+            f.write(TOPO_CACHE_HEADER.pack(
+                TOPO_CACHE_MAGIC, TOPO_CACHE_VERSION, digest,
+                len(names), len(edge_src), len(names_blob)))
+            for edges in (edge_src, edge_dst):
+                for start in range(0, len(edges), chunk_size):
+                    f.write(np.ascontiguousarray(edges[start:start + chunk_size], dtype='<i4').tobytes())
+            f.write(names_blob)
+        os.replace(tmp_filepath, cache_filepath)
+    except OSError as e:
+        print(f"Failed to write topology cache {cache_filepath}: {e}")
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
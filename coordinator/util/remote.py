@@ -1,8 +1,87 @@
 import os
+import time
+import uuid
+import shlex
+import select
+import threading
+import subprocess
 import paramiko
 from scp import SCPClient
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+# Seconds between keepalive packets on idle SSH transports, so that dead peers are noticed
+# and NAT/firewall state of long idle connections is not dropped
+SSH_KEEPALIVE_INTERVAL = 30
+# Bytes read from a channel at once
+SSH_RECV_SIZE = 1 << 15
+
+
+def build_remote_command(command, working_dir, password, output_file=None, use_sudo=False):
+    """
+    Wraps command to run in working_dir, optionally with its output redirected to output_file on the
+    remote machine, and optionally with sudo (the password is provided via stdin of sudo -S).
+    """
+    if use_sudo:
+        command = f"echo {password} | sudo -E -S {command}"
+    if output_file:
+        return f"cd {working_dir} && {command} > {output_file} 2>&1"
+    return f"cd {working_dir} && {command}"
+
+
+def build_killable_command(command, pid_filepath):
+    """
+    Runs command in its own session (so in its own process group), with its pid in pid_filepath on
+    the remote machine, so that the whole group can be killed with build_kill_command.
+    """
+    # The pid is written from inside the new session, as setsid may fork; -w passes on the exit status
+    session_command = f"echo $$ > {pid_filepath}; exec sh -c {shlex.quote(command)}"
+    return f"setsid -w sh -c {shlex.quote(session_command)}; status=$?; rm -f {pid_filepath}; exit $status"
+
+
+def build_kill_command(pid_filepath, password):
+    """Kills the process group of a command started by build_killable_command, as root if sudo allows."""
+    kill_command = f"kill -TERM -$(cat {pid_filepath})"
+    return f"{build_remote_command(kill_command, '/tmp', password, use_sudo=True)} 2> /dev/null || " \
+        f"{kill_command}; rm -f {pid_filepath}"
+
+
+def get_remote_pid_filepath():
+    return f"/tmp/.splitnn-{uuid.uuid4().hex}.pid"
+
+
+def build_archive_command(remote_paths):
+    """
+    Command writing one archive of remote_paths to stdout, compressed with zstd (gzip if the remote
+    machine has no zstd). Every path is archived under its base name, as scp would place it.
+    """
+    tar_args = ' '.join(
+        f"-C {shlex.quote(os.path.dirname(remote_path) or '.')} {shlex.quote(os.path.basename(remote_path))}"
+        for remote_path in remote_paths)
+    return f"tar -cf - {tar_args} | " \
+        "if command -v zstd > /dev/null; then zstd -q -c -T0; else gzip -c -1; fi"
+
+
+def get_extract_command(local_dir, magic):
+    """Local tar command extracting an archive stream into local_dir, given the first bytes of the stream."""
+    # zstd frames start with 28 b5 2f fd, gzip streams with 1f 8b
+    compress_option = "--zstd" if magic.startswith(b"\x28\xb5\x2f\xfd") else "--gzip"
+    return ["tar", compress_option, "-x", "-f", "-", "-C", local_dir]
+
+
+def parse_command_info(command_info):
+    """
+    Parses a (command, working_dir[, output_file[, use_sudo]]) tuple of the dict-of-commands API.
+    Returns (command, working_dir, output_file, use_sudo).
+    """
+    if len(command_info) == 4:
+        return command_info
+    elif len(command_info) == 3:
+        command, working_dir, output_file = command_info
+        return command, working_dir, output_file, False
+    command, working_dir = command_info
+    return command, working_dir, None, False
+
+
 class RemoteMachine:
     def __init__(self, hostname, username, password, port=22, working_dir='/tmp'):
         self.hostname = hostname
@@ -22,13 +101,33 @@ class RemoteMachine:
             self.ssh = paramiko.SSHClient()
             self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
             self.ssh.connect(self.hostname, port=self.port, username=self.username, password=self.password)
+            self.ssh.get_transport().set_keepalive(SSH_KEEPALIVE_INTERVAL)
             self.scp = SCPClient(self.ssh.get_transport())
             print(f"Connected to {self.hostname}")
         except Exception as e:
             print(f"Failed to connect to {self.hostname}: {str(e)}")
+            self.ssh.close()
+            self.ssh, self.scp = None, None
             return None
         return self
 
+    def is_connected(self):
+        if self.ssh is None:
+            return False
+        transport = self.ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+    def ensure_connected(self):
+        """
+        Reconnects if the connection was dropped. Returns self, or None if reconnecting failed.
+        """
+        if self.is_connected():
+            return self
+        if self.ssh is not None:
+            print(f"Connection to {self.hostname} was dropped, reconnecting...")
+            self.close_connection()
+        return self.connect()
+
     def execute_command(self, command, output_file=None, use_sudo=False):
         """
         Executes a command on the remote machine.
@@ -38,42 +137,114 @@ class RemoteMachine:
         :param command: The command to execute.
         :param output_file: Path to the file on the remote machine where stdout should be redirected.
         :param use_sudo: If True, the command will be executed with sudo privileges.
+        :return: (exit_status, stdout) of the command, the exit status is None if it could not be run.
         """
-        if self.ssh is None:
+        if self.ensure_connected() is None:
             print("Not connected to any remote machine.")
-            return None
+            return None, ""
 
         try:
-            # If sudo is needed, prepend the command with sudo -S and provide the password via stdin
-            if use_sudo:
-                if output_file:
-                    full_command = f"cd {self.working_dir} && echo {self.password} | sudo -E -S {command} > {output_file} 2>&1"
-                else:
-                    full_command = f"cd {self.working_dir} && echo {self.password} | sudo -E -S {command}"
-            else:
-                if output_file:
-                    full_command = f"cd {self.working_dir} && {command} > {output_file} 2>&1"
-                else:
-                    full_command = f"cd {self.working_dir} && {command}"
+            full_command = build_remote_command(command, self.working_dir, self.password, output_file, use_sudo)
 
-            stdin, stdout, stderr = self.ssh.exec_command(full_command)
-
-            # Capture stderr for any potential errors
-            errors = stderr.read().decode()
+            # Read stdout and stderr as they come, so that neither pipe fills up on the remote side
+            outputs = {"stdout": [], "stderr": []}
+            exit_status = self.run_channel(full_command, lambda stream, data: outputs[stream].append(data))
+            errors = b"".join(outputs["stderr"]).decode(errors="replace")
+            if exit_status != 0:
+                print(f"Command exited with status {exit_status}: {full_command}")
 
             if errors and not errors.startswith("[sudo]"):
                 print(f"Stderr outputs when executing {full_command}")
                 print(f"Stderr:\n{errors}\n")
-            else:
-                if output_file:
-                    print(f"Command output has been redirected to {output_file}")
-                else:
-                    output = stdout.read().decode()
-                    return output
+            elif output_file:
+                print(f"Command output has been redirected to {output_file}")
+            return exit_status, b"".join(outputs["stdout"]).decode(errors="replace")
         except Exception as e:
             print(f"Failed to execute command: {str(e)}")
+            return None, ""
+
+
+    def run_channel(self, full_command, on_data, timeout=None):
+        """
+        Runs full_command on a new channel, passing the stdout and stderr data to on_data(stream, data)
+        as it arrives. Returns the exit status, or None if the command timed out. A timed out command
+        is killed with its whole process group, as closing the channel does not stop it.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        if timeout is not None:
+            pid_filepath = get_remote_pid_filepath()
+            full_command = build_killable_command(full_command, pid_filepath)
+        channel = self.ssh.get_transport().open_session()
+        try:
+            channel.exec_command(full_command)
+            while True:
+                select.select([channel], [], [], 0.5)
+                while channel.recv_ready():
+                    on_data("stdout", channel.recv(SSH_RECV_SIZE))
+                while channel.recv_stderr_ready():
+                    on_data("stderr", channel.recv_stderr(SSH_RECV_SIZE))
+                if channel.exit_status_ready() and (channel.eof_received or channel.closed) and \
+                        not channel.recv_ready() and not channel.recv_stderr_ready():
+                    return channel.recv_exit_status()
+                if deadline is not None and time.time() > deadline:
+                    self.kill_remote_process_group(pid_filepath)
+                    return None
+        finally:
+            channel.close()
+
+    def kill_remote_process_group(self, pid_filepath):
+        channel = self.ssh.get_transport().open_session()
+        try:
+            channel.exec_command(build_kill_command(pid_filepath, self.password))
+            channel.recv_exit_status()
+        finally:
+            channel.close()
+
+    def execute_command_streaming(self, command, log_filepath=None, use_sudo=False, line_callback=None,
+                                  timeout=None):
+        """
+        Executes a command on the remote machine, writing its stdout and stderr lines to log_filepath
+        (stderr lines prefixed with [stderr]) and passing them to line_callback(hostname, stream, line)
+        as they arrive.
+
+        :param timeout: Seconds after which the command is given up (None to wait forever).
+        :return: The exit status of the command, None if it timed out or could not be run.
+        """
+        if self.ensure_connected() is None:
+            print("Not connected to any remote machine.")
             return None
 
+        full_command = build_remote_command(command, self.working_dir, self.password, None, use_sudo)
+        buffers = {"stdout": b"", "stderr": b""}
+        log_file = open(log_filepath, 'w', buffering=1) if log_filepath else None
+
+        def emit(stream, line):
+            line = line.decode(errors="replace")
+            if log_file:
+                log_file.write(f"{line}\n" if stream == "stdout" else f"[stderr] {line}\n")
+            if line_callback:
+                line_callback(self.hostname, stream, line)
+
+        def on_data(stream, data):
+            lines = (buffers[stream] + data).split(b"\n")
+            buffers[stream] = lines.pop()
+            for line in lines:
+                emit(stream, line)
+
+        try:
+            exit_status = self.run_channel(full_command, on_data, timeout)
+            for stream, rest in buffers.items():
+                if rest:
+                    emit(stream, rest)
+        except Exception as e:
+            print(f"Failed to execute command: {str(e)}")
+            return None
+        finally:
+            if log_file:
+                log_file.close()
+        if exit_status is None:
+            print(f"Command timed out after {timeout}s on {self.hostname}: {full_command}")
+        return exit_status
 
     # def send_file(self, local_file_path, remote_file_path):
     #     """
@@ -121,7 +292,7 @@ class RemoteMachine:
         :param remote_path: Path on the remote machine.
         :param recursive: Set to True to send a directory.
         """
-        if self.scp is None:
+        if self.ensure_connected() is None:
             print("Not connected to any remote machine.")
             return None
         try:
@@ -139,7 +310,7 @@ class RemoteMachine:
         :param local_path: Path where the file/directory should be saved on the local machine.
         :param recursive: Set to True to receive a directory.
         """
-        if self.scp is None:
+        if self.ensure_connected() is None:
             print("Not connected to any remote machine.")
             return None
         try:
@@ -149,6 +320,54 @@ class RemoteMachine:
             print(f"Failed to receive {remote_path}: {str(e)}")
             return None
 
+    def receive_paths(self, remote_paths, local_dir):
+        """
+        Receives files and directories from the remote machine into local_dir as one compressed
+        archive stream over a single channel, extracted locally while it is being received.
+
+        :param remote_paths: Paths of files or directories on the remote machine.
+        :return: True if all paths were received, None otherwise.
+        """
+        if self.ensure_connected() is None:
+            print("Not connected to any remote machine.")
+            return None
+
+        os.makedirs(local_dir, exist_ok=True)
+        extractor, magic, errors = None, b"", []
+
+        def on_data(stream, data):
+            nonlocal extractor, magic
+            if stream == "stderr":
+                errors.append(data)
+                return
+            if extractor is None:
+                # Wait for the magic number to choose the decompressor
+                magic += data
+                if len(magic) < 4:
+                    return
+                extractor = subprocess.Popen(get_extract_command(local_dir, magic), stdin=subprocess.PIPE)
+                data, magic = magic, b""
+            extractor.stdin.write(data)
+
+        try:
+            exit_status = self.run_channel(build_archive_command(remote_paths), on_data)
+        except Exception as e:
+            print(f"Failed to receive {remote_paths}: {str(e)}")
+            exit_status = None
+        finally:
+            if extractor is not None:
+                extractor.stdin.close()
+                extractor.wait()
+        errors = b''.join(errors).decode(errors="replace").strip()
+        if exit_status != 0 or extractor is None or extractor.returncode != 0:
+            print(f"Failed to receive {remote_paths} from {self.hostname}: {errors}")
+            return None
+        if errors:
+            # e.g. a missing path, the other paths are still received
+            print(f"Stderr outputs when receiving {remote_paths} from {self.hostname}:\n{errors}")
+        print(f"{remote_paths} successfully received and saved to {local_dir}")
+        return True
+
     def close_connection(self):
         """
         Closes the connection to the remote machine.
@@ -159,9 +378,55 @@ class RemoteMachine:
             self.scp.close()
         if self.ssh:
             self.ssh.close()
+        self.ssh, self.scp = None, None
         print(f"Connection to {self.hostname} closed.")
 
 
+class ConnectionPool:
+    """
+    SSH connections kept open across tests, one per host. Connecting to a host that is already
+    in the pool reuses its connection, and only reconnects if the connection was dropped.
+    """
+    def __init__(self):
+        self.machines = {}
+        self.lock = threading.Lock()
+
+    def get_machine(self, hostname, username, password, port=22):
+        """Returns the connected RemoteMachine of hostname, or None if connecting failed."""
+        with self.lock:
+            machine = self.machines.get(hostname)
+            if machine is None or (machine.username, machine.password, machine.port) != (username, password, port):
+                if machine is not None:
+                    machine.close_connection()
+                machine = RemoteMachine(hostname, username, password, port)
+                self.machines[hostname] = machine
+        return machine.ensure_connected()
+
+    def close(self, hostnames=None):
+        """Closes and forgets the connections to hostnames (all hosts if None)."""
+        with self.lock:
+            if hostnames is None:
+                hostnames = list(self.machines)
+            machines = [self.machines.pop(hostname) for hostname in hostnames if hostname in self.machines]
+        for machine in machines:
+            machine.close_connection()
+
+
+# Connections shared by all tests of a run
+connection_pool = ConnectionPool()
+
+
+def connect_remote_machines(machine_config_list, pool=connection_pool):
+    """
+    Connects to all machines of machine_config_list concurrently through pool, reusing the live
+    connections of the pool. Returns the RemoteMachine of each machine, None for the failed ones.
+    """
+    with ThreadPoolExecutor(max_workers=max(len(machine_config_list), 1)) as executor:
+        return list(executor.map(
+            lambda mach: pool.get_machine(mach["ipAddr"], mach["user"], mach["password"]),
+            machine_config_list))
+
+
 def execute_command_on_multiple_machines(machines, commands):
     """
     Executes commands concurrently on multiple machines, with each command executed in its own working directory.
@@ -170,6 +435,8 @@ def execute_command_on_multiple_machines(machines, commands):
     :param machines: A list of RemoteMachine objects.
     :param commands: A dictionary where the key is the machine hostname and the value is a tuple:
                      (command, working_directory, output_file, use_sudo).
+    :return: A dictionary of (exit_status, stdout) of each machine, the exit status is None if the command
+             could not be run.
     """
     def execute_on_machine(machine, command, working_dir, output_file=None, use_sudo=False):
         # Change the working directory before executing the command
@@ -182,17 +449,8 @@ def execute_command_on_multiple_machines(machines, commands):
         future_to_machine = {}
         for machine in machines:
             if machine.hostname in commands:
-                command_info = commands[machine.hostname]
-                
                 # Parse the command tuple, which now includes the use_sudo flag
-                if len(command_info) == 4:
-                    command, working_dir, output_file, use_sudo = command_info
-                elif len(command_info) == 3:
-                    command, working_dir, output_file = command_info
-                    use_sudo = False
-                else:
-                    command, working_dir = command_info
-                    output_file, use_sudo = None, False
+                command, working_dir, output_file, use_sudo = parse_command_info(commands[machine.hostname])
 
                 future_to_machine[executor.submit(execute_on_machine, machine, command, working_dir, output_file, use_sudo)] = machine
 
@@ -200,16 +458,43 @@ def execute_command_on_multiple_machines(machines, commands):
         for future in as_completed(future_to_machine):
             machine = future_to_machine[future]
             try:
-                result = future.result()
-                if result:
-                    results[machine.hostname] = result
-                else:
-                    if isinstance(commands[machine.hostname], tuple) and len(commands[machine.hostname]) >= 3:
-                        results[machine.hostname] = f"Output redirected to {commands[machine.hostname][2]}"
-                    else:
-                        results[machine.hostname] = "Command executed successfully"
+                results[machine.hostname] = future.result()
             except Exception as e:
-                results[machine.hostname] = f"Error: {str(e)}"
+                print(f"Failed to execute command on {machine.hostname}: {str(e)}")
+                results[machine.hostname] = (None, "")
+
+    return results
+
+
+def stream_command_on_multiple_machines(machines, commands, log_dir=None, line_callback=None, timeout=None):
+    """
+    Executes commands concurrently on multiple machines, streaming the output of each machine into
+    <log_dir>/<hostname>.log and to line_callback(hostname, stream, line), which must be thread-safe.
+
+    :param commands: A dictionary where the key is the machine hostname and the value is a tuple:
+                     (command, working_directory, output_file, use_sudo).
+    :return: A dictionary of the exit status of each machine, None if the command timed out or could not be run.
+    """
+    def stream_on_machine(machine, command, working_dir, use_sudo):
+        machine.working_dir = working_dir
+        log_filepath = os.path.join(log_dir, f"{machine.hostname}.log") if log_dir else None
+        return machine.execute_command_streaming(command, log_filepath, use_sudo, line_callback, timeout)
+
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(len(machines), 1)) as executor:
+        future_to_machine = {}
+        for machine in machines:
+            if machine.hostname in commands:
+                command, working_dir, output_file, use_sudo = parse_command_info(commands[machine.hostname])
+                if output_file:
+                    command = f"{command} > {output_file} 2>&1"
+                future_to_machine[executor.submit(
+                    stream_on_machine, machine, command, working_dir, use_sudo)] = machine
+
+        for future in as_completed(future_to_machine):
+            results[future_to_machine[future].hostname] = future.result()
 
     return results
 
@@ -283,3 +568,33 @@ def receive_file_from_multiple_machines(machines, file_paths):
                 results[machine.hostname] = f"Error: {str(e)}"
 
     return results
+
+
+def receive_paths_from_multiple_machines(machines, path_lists):
+    """
+    Receives several files and directories from each of multiple machines concurrently,
+    with one compressed archive stream per machine.
+
+    :param machines: A list of RemoteMachine objects.
+    :param path_lists: A dictionary where the key is the machine hostname and the value is a tuple:
+                       (list of remote paths, local directory).
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(len(machines), 1)) as executor:
+        future_to_machine = {
+            executor.submit(machine.receive_paths, *path_lists[machine.hostname]): machine
+            for machine in machines if machine.hostname in path_lists
+        }
+
+        # Collect results as they complete
+        for future in as_completed(future_to_machine):
+            machine = future_to_machine[future]
+            try:
+                if future.result():
+                    results[machine.hostname] = f"Files received successfully from {machine.hostname}"
+                else:
+                    results[machine.hostname] = f"Error: failed to receive files from {machine.hostname}"
+            except Exception as e:
+                results[machine.hostname] = f"Error: {str(e)}"
+
+    return results
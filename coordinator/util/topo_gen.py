@@ -0,0 +1,123 @@
+import numpy as np
+
+################################################################
+# Vectorized topology generators                               #
+#                                                              #
+# Each generator returns (node_num, edge_src, edge_dst) with   #
+# 0-based node ids; node i is named str(i + 1). Links come out #
+# in the same order as scripts/topo/generate_<type>_topo.py    #
+# writes them, so the written files are identical.             #
+################################################################
+
+def _edges(src, dst):
+    return np.asarray(src, dtype=np.int32).ravel(), np.asarray(dst, dtype=np.int32).ravel()
+
+
+def generate_isolated_edges(n):
+    n = int(n)
+    return (n,) + _edges([], [])
+
+
+def generate_sudoisolated_edges(l, n):
+    l, n = int(l), int(n)
+    return (n + 2,) + _edges(np.zeros(l), np.ones(l))
+
+
+def generate_pairs_edges(n):
+    n = int(n)
+    ids = np.arange(n)
+    return (2 * n,) + _edges(2 * ids, 2 * ids + 1)
+
+
+def generate_chain_edges(n):
+    n = int(n)
+    ids = np.arange(max(n - 1, 0))
+    return (n,) + _edges(ids, ids + 1)
+
+
+def generate_star_edges(n):
+    n = int(n)
+    return (n,) + _edges(np.zeros(max(n - 1, 0)), np.arange(1, n))
+
+
+def generate_fullmesh_edges(n):
+    n = int(n)
+    rows, cols = np.tril_indices(n, -1)
+    return (n,) + _edges(cols, rows)
+
+
+def generate_trie_edges(n, k):
+    # Nodes are numbered in BFS order of a complete k-ary tree
+    n, k = int(n), int(k)
+    children = np.arange(1, max(n, 1))
+    return (n,) + _edges(children, (children - 1) // k)
+
+
+def generate_grid_edges(x, y):
+    # Toroidal grid: every node links to its right and bottom neighbors, wrapping around
+    x, y = int(x), int(y)
+    ids = np.arange(x * y)
+    i, j = ids // y, ids % y
+    neighbors = []
+    if y > 1:
+        neighbors.append(i * y + (j + 1) % y)
+    if x > 1:
+        neighbors.append(((i + 1) % x) * y + j)
+    if not neighbors:
+        return (x * y,) + _edges([], [])
+    neighbors = np.stack(neighbors, axis=1)
+    src = np.repeat(ids, neighbors.shape[1])
+    return (x * y,) + _edges(src, neighbors)
+
+
+def generate_clos_edges(k):
+    # Leaves and spines of each pod, then superspines, then clients of each leaf
+    k = int(k)
+    p, h = k, k // 2
+    pods, ports = np.arange(p), np.arange(h)
+    leaf = lambda pod, l: pod * 2 * h + l
+    spine = lambda pod, s: pod * 2 * h + h + s
+    superspine = lambda ss: p * 2 * h + ss
+    client = lambda pod, l, c: p * 2 * h + h * h + (pod * h + l) * h + c
+    node_num = p * 2 * h + h * h + p * h * h
+
+    # Leaf to spine links for each pod
+    pod, l, s = np.meshgrid(pods, ports, ports, indexing='ij')
+    leaf_spine = (leaf(pod, l), spine(pod, s))
+    # Spine s of every pod links to superspines [s * h, (s + 1) * h)
+    pod, s, i = np.meshgrid(pods, ports, ports, indexing='ij')
+    spine_superspine = (spine(pod, s), superspine(s * h + i))
+    # Client to leaf links
+    pod, l, c = np.meshgrid(pods, ports, ports, indexing='ij')
+    client_leaf = (client(pod, l, c), leaf(pod, l))
+
+    src = np.concatenate([e[0].ravel() for e in (leaf_spine, spine_superspine, client_leaf)])
+    dst = np.concatenate([e[1].ravel() for e in (leaf_spine, spine_superspine, client_leaf)])
+    return (node_num,) + _edges(src, dst)
+
+
+topo_generators = {
+    "isolated": generate_isolated_edges,
+    "sudoisolated": generate_sudoisolated_edges,
+    "pairs": generate_pairs_edges,
+    "chain": generate_chain_edges,
+    "star": generate_star_edges,
+    "fullmesh": generate_fullmesh_edges,
+    "trie": generate_trie_edges,
+    "grid": generate_grid_edges,
+    "clos": generate_clos_edges,
+}
+
+
+def get_default_node_names(node_num):
+    return [str(i) for i in range(1, node_num + 1)]
+
+
+def write_topo_edges_to_file(filepath, names, edge_src, edge_dst, chunk_size=1 << 18):
+    """Bulk writer for the text topology format, formatting links chunk by chunk."""
+    with open(filepath, 'w') as f:
+        f.write(' '.join(names) + '\n')
+        for start in range(0, len(edge_src), chunk_size):
+            src_names = map(names.__getitem__, edge_src[start:start + chunk_size].tolist())
+            dst_names = map(names.__getitem__, edge_dst[start:start + chunk_size].tolist())
+            f.write(''.join(map("{} {}\n".format, src_names, dst_names)))
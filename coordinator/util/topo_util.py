@@ -1,6 +1,9 @@
 import os
 import json
-import subprocess
+import shutil
+from .topo_gen import *
+from .mvs.partition.graph import TopoGraph
+from .mvs.partition.fmt_util import read_graph_from_topo_file
 
 COORDINATOR_WORKDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
 AS_DATA_DIR = os.path.join(COORDINATOR_WORKDIR, "data")
@@ -25,19 +28,38 @@ def get_sub_topo_filename(topo_args, i):
     sub_topo_filename = '.'.join(splited_sub_topo_filename)
     return sub_topo_filename
 
-def generate_topo(topo, output_dir):
+def generate_topo(topo, output_dir, build_graph=True):
+    """
+    Generates the topology in-process and writes it into output_dir.
+    Returns the topology file path and the topology as a TopoGraph, so callers need not parse the file again
+    (None instead if build_graph is False, for callers that stream the file).
+    """
     topo_type = topo[0]
     full_topo_filename = get_full_topo_filename(topo)
     full_topo_filepath = os.path.join(output_dir, full_topo_filename)
-    generate_topo_type_script_path = os.path.join(COORDINATOR_WORKDIR, "scripts", "topo", f"generate_{topo_type}_topo.py")
+    if topo_type == "as":
+        with open(AS_TOPO_CONFIG_FILEPATH, 'r') as f:
+            as_topo_config = json.load(f)
+        try:
+            src_filepath = os.path.join(AS_DATA_DIR, as_topo_config[topo[1]])
+        except KeyError:
+            print(f"Invalid size: {topo[1]}")
+            exit(1)
+        shutil.copy(src_filepath, full_topo_filepath)
+        return full_topo_filepath, read_graph_from_topo_file(full_topo_filepath) if build_graph else None
+
     try:
-        generate_topology_cmd = \
-            ["python3", generate_topo_type_script_path] + topo[1:] + [full_topo_filepath]
-    except IndexError:
-        generate_topology_cmd = \
-            ["python3", generate_topo_type_script_path, full_topo_filepath]
-    result = subprocess.run(generate_topology_cmd, capture_output=True, text=True)
-    return full_topo_filepath
+        generate_edges = topo_generators[topo_type]
+    except KeyError:
+        print(f"Invalid topology type: {topo_type}")
+        exit(1)
+    node_num, edge_src, edge_dst = generate_edges(*topo[1:])
+    names = get_default_node_names(node_num)
+    write_topo_edges_to_file(full_topo_filepath, names, edge_src, edge_dst)
+    if not build_graph:
+        return full_topo_filepath, None
+    graph = TopoGraph.from_edges(names, edge_src, edge_dst, drop_isolated=True)
+    return full_topo_filepath, graph
 
 
 ###################################################################